@@ -25,7 +25,6 @@
 """
 
 import os
-import distro
 import logging
 import hashlib
 import base64
@@ -171,6 +170,7 @@ class Provenance:
         if self._mode == self.Mode.MAX:
             bd['internalParameters']['env'] = \
                 self._ctx.config.get_environment()
+        import distro
         b_versions = {
             'kas': KASVERSION,
             'distro.name': distro.id(),
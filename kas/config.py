@@ -25,11 +25,11 @@
 
 import os
 import json
-import copy
 from pathlib import Path
+from .configview import freeze
 from .repos import Repo
 from .includehandler import IncludeHandler
-from .kasusererror import ArtifactNotFoundError
+from .kasusererror import ArtifactNotFoundError, KasUserError
 from .configschema import CONFIGSCHEMA
 
 __license__ = 'MIT'
@@ -47,6 +47,7 @@ class Config:
         self._override_task = task
         self._build_dir = ctx.build_dir
         self.__config = {}
+        self.__frozen = None
         if not filename:
             filename = os.path.join(ctx.kas_work_dir, CONFIG_YAML_FILE)
 
@@ -55,7 +56,8 @@ class Config:
 
         update = ctx.args.update if hasattr(ctx.args, 'update') else False
 
-        self.handler = IncludeHandler(self.filenames, not update)
+        self.handler = IncludeHandler(self.filenames, not update,
+                                      ctx.config_cache_dir)
         self.repo_dict = {}
         self.repo_cfg_hashes = {}
 
@@ -71,21 +73,30 @@ class Config:
         """
         return self._config.get('build_system', '')
 
-    def find_missing_repos(self, repo_paths={}):
+    def find_missing_repos(self, repo_paths={}, readers=None):
         """
             Returns repos that are in config but not on disk and updates
-            the internal config dictionary.
+            the internal config dictionary. Files of repos that are not
+            checked out yet are read using the ``readers`` (see
+            :meth:`kas.includehandler.IncludeHandler.get_config`).
         """
         (self.__config, missing_repo_names) = \
-            self.handler.get_config(repos=repo_paths)
+            self.handler.get_config(repos=repo_paths, readers=readers)
+        self.__frozen = None
 
         return missing_repo_names
 
     def get_config(self, remove_includes=False, apply_overrides=False):
         """
-            Returns a copy of the config dict
+            Returns a read-only view of the config dict. Call ``mutable()``
+            on it to get a modifiable (copy-on-write) view.
         """
-        config = copy.deepcopy(self._config)
+        if self.__frozen is None:
+            self.__frozen = freeze(self._config)
+        config = self.__frozen
+        if not remove_includes and not apply_overrides:
+            return config
+        config = config.mutable()
         if remove_includes and 'includes' in config['header']:
             del config['header']['includes']
         if apply_overrides:
@@ -93,7 +104,7 @@ class Config:
             if overrides:
                 config.update(overrides)
                 del config['overrides']
-        return config
+        return freeze(config)
 
     def get_lockfiles(self):
         """
@@ -147,6 +158,71 @@ class Config:
         self.repo_cfg_hashes[encoded] = repo
         return repo
 
+    def get_pinned_repos(self, hints={}):
+        """
+            Returns the repos of the config loaded so far that are pinned
+            to a commit, e.g. by a lockfile. Repos that are only pinned by
+            an override but not configured yet are created from the
+            ``hints`` (url, type and path by repo name), if available.
+        """
+        repos_config = self.get_repos_config()
+        overrides = self._config.get('overrides', {}).get('repos', {})
+        repos = []
+        for name in dict.fromkeys([*repos_config, *overrides]):
+            config = repos_config.get(name) or {}
+            commit = (overrides.get(name) or {}).get('commit') \
+                or config.get('commit')
+            if not commit:
+                continue
+            if name in repos_config:
+                if not config.get('url'):
+                    continue
+                try:
+                    repo = self.get_repo(name)
+                except KasUserError:
+                    # not complete yet, will be fetched once it is needed
+                    continue
+            else:
+                repo = self._get_hinted_repo(name, hints.get(name),
+                                             {'commit': commit})
+                if not repo:
+                    continue
+            repos.append(repo)
+        return repos
+
+    def get_discovered_repos(self, hints):
+        """
+            Returns the repos that were used by the previous run of the
+            same configuration (``hints``, see :meth:`get_pinned_repos`)
+            but are not configured yet, e.g. as they are added by include
+            files of other repos. The repos are created with the revision
+            that was used by the previous run.
+        """
+        repos_config = self.get_repos_config()
+        repos = []
+        for (name, hint) in hints.items():
+            if name in repos_config:
+                continue
+            revision = {k: hint[k] for k in ['commit', 'branch', 'tag']
+                        if hint.get(k)}
+            if not revision:
+                continue
+            repo = self._get_hinted_repo(name, hint, revision)
+            if repo:
+                repos.append(repo)
+        return repos
+
+    @staticmethod
+    def _get_hinted_repo(name, hint, revision):
+        if not hint:
+            return None
+        config = {'url': hint['url'], 'type': hint.get('type', 'git'),
+                  'path': hint.get('path'), **revision}
+        try:
+            return Repo.factory(name, config, {}, None)
+        except KasUserError:
+            return None
+
     def _get_repo_dict(self):
         """
             Returns a dictionary containing the repositories with
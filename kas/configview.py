@@ -0,0 +1,141 @@
+# kas - setup tool for bitbake based projects
+#
+# Copyright (c) Siemens AG, 2025
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+    This module contains the read-only views of the kas configuration.
+
+    The merged configuration is frozen once and the same view is handed out
+    to all consumers. As the views are ``dict`` and ``list`` subclasses,
+    they can be serialized like the plain types. A consumer that needs to
+    modify the configuration calls ``mutable()``, which returns a
+    copy-on-write view: nested values are only copied when they are
+    accessed through it, all other parts stay shared.
+"""
+
+__license__ = 'MIT'
+__copyright__ = 'Copyright (c) Siemens AG, 2025'
+
+
+def _readonly(self, *args, **kwargs):
+    raise TypeError('The configuration is read-only, '
+                    'use mutable() to get a modifiable copy')
+
+
+class FrozenDict(dict):
+    """
+        A read-only dict. All nested dicts and lists are frozen as well.
+    """
+    __slots__ = ()
+
+    __setitem__ = __delitem__ = __ior__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return thaw(self)
+
+    def __reduce__(self):
+        return (FrozenDict, (dict(self),))
+
+    def mutable(self):
+        """
+            Returns a copy-on-write view of this dict.
+        """
+        return MutableDict(self)
+
+
+class FrozenList(list):
+    """
+        A read-only list. All nested dicts and lists are frozen as well.
+    """
+    __slots__ = ()
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _readonly
+    append = clear = extend = insert = pop = remove = _readonly
+    reverse = sort = _readonly
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return thaw(self)
+
+    def __reduce__(self):
+        return (FrozenList, (list(self),))
+
+    def mutable(self):
+        """
+            Returns a modifiable copy of this list. Nested values are
+            copy-on-write views.
+        """
+        return [_writable(v) for v in self]
+
+
+class MutableDict(dict):
+    """
+        A dict that replaces its frozen values by copy-on-write views when
+        they are accessed.
+    """
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        if isinstance(value, (FrozenDict, FrozenList)):
+            value = _writable(value)
+            super().__setitem__(key, value)
+        return value
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+
+def _writable(value):
+    if isinstance(value, (FrozenDict, FrozenList)):
+        return value.mutable()
+    return value
+
+
+def freeze(value):
+    """
+        Returns a read-only view of the value. Parts that are already frozen
+        are shared with the result.
+    """
+    if isinstance(value, (FrozenDict, FrozenList)):
+        return value
+    if isinstance(value, dict):
+        return FrozenDict((k, freeze(v)) for (k, v) in value.items())
+    if isinstance(value, list):
+        return FrozenList(freeze(v) for v in value)
+    return value
+
+
+def thaw(value):
+    """
+        Returns a deep copy of the value that only consists of plain dicts
+        and lists.
+    """
+    if isinstance(value, dict):
+        return {k: thaw(v) for (k, v) in value.items()}
+    if isinstance(value, list):
+        return [thaw(v) for v in value]
+    return value
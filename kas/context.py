@@ -23,20 +23,27 @@
     This module contains the implementation of the kas context.
 """
 
-import distro
 import os
+import re
 import logging
 from enum import Enum
 from kas.kasusererror import KasUserError
+from kas.scheduler import Scheduler, STATS_FILE, DEFAULT_JOBS, \
+    DEFAULT_HOST_JOBS
 from kas import __version__
 
 __context__ = None
 
+CONFIG_CACHE_DIR = '.kas_config_cache'
+# partial clone filters (see git rev-list --filter)
+CLONE_FILTER_RE = r'blob:none|blob:limit=\d+[kmg]?|tree:\d+'
+
 
 def get_distro_id_base():
     """
         Returns a compatible distro id.
     """
+    import distro
     return distro.like() or distro.id()
 
 
@@ -87,18 +94,72 @@ class Context:
         self.__kas_build_dir = os.path.abspath(build_dir)
         ref_dir = os.environ.get('KAS_REPO_REF_DIR', None)
         self.__kas_repo_ref_dir = os.path.abspath(ref_dir) if ref_dir else None
+        ref_max_age = os.environ.get('KAS_REPO_REF_MAX_AGE', '0')
+        if not ref_max_age.isdigit():
+            raise KasUserError('KAS_REPO_REF_MAX_AGE must be a number')
+        self.repo_ref_max_age = int(ref_max_age)
+        lock_timeout = os.environ.get('KAS_REF_LOCK_TIMEOUT', '3600')
+        if not lock_timeout.isdigit():
+            raise KasUserError('KAS_REF_LOCK_TIMEOUT must be a number')
+        self.repo_ref_lock_timeout = int(lock_timeout)
+        self.repo_ref_shared = \
+            os.environ.get('KAS_REPO_REF_SHARED', '0') == '1'
         clone_depth = os.environ.get('KAS_CLONE_DEPTH', '0')
         if not clone_depth.isdigit():
             raise KasUserError('KAS_CLONE_DEPTH must be a number')
         self.repo_clone_depth = max(int(clone_depth), 0)
+        clone_filter = getattr(args, 'clone_filter', None)
+        if clone_filter is None:
+            clone_filter = os.environ.get('KAS_CLONE_FILTER', '')
+        if clone_filter and not re.fullmatch(CLONE_FILTER_RE, clone_filter):
+            raise KasUserError('Unsupported clone filter (--clone-filter, '
+                               f'KAS_CLONE_FILTER): "{clone_filter}"')
+        self.repo_clone_filter = clone_filter or None
+        self.repo_sparse_checkout = \
+            os.environ.get('KAS_SPARSE_CHECKOUT', '0') == '1'
+        self.repo_clone_minimal = \
+            os.environ.get('KAS_CLONE_MINIMAL', '0') == '1'
+        fetch_jobs = getattr(args, 'jobs', None)
+        if fetch_jobs is None:
+            fetch_jobs = os.environ.get('KAS_FETCH_JOBS', DEFAULT_JOBS)
+        fetch_jobs = str(fetch_jobs)
+        if not fetch_jobs.isdigit() or int(fetch_jobs) < 1:
+            raise KasUserError('Number of fetch jobs (--jobs, KAS_FETCH_JOBS) '
+                               'must be a positive number')
+        self.fetch_jobs = int(fetch_jobs)
+        host_jobs = os.environ.get('KAS_FETCH_HOST_JOBS',
+                                   str(DEFAULT_HOST_JOBS))
+        if not host_jobs.isdigit() or int(host_jobs) < 1:
+            raise KasUserError('KAS_FETCH_HOST_JOBS must be a positive '
+                               'number')
+        self.fetch_host_jobs = int(host_jobs)
+        self.__scheduler = None
+        self.config_cache_dir = None
+        if os.environ.get('KAS_CONFIG_CACHE', '0') == '1':
+            self.config_cache_dir = os.path.join(self.__kas_work_dir,
+                                                 CONFIG_CACHE_DIR)
         self.setup_initial_environ()
         self.check_container_call()
         # Register the paths that kas created and exclusively owns
         self.managed_paths = set()
         if not os.environ.get('KAS_BUILD_DIR'):
             self.managed_paths.add(self.__kas_build_dir)
+        if self.config_cache_dir:
+            self.managed_paths.add(self.config_cache_dir)
         self.keyhandler = {}
         self.config = None
+        self.state = None
+        # VCS root paths by directory, see Repo.get_root_path
+        self.root_paths = {}
+        # background fetches by repo name, see libkas.repos_prefetch
+        self.prefetches = {}
+        self.prefetches_started = set()
+        # repo revisions fetched in this run, see Repo.fetch_async
+        self.fetched_repos = set()
+        # hosts that refused to fetch commits by SHA in this run
+        self.fetch_by_sha_refused = set()
+        # long-running helper processes, see libkas.get_batch_cmd
+        self.batch_cmds = {}
         self.args = args
 
     def setup_initial_environ(self):
@@ -181,6 +242,19 @@ class Context:
         """
         return self.__kas_repo_ref_dir
 
+    @property
+    def scheduler(self):
+        """
+            The scheduler for concurrent repository operations. Job
+            statistics are shared via the repo reference directory, if set.
+        """
+        if not self.__scheduler:
+            stats_dir = self.__kas_repo_ref_dir or self.__kas_build_dir
+            self.__scheduler = Scheduler(self.fetch_jobs,
+                                         self.fetch_host_jobs,
+                                         os.path.join(stats_dir, STATS_FILE))
+        return self.__scheduler
+
     @property
     def force_checkout(self):
         return getattr(self.args, 'force_checkout', None)
@@ -0,0 +1,347 @@
+# kas - setup tool for bitbake based projects
+#
+# Copyright (c) Siemens AG, 2025
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+    This module resolves the refs of git repositories without running git.
+
+    Only the plain on-disk layout is supported: loose refs, the
+    ``packed-refs`` file, gitfiles (``.git`` files of worktrees and
+    submodules) and alternate object directories. Annotated tags are peeled
+    using the peeled entries of ``packed-refs`` or by reading the tag
+    objects (loose or from a pack). In all other cases (e.g. the reftable
+    backend, revision expressions or abbreviated object ids), a
+    ``NotImplementedError`` is raised and the caller falls back to git.
+"""
+
+import os
+import re
+import struct
+import zlib
+
+__license__ = 'MIT'
+__copyright__ = 'Copyright (c) Siemens AG, 2025'
+
+# the order in which git looks up short ref names
+REF_RULES = ['{}', 'refs/{}', 'refs/tags/{}', 'refs/heads/{}',
+             'refs/remotes/{}', 'refs/remotes/{}/HEAD']
+# refs that are stored per worktree
+WORKTREE_REFS = ('refs/bisect/', 'refs/worktree/', 'refs/rewritten/')
+OBJECT_ID_RE = re.compile(r'[0-9a-f]{40}|[0-9a-f]{64}')
+ABBREV_OBJECT_ID_RE = re.compile(r'[0-9a-f]{4,63}')
+# characters that are only valid in revision expressions
+REVISION_EXPR_RE = re.compile(r'[\s~^:?*\[\\]|@\{|\.\.')
+PACK_TYPES = {1: 'commit', 2: 'tree', 3: 'blob', 4: 'tag'}
+OFS_DELTA = 6
+REF_DELTA = 7
+# recursion limit for symbolic refs, tags and alternates
+MAX_DEPTH = 5
+# git limits delta chains to 50 by default
+MAX_DELTA_DEPTH = 100
+
+
+def _read_text(path):
+    try:
+        with open(path, 'r') as f:
+            return f.read()
+    except (FileNotFoundError, NotADirectoryError, IsADirectoryError):
+        return None
+
+
+def _read_varint(data, pos):
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        shift += 7
+        if not byte & 0x80:
+            return (value, pos)
+
+
+def _apply_delta(base, delta):
+    """
+        Returns the object that results from applying the delta (as stored
+        in packs) to the base object.
+    """
+    (size, pos) = _read_varint(delta, 0)
+    if size != len(base):
+        raise NotImplementedError('Delta does not match its base')
+    (size, pos) = _read_varint(delta, pos)
+    result = bytearray()
+    while pos < len(delta):
+        op = delta[pos]
+        pos += 1
+        if op & 0x80:
+            # copy from the base: offset and size are stored in the bytes
+            # that are selected by the lower bits of the opcode
+            offset = length = 0
+            for i in range(4):
+                if op & (1 << i):
+                    offset |= delta[pos] << (8 * i)
+                    pos += 1
+            for i in range(3):
+                if op & (0x10 << i):
+                    length |= delta[pos] << (8 * i)
+                    pos += 1
+            result += base[offset:offset + (length or 0x10000)]
+        elif op:
+            result += delta[pos:pos + op]
+            pos += op
+        else:
+            raise NotImplementedError('Invalid delta opcode')
+    if len(result) != size:
+        raise NotImplementedError('Invalid delta')
+    return bytes(result)
+
+
+class GitRefReader:
+    """
+        Resolves refs of the git repository with the work tree ``path``.
+    """
+
+    def __init__(self, path):
+        gitdir = os.path.join(path, '.git')
+        if os.path.isfile(gitdir):
+            gitfile = _read_text(gitdir).strip()
+            if not gitfile.startswith('gitdir: '):
+                raise NotImplementedError(f'Invalid gitfile {gitdir}')
+            gitdir = os.path.join(path, gitfile[len('gitdir: '):])
+        elif not os.path.isdir(gitdir):
+            # e.g. a repo in a parent directory
+            raise NotImplementedError(f'No git directory in {path}')
+        self.gitdir = gitdir
+        commondir = _read_text(os.path.join(gitdir, 'commondir'))
+        self.commondir = os.path.join(gitdir, commondir.strip()) \
+            if commondir else gitdir
+        if any(os.path.exists(os.path.join(d, 'reftable'))
+               for d in [self.gitdir, self.commondir]):
+            raise NotImplementedError('Reftable repositories')
+        self._packed_refs = None
+        self._fully_peeled = False
+
+    def _get_packed_refs(self):
+        if self._packed_refs is not None:
+            return self._packed_refs
+        self._packed_refs = {}
+        content = _read_text(os.path.join(self.commondir, 'packed-refs'))
+        ref = None
+        for line in (content or '').splitlines():
+            if line.startswith('#'):
+                self._fully_peeled = 'fully-peeled' in line.split()
+            elif line.startswith('^') and ref:
+                self._packed_refs[ref] = (self._packed_refs[ref][0],
+                                          line[1:].strip())
+            elif line:
+                (oid, ref) = line.split(maxsplit=1)
+                self._packed_refs[ref] = (oid, None)
+        return self._packed_refs
+
+    def _read_ref(self, ref, depth=0):
+        """
+            Returns the object id of the ref, the peeled object id from
+            ``packed-refs`` (if known) and whether the ref is packed, or
+            None if the ref does not exist.
+        """
+        if depth > MAX_DEPTH:
+            raise NotImplementedError(f'Too many symbolic refs for {ref}')
+        basedir = self.commondir
+        if not ref.startswith('refs/') or ref.startswith(WORKTREE_REFS):
+            basedir = self.gitdir
+        content = _read_text(os.path.join(basedir, ref))
+        if content is not None:
+            content = content.strip()
+            if content.startswith('ref: '):
+                return self._read_ref(content[len('ref: '):], depth + 1)
+            if not OBJECT_ID_RE.fullmatch(content):
+                raise NotImplementedError(f'Invalid ref {ref}')
+            return (content, None, False)
+        entry = self._get_packed_refs().get(ref)
+        return (*entry, True) if entry else None
+
+    def _lookup(self, name):
+        if REVISION_EXPR_RE.search(name) or not name:
+            raise NotImplementedError(f'Revision expression "{name}"')
+        for rule in REF_RULES:
+            ref = rule.format(name)
+            # only refs and pseudo refs like HEAD are looked up directly
+            if rule == '{}' and not (ref.startswith('refs/')
+                                     or re.fullmatch(r'[A-Z_]+', ref)):
+                continue
+            entry = self._read_ref(ref)
+            if entry:
+                return entry
+        if ABBREV_OBJECT_ID_RE.fullmatch(name.lower()):
+            raise NotImplementedError(f'Abbreviated object id "{name}"')
+        return None
+
+    def rev_parse(self, name):
+        """
+            Returns the object id the name refers to (like
+            ``git rev-parse --verify``), or None if it does not exist. Full
+            object ids are returned as is.
+        """
+        if OBJECT_ID_RE.fullmatch(name.lower()):
+            return name.lower()
+        entry = self._lookup(name)
+        return entry[0] if entry else None
+
+    def peel(self, name):
+        """
+            Returns the commit the name refers to, peeling annotated tags
+            (like ``git rev-list -n 1``), or None if it does not exist.
+        """
+        if OBJECT_ID_RE.fullmatch(name.lower()):
+            return self._peel_object(name.lower())
+        entry = self._lookup(name)
+        if not entry:
+            return None
+        (oid, peeled, packed) = entry
+        if peeled:
+            return peeled
+        if packed and self._fully_peeled:
+            # packed refs without a peeled entry are no tags
+            return oid
+        return self._peel_object(oid)
+
+    def _peel_object(self, oid):
+        for _ in range(MAX_DEPTH):
+            (objtype, data) = self._read_object(oid)
+            if objtype == 'commit':
+                return oid
+            if objtype != 'tag' or not data.startswith(b'object '):
+                raise NotImplementedError(f'Cannot peel {objtype} {oid}')
+            oid = data.split(b'\n', 1)[0][len('object '):].decode()
+        raise NotImplementedError(f'Too many nested tags for {oid}')
+
+    def _get_object_dirs(self):
+        dirs = [os.path.join(self.commondir, 'objects')]
+        for objdir in dirs:
+            if len(dirs) > MAX_DEPTH:
+                break
+            alternates = _read_text(os.path.join(objdir, 'info',
+                                                 'alternates'))
+            for line in (alternates or '').splitlines():
+                if line and not line.startswith('#'):
+                    dirs.append(os.path.join(objdir, line))
+        return dirs
+
+    def _read_object(self, oid):
+        """
+            Returns the type and the content of the object.
+        """
+        for objdir in self._get_object_dirs():
+            try:
+                with open(os.path.join(objdir, oid[:2], oid[2:]), 'rb') as f:
+                    data = zlib.decompress(f.read())
+            except FileNotFoundError:
+                pass
+            else:
+                (header, _, content) = data.partition(b'\0')
+                return (header.split(b' ')[0].decode(), content)
+            packdir = os.path.join(objdir, 'pack')
+            try:
+                indexes = [f for f in os.listdir(packdir)
+                           if f.endswith('.idx')]
+            except FileNotFoundError:
+                continue
+            for index in indexes:
+                index = os.path.join(packdir, index)
+                offset = self._find_in_index(index, bytes.fromhex(oid))
+                if offset is not None:
+                    return self._read_packed_object(index, offset,
+                                                    len(oid) // 2)
+        raise NotImplementedError(f'Object {oid} not found')
+
+    @staticmethod
+    def _find_in_index(path, oid):
+        """
+            Returns the offset of the object in the pack of the (version 2)
+            pack index, or None if the pack does not contain it.
+        """
+        with open(path, 'rb') as f:
+            header = f.read(8 + 256 * 4)
+            if header[:4] != b'\377tOc' or \
+                    struct.unpack('>I', header[4:8])[0] != 2:
+                raise NotImplementedError(f'Unsupported pack index {path}')
+            fanout = struct.unpack('>256I', header[8:])
+            count = fanout[255]
+            (low, high) = (fanout[oid[0] - 1] if oid[0] else 0, fanout[oid[0]])
+            names = 8 + 256 * 4
+            while low < high:
+                mid = (low + high) // 2
+                f.seek(names + mid * len(oid))
+                name = f.read(len(oid))
+                if name == oid:
+                    break
+                if name < oid:
+                    low = mid + 1
+                else:
+                    high = mid
+            else:
+                return None
+            offsets = names + count * (len(oid) + 4)
+            f.seek(offsets + mid * 4)
+            offset = struct.unpack('>I', f.read(4))[0]
+            if offset & 0x80000000:
+                f.seek(offsets + count * 4 + (offset & 0x7fffffff) * 8)
+                offset = struct.unpack('>Q', f.read(8))[0]
+            return offset
+
+    def _read_packed_object(self, index, offset, oid_len, depth=0):
+        """
+            Returns the type and the content of the object at the offset of
+            the pack that belongs to the index. Deltified objects are
+            resolved against their base object.
+        """
+        if depth > MAX_DELTA_DEPTH:
+            raise NotImplementedError('Delta chain too long')
+        with open(index[:-len('.idx')] + '.pack', 'rb') as f:
+            f.seek(offset)
+            byte = f.read(1)[0]
+            objtype = (byte >> 4) & 7
+            while byte & 0x80:
+                byte = f.read(1)[0]
+            if objtype == OFS_DELTA:
+                byte = f.read(1)[0]
+                base = byte & 0x7f
+                while byte & 0x80:
+                    byte = f.read(1)[0]
+                    base = ((base + 1) << 7) | (byte & 0x7f)
+                base = offset - base
+            elif objtype == REF_DELTA:
+                oid = f.read(oid_len)
+                base = self._find_in_index(index, oid)
+                if base is None:
+                    raise NotImplementedError('Thin pack')
+            elif objtype not in PACK_TYPES:
+                raise NotImplementedError(f'Invalid object type {objtype}')
+            inflater = zlib.decompressobj()
+            data = b''
+            while not inflater.eof:
+                chunk = f.read(4096)
+                if not chunk:
+                    raise NotImplementedError('Truncated pack')
+                data += inflater.decompress(chunk)
+        if objtype in PACK_TYPES:
+            return (PACK_TYPES[objtype], data)
+        (basetype, basedata) = self._read_packed_object(index, base, oid_len,
+                                                        depth + 1)
+        return (basetype, _apply_delta(basedata, data))
@@ -26,19 +26,19 @@
 """
 
 import os
+import copy
+import hashlib
 from pathlib import Path
+from tempfile import NamedTemporaryFile
 from collections import OrderedDict
 from collections.abc import Mapping
 from functools import cached_property
-import functools
 import logging
 import json
-import yaml
-
-from jsonschema.validators import validator_for
 
 from .kasusererror import KasUserError
 from .repos import Repo
+from .schemacompiler import get_validator
 from . import __file_version__, __compatible_file_version__, __version__
 from . import CONFIGSCHEMA
 
@@ -66,7 +66,46 @@ class IncludeException(KasUserError):
     pass
 
 
+def merge_configs(configs):
+    """
+    Merges the configs recursively. Later configs overwrite earlier ones,
+    and the keys are ordered by their first appearance.
+
+    All configs are merged at once per key path: a value that is not a
+    mapping overwrites all previous values of the key, the mappings after
+    the last non-mapping value are merged. Sub-trees that are only defined
+    in a single config are not copied.
+    """
+    if not all(isinstance(c, Mapping) for c in configs):
+        raise IncludeException('Cannot merge using non-dict')
+
+    def _merge(sources):
+        result = {}
+        for source in sources:
+            result.update(source)
+        # parsed configs only contain plain dicts as mappings
+        pending = {k: [] for (k, v) in result.items() if isinstance(v, dict)}
+        if not pending:
+            return result
+        for source in sources:
+            for key in source.keys() & pending.keys():
+                value = source[key]
+                if isinstance(value, dict):
+                    pending[key].append(value)
+                else:
+                    pending[key].clear()
+        for (key, values) in pending.items():
+            if len(values) > 1:
+                result[key] = _merge(values)
+        return result
+
+    return _merge(configs)
+
+
 class ConfigFile():
+    # parsed and validated configs, keyed by the identity of the file
+    _cache = {}
+
     def __init__(self, filename, is_external, is_lockfile):
         self.filename = Path(filename)
         self.config = {}
@@ -76,34 +115,25 @@ class ConfigFile():
         self.is_lockfile = is_lockfile
 
     @staticmethod
-    def load(filename, is_external=False, is_lockfile=False):
-        """
-            Load the configuration file and test if version is supported.
-        """
-        cf = ConfigFile(filename, is_external, is_lockfile)
-        (_, ext) = os.path.splitext(filename)
+    def _parse(filename, ext, content):
         if ext == '.json':
-            with open(filename, 'rb') as fds:
-                cf.config = json.load(fds)
-        elif ext in ['.yml', '.yaml']:
-            try:
-                with open(filename, 'rb') as fds:
-                    cf.config = yaml.safe_load(fds)
-            except yaml.YAMLError as e:
-                msg = f'Error in line {e.problem_mark.line + 1}' \
-                    if hasattr(e, 'problem_mark') else ''
-                raise LoadConfigException(
-                    f'Configuration file is not valid YAML: {msg}',
-                    filename)
-        else:
-            raise LoadConfigException('Config file extension not recognized',
-                                      filename)
+            return json.loads(content)
+        import yaml
+        try:
+            return yaml.safe_load(content)
+        except yaml.YAMLError as e:
+            msg = f'Error in line {e.problem_mark.line + 1}' \
+                if hasattr(e, 'problem_mark') else ''
+            raise LoadConfigException(
+                f'Configuration file is not valid YAML: {msg}',
+                filename)
 
-        validator_class = validator_for(CONFIGSCHEMA)
-        validator = validator_class(CONFIGSCHEMA)
+    @staticmethod
+    def _validate(filename, config):
+        validator = get_validator(CONFIGSCHEMA)
         validation_error = False
 
-        for error in sorted(validator.iter_errors(cf.config), key=str):
+        for error in sorted(validator.iter_errors(config), key=str):
             validation_error = True
             logging.error('Config file validation Error:\n%s', error.message)
             logging.error('For a list of supported configuration elements, '
@@ -115,6 +145,87 @@ class ConfigFile():
             raise LoadConfigException('Error(s) occured while validating the '
                                       'config file', filename)
 
+    @staticmethod
+    def _load_validated(filename, ext, cache_dir=None, reader=None):
+        """
+            Returns the parsed and validated content of the file. Results
+            are cached in-process by file identity and, if ``cache_dir`` is
+            set, on disk by content. If set, the content is read using the
+            ``reader`` function instead of from disk.
+        """
+        key = None
+        if reader:
+            content = reader()
+        else:
+            try:
+                st = os.stat(filename)
+                key = (os.path.realpath(filename), st.st_ino, st.st_size,
+                       st.st_mtime_ns)
+            except OSError:
+                pass
+            if key in ConfigFile._cache:
+                return ConfigFile._cache[key]
+
+            with open(filename, 'rb') as fds:
+                content = fds.read()
+
+        cache_file = None
+        config = None
+        if cache_dir:
+            data = content if isinstance(content, bytes) \
+                else content.encode()
+            digest = hashlib.sha256(__version__.encode() + ext.encode()
+                                    + b'\0' + data).hexdigest()
+            cache_file = os.path.join(cache_dir, digest + '.json')
+            try:
+                with open(cache_file, 'r') as f:
+                    config = json.load(f)
+                cache_file = None
+            except (OSError, ValueError):
+                pass
+
+        if config is None:
+            config = ConfigFile._parse(filename, ext, content)
+            ConfigFile._validate(filename, config)
+
+        if cache_file:
+            ConfigFile._store(cache_file, config)
+        if key:
+            ConfigFile._cache[key] = config
+        return config
+
+    @staticmethod
+    def _store(cache_file, config):
+        try:
+            encoded = json.dumps(config)
+            # only cache what survives the round-trip (e.g. no dates)
+            if json.loads(encoded) != config:
+                return
+            os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+            with NamedTemporaryFile('w', delete=False,
+                                    dir=os.path.dirname(cache_file)) as f:
+                f.write(encoded)
+            os.replace(f.name, cache_file)
+        except (OSError, TypeError, ValueError) as e:
+            logging.debug('Could not cache config file: %s', e)
+
+    @staticmethod
+    def load(filename, is_external=False, is_lockfile=False, cache_dir=None,
+             reader=None):
+        """
+            Load the configuration file and test if version is supported.
+            If set, the ``reader`` function returns the content of the file.
+        """
+        cf = ConfigFile(filename, is_external, is_lockfile)
+        (_, ext) = os.path.splitext(filename)
+        if ext not in ['.json', '.yml', '.yaml']:
+            raise LoadConfigException('Config file extension not recognized',
+                                      filename)
+
+        config = ConfigFile._load_validated(filename, ext, cache_dir, reader)
+        # the cached config must not be modified by the consumers
+        cf.config = copy.deepcopy(config)
+
         try:
             version_value = int(cf.config['header']['version'])
         except ValueError:
@@ -159,12 +270,17 @@ class IncludeHandler:
         ``<file>.lock.<ext>`` exists next to the first entry in
         ``top_files``. This filename is then appended to the list of
         ``top_files``.
+
+        If ``cache_dir`` is set, the parsed and validated config files are
+        cached in this directory, keyed by their content.
     """
 
-    def __init__(self, top_files, use_lock=True):
+    def __init__(self, top_files, use_lock=True, cache_dir=None):
         self.top_files = top_files
         self.use_lock = use_lock
+        self.cache_dir = cache_dir
         self.config_files = []
+        self.readers = {}
 
     def get_lock_filename(self, kasfile=None):
         """
@@ -203,10 +319,36 @@ class IncludeHandler:
                                    'belong to the same repository or all '
                                    'must be outside of versioning control')
 
-    def get_config(self, repos=None):
+    def _get_reader(self, filename):
+        """
+        Returns a function that reads the file via the reader of the repo
+        containing it, or None if the file is read from disk.
+        """
+        filename = os.path.abspath(filename)
+        for (path, reader) in self.readers.items():
+            relpath = os.path.relpath(filename, path)
+            if not relpath.startswith(os.pardir):
+                return lambda: reader(relpath)
+        return None
+
+    def _exists(self, filename):
+        reader = self._get_reader(filename)
+        if not reader:
+            return os.path.exists(filename)
+        try:
+            reader()
+        except FileNotFoundError:
+            return False
+        return True
+
+    def get_config(self, repos=None, readers=None):
         """
         Parameters:
           repos -- A dictionary that maps repo names to directory paths
+          readers -- A dictionary that maps directory paths of repos that \
+                     are not checked out yet to functions that return the \
+                     content of a file in the repo (see \
+                     :meth:`kas.repos.Repo.get_file_reader`)
 
         Returns:
           (config, repos)
@@ -216,10 +358,38 @@ class IncludeHandler:
         """
 
         repos = repos or {}
+        self.readers = {os.path.abspath(path): reader
+                        for (path, reader) in (readers or {}).items()}
+        # resolved includes, as a file can be reached via multiple paths
+        include_memo = {}
+        include_stack = []
 
         def _internal_include_handler(filename, repo_path,
                                       is_external=False, is_lockfile=False):
             """
+            Resolves an include via the memo and detects include cycles.
+            """
+            path = os.path.abspath(filename)
+            key = (path, repo_path, is_external, is_lockfile)
+            if key in include_memo:
+                (configs, missing_repos) = include_memo[key]
+                return (list(configs), list(missing_repos))
+            if path in include_stack:
+                cycle = include_stack[include_stack.index(path):]
+                raise IncludeException('Circular include detected: '
+                                       + ' -> '.join(cycle + [path]))
+            include_stack.append(path)
+            try:
+                result = _load_include(filename, repo_path,
+                                       is_external, is_lockfile)
+            finally:
+                include_stack.pop()
+            include_memo[key] = result
+            return (list(result[0]), list(result[1]))
+
+        def _load_include(filename, repo_path,
+                          is_external=False, is_lockfile=False):
+            """
             Recursively loads include files and finds missing repos.
 
             Includes are done in the following way:
@@ -248,10 +418,12 @@ class IncludeHandler:
             configs = []
             try:
                 current_config = \
-                    ConfigFile.load(filename, is_external, is_lockfile)
+                    ConfigFile.load(filename, is_external, is_lockfile,
+                                    self.cache_dir,
+                                    self._get_reader(filename))
                 # if lockfile exists, inject it after current file
                 lockfile = self.get_lock_filename(filename)
-                if Path(lockfile).exists():
+                if self._exists(lockfile):
                     (cfg, rep) = _internal_include_handler(
                         lockfile,
                         repo_path,
@@ -281,14 +453,14 @@ class IncludeHandler:
                     else:
                         includefile = os.path.abspath(
                             os.path.join(repo_path, include))
-                        if not os.path.exists(includefile):
+                        if not self._exists(includefile):
                             alternate = os.path.abspath(
                                 os.path.join(
                                     os.path.dirname(current_config.filename),
                                     include
                                 )
                             )
-                            if os.path.exists(alternate):
+                            if self._exists(alternate):
                                 logging.warning(
                                     'Falling back to file-relative addressing '
                                     'of local include "%s"', include)
@@ -328,43 +500,6 @@ class IncludeHandler:
             missing_repos = list(OrderedDict.fromkeys(missing_repos))
             return (configs, missing_repos)
 
-        def _internal_dict_merge(dest, upd):
-            """
-            Merges upd recursively into a copy of dest. The order is preserved
-            as in the original dict as dict-insertion orders are preserved from
-            Python 3.6 onwards.
-
-            If keys in upd intersect with keys in dest we will do a manual
-            merge (helpful for non-dict types like FunctionWrapper).
-            """
-            if (not isinstance(dest, Mapping)) \
-                    or (not isinstance(upd, Mapping)):
-                raise IncludeException('Cannot merge using non-dict')
-            dest = dest.copy()
-            updkeys = list(upd.keys())
-            if set(list(dest.keys())) & set(updkeys):
-                for key in updkeys:
-                    val = upd[key]
-                    try:
-                        dest_subkey = dest.get(key, None)
-                    except AttributeError:
-                        dest_subkey = None
-                    if isinstance(dest_subkey, Mapping) \
-                            and isinstance(val, Mapping):
-                        ret = _internal_dict_merge(dest_subkey, val)
-                        dest[key] = ret
-                    else:
-                        dest[key] = upd[key]
-                return dest
-            try:
-                for k in upd:
-                    dest[k] = upd[k]
-            except AttributeError:
-                # this mapping is not a dict
-                for k in upd:
-                    dest[k] = upd[k]
-            return dest
-
         self.config_files = []
         missing_repos = []
         self.ensure_from_same_repo()
@@ -380,10 +515,9 @@ class IncludeHandler:
         if not self.use_lock:
             config_files = [x for x in config_files if not x.is_lockfile]
 
-        config = functools.reduce(_internal_dict_merge,
-                                  map(lambda x: x.config, config_files))
+        config = merge_configs([x.config for x in config_files])
         # the merged config must have the highest (used) version number
         header_version = max([int(cfg.config['header']['version'])
                               for cfg in config_files])
-        config['header']['version'] = header_version
+        config['header'] = dict(config['header'], version=header_version)
         return config, missing_repos
@@ -34,6 +34,7 @@ import logging
 import signal
 import sys
 import os
+from .context import get_context
 from .kasusererror import KasUserError, CommandExecError
 
 try:
@@ -111,20 +112,31 @@ def shutdown_loop(loop):
     """
         Waits for completion of the event loop
     """
+    ctx = get_context()
+    if ctx and ctx.prefetches:
+        from .libkas import cancel_prefetch
+        # a failed run does not wait for the queued speculative fetches
+        loop.run_until_complete(cancel_prefetch())
     pending = asyncio.all_tasks(loop)
     loop.run_until_complete(asyncio.gather(*pending))
+    if ctx and ctx.batch_cmds:
+        from .libkas import close_batch_cmds
+        loop.run_until_complete(close_batch_cmds())
     loop.close()
 
 
-def kas_get_argparser():
+def kas_get_argparser(commands=None):
     """
-        Creates an argparser for kas with all plugins.
+        Creates an argparser for kas with all plugins. Only the arguments of
+        the given commands are set up (all by default), so that only their
+        plugins are imported.
     """
 
-    # Load plugins here so that the commands and arguments introduced by the
-    # plugins can be seen by sphinx when it calls this function to build the
-    # documentation
-    plugins.load()
+    # By default, all plugins are loaded so that the commands and arguments
+    # introduced by the plugins can be seen by sphinx when it calls this
+    # function to build the documentation
+    if commands is None:
+        plugins.load()
 
     parser = argparse.ArgumentParser(description='kas - setup tool for '
                                      'bitbake based project')
@@ -142,12 +154,17 @@ def kas_get_argparser():
 
     subparser = parser.add_subparsers(help='sub command help', dest='cmd')
 
-    for plugin in plugins.all():
+    for (name, helpmsg) in plugins.commands():
+        setup = commands is None or name in commands
+        # the parsers of the other commands are only stubs, which leave
+        # all their arguments (including --help) unparsed
         plugin_parser = subparser.add_parser(
-            plugin.name,
-            help=plugin.helpmsg,
+            name,
+            help=helpmsg,
+            add_help=setup,
             formatter_class=ArgumentChoicesHelpFormatter)
-        plugin.setup_parser(plugin_parser)
+        if setup:
+            plugins.setup_parser(name, plugin_parser)
 
     return parser
 
@@ -175,7 +192,9 @@ def kas(argv):
     """
     create_logger()
 
-    parser = kas_get_argparser()
+    # determine the command first, then parse its arguments
+    (args, _) = kas_get_argparser(commands=[]).parse_known_args(argv)
+    parser = kas_get_argparser(commands=[args.cmd])
     args = parser.parse_args(argv)
 
     if args.log_level:
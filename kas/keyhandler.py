@@ -27,7 +27,6 @@
 import logging
 import subprocess
 from pathlib import Path
-from git.config import GitConfigParser
 from kas.kasusererror import KasUserError, MissingModuleError
 
 try:
@@ -251,6 +250,7 @@ class SSHKeyHandler(KeyHandler):
                 f.write(f'"{signer["comment"]}" namespaces="git" '
                         f'{signer["type"]} {signer["key"]}\n')
 
+        from git.config import GitConfigParser
         gitconfig = Path(repo.path) / '.git/config'
         with GitConfigParser(gitconfig, read_only=False) as config:
             config.add_section('gpg "ssh"')
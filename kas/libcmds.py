@@ -23,6 +23,7 @@
     This module contains common commands used by kas plugins.
 """
 
+import asyncio
 import tempfile
 import logging
 import shutil
@@ -32,15 +33,19 @@ import configparser
 import json
 import base64
 from pathlib import Path
-from git.config import GitConfigParser
 from .libkas import (ssh_cleanup_agent, ssh_setup_agent, ssh_no_host_key_check,
-                     get_build_environ, repos_fetch, repos_apply_patches)
+                     get_build_environ, source_init_build_env,
+                     find_init_script, repos_fetch, repos_prefetch,
+                     wait_prefetch, cancel_prefetch, TaskExecError)
 from .context import ManagedEnvironment as ME
 from .context import get_context
 from .includehandler import IncludeException
-from .kasusererror import EnvSetButNotFoundError, ArgsCombinationError
+from .kasusererror import (EnvSetButNotFoundError, ArgsCombinationError,
+                           CommandExecError)
 from .keyhandler import GPGKeyHandler, SSHKeyHandler
 from .repos import RepoRefError
+from .scheduler import TaskGraph
+from .state import WorkspaceState
 
 __license__ = 'MIT'
 __copyright__ = 'Copyright (c) Siemens AG, 2017-2018'
@@ -110,13 +115,36 @@ class Macro:
             command.execute(ctx)
             return True
 
+        def _run_pipeline():
+            # consecutive pipeline commands are executed as a single graph
+            if pipeline:
+                _run_single(ReposPipeline(pipeline))
+                pipeline.clear()
+
+        def _run_commands(commands):
+            for (cmd, cleanup) in commands:
+                if str(cmd) in (skip or []):
+                    continue
+                if isinstance(cmd, PipelineCommand):
+                    pipeline.append(cmd)
+                    continue
+                _run_pipeline()
+                if _run_single(cmd) and cleanup:
+                    cleanup_commands.insert(0, cleanup)
+            _run_pipeline()
+
+        # the workspace state is only valid for a complete setup
+        skip_state = set(skip or []) & set(WorkspaceState.STEPS)
+        if self.setup_commands and not skip_state:
+            ctx.state = WorkspaceState(ctx)
+
         cleanup_commands = []
+        pipeline = []
         try:
-            for cmd in self.setup_commands:
-                if _run_single(cmd[0]) and cmd[1]:
-                    cleanup_commands.insert(0, cmd[1])
-            for cmd in self.commands:
-                _run_single(cmd)
+            _run_commands(self.setup_commands)
+            if ctx.state:
+                ctx.state.save(ctx)
+            _run_commands([(c, None) for c in self.commands])
         finally:
             for cmd in cleanup_commands:
                 _run_single(cmd)
@@ -134,6 +162,162 @@ class Command:
         pass
 
 
+class PipelineCommand(Command):
+    """
+        A command that is executed as part of a :class:`ReposPipeline`.
+        Instead of executing the command as a whole, it adds its tasks to
+        the task graph of the pipeline.
+    """
+
+    def add_tasks(self, ctx, pipeline):
+        """
+            Adds the tasks of this command to the pipeline.
+        """
+        raise NotImplementedError()
+
+    def finish(self, ctx):
+        """
+            Called after the pipeline was executed (also on errors).
+        """
+        pass
+
+    def execute(self, ctx):
+        ReposPipeline([self]).execute(ctx)
+
+
+class RepoCommand(PipelineCommand):
+    """
+        A pipeline command that is executed on each repo individually. The
+        step for a repo starts as soon as the previous step of the same repo
+        and the steps returned by :meth:`get_dependencies` are completed.
+    """
+
+    def prepare(self, ctx, pipeline):
+        """
+            Called once before any task of the command is added.
+        """
+        pass
+
+    def get_dependencies(self, ctx, pipeline, repo):
+        """
+            Returns the tasks (besides the previous step of the same repo)
+            the step on ``repo`` depends on.
+        """
+        return []
+
+    async def execute_repo_async(self, ctx, repo):
+        """
+            Executes the command on a single repo.
+        """
+        raise NotImplementedError()
+
+    def add_tasks(self, ctx, pipeline):
+        self.prepare(ctx, pipeline)
+        for repo in self.order(ctx, pipeline.repos):
+            if ctx.state and ctx.state.is_clean(repo):
+                continue
+            deps = [pipeline.task(pipeline.previous(self), repo)]
+            deps += self.get_dependencies(ctx, pipeline, repo)
+            pipeline.add(pipeline.task(str(self), repo),
+                         lambda r=repo: self.execute_repo_async(ctx, r),
+                         deps)
+
+    def order(self, ctx, repos):
+        """
+            Returns the repos in the order their tasks are submitted.
+        """
+        return repos
+
+
+class ReposPipeline(Command):
+    """
+        Executes a sequence of pipeline commands as a graph of tasks on the
+        event loop. Each repo proceeds through the per-repo steps
+        independently, so that repos that are ready (e.g. fetched) do not
+        wait for the slowest repo of the whole set.
+
+        .. note:: termination point of the asyncio event loop.
+    """
+
+    # order of the per-repo steps within a pipeline
+    STEPS = [
+        'finish_setup_repos',
+        'repos_checkout',
+        'repos_check_signatures',
+        'repos_apply_patches',
+    ]
+
+    def __init__(self, commands):
+        self.commands = commands
+        self.repos = []
+        self.graph = None
+
+    def __str__(self):
+        return 'repos_pipeline'
+
+    @property
+    def steps(self):
+        return [str(c) for c in self.commands if isinstance(c, RepoCommand)]
+
+    def previous(self, command):
+        """
+            Returns the name of the step that precedes the given command.
+        """
+        steps = self.steps
+        index = steps.index(str(command))
+        return steps[index - 1] if index > 0 else None
+
+    def task(self, step, repo=None):
+        """
+            Returns the key of the task that completes ``step`` on ``repo``.
+            If the step is not part of the pipeline (e.g. skipped), the last
+            preceding step that is part of it is used instead.
+        """
+        if step is None:
+            return None
+        if repo is None:
+            return (step, None)
+        steps = self.steps
+        for candidate in reversed(self.STEPS[:self.STEPS.index(step) + 1]):
+            if candidate in steps:
+                return (candidate, repo)
+        return None
+
+    def add(self, key, func, deps=None):
+        """
+            Adds a task to the pipeline.
+        """
+        self.graph.add(key, func, [d for d in deps or [] if d])
+
+    async def wait(self, keys):
+        """
+            Waits for tasks from within another task of the pipeline.
+        """
+        await self.graph.wait([k for k in keys if k])
+
+    @staticmethod
+    async def run_sync(func, *args):
+        """
+            Runs a synchronous function without blocking the event loop.
+        """
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, func, *args)
+
+    def execute(self, ctx):
+        logging.debug('execute %s',
+                      ', '.join(str(c) for c in self.commands))
+        self.repos = ctx.config.get_repos()
+        self.graph = TaskGraph()
+        try:
+            for command in self.commands:
+                command.add_tasks(ctx, self)
+            loop = asyncio.get_event_loop()
+            loop.run_until_complete(self.graph.run())
+        finally:
+            for command in self.commands:
+                command.finish(ctx)
+
+
 class Loop(Command):
     """
         A class that defines a set of commands as a loop.
@@ -332,6 +516,7 @@ class SetupHome(Command):
         if gitconfig_host:
             shutil.copy(gitconfig_host, gitconfig_kas)
 
+        from git.config import GitConfigParser
         with GitConfigParser(gitconfig_kas, read_only=False) as config:
             if os.environ.get('GIT_CREDENTIAL_HELPER', False):
                 config['credential'] = {
@@ -415,16 +600,47 @@ class CleanupSSHAgent(Command):
         ssh_cleanup_agent()
 
 
-class SetupEnviron(Command):
+class SetupEnviron(PipelineCommand):
     """
         Sets up the kas environment.
+
+        Within a pipeline, the environment is set up as soon as the repo that
+        provides the init-build-env script completed all its steps and all
+        other repos are checked out. It is applied once the pipeline
+        completed, so that commands of other repos do not observe a changing
+        environment.
     """
 
+    def __init__(self):
+        super().__init__()
+        self.environ = None
+
     def __str__(self):
         return 'setup_environ'
 
-    def execute(self, ctx):
-        ctx.environ.update(get_build_environ(ctx.config.get_build_system()))
+    def add_tasks(self, ctx, pipeline):
+        async def _setup_environ():
+            init_env = ctx.state.get_init_environ(ctx) if ctx.state else None
+            if init_env is None:
+                # the init repo is only known once all repos are in place
+                await pipeline.wait([pipeline.task('repos_checkout', r)
+                                     for r in pipeline.repos])
+                (init_repo, _) = find_init_script(build_system)
+                await pipeline.wait([pipeline.task('repos_apply_patches',
+                                                   init_repo)])
+                init_env = await pipeline.run_sync(source_init_build_env,
+                                                   build_system)
+                if ctx.state:
+                    ctx.state.init_environ = init_env
+            self.environ = get_build_environ(build_system, init_env)
+
+        self.environ = None
+        build_system = ctx.config.get_build_system()
+        pipeline.add(pipeline.task(str(self)), _setup_environ)
+
+    def finish(self, ctx):
+        if self.environ is not None:
+            ctx.environ.update(self.environ)
 
 
 class WriteBBConfig(Command):
@@ -475,16 +691,24 @@ class WriteBBConfig(Command):
         _write_local_conf(ctx)
 
 
-class ReposApplyPatches(Command):
+class ReposApplyPatches(RepoCommand):
     """
         Applies the patches defined in the configuration to the repositories.
+        The patches of a repo are applied as soon as the repo itself and the
+        repos providing the patches are ready.
     """
 
+    def __init__(self):
+        super().__init__()
+        self.gitconfig = None
+        self.user = None
+
     def __str__(self):
         return 'repos_apply_patches'
 
     def _vcs_operate_as_kas(self, gitconfig):
         # currently only implemented for git
+        from git.config import GitConfigParser
         with GitConfigParser(gitconfig, read_only=False) as config:
             # in case no user is defined, we keep the kas user
             user_orig = {
@@ -500,20 +724,35 @@ class ReposApplyPatches(Command):
 
     def _vcs_restore_user(self, gitconfig, user):
         # currently only implemented for git
+        from git.config import GitConfigParser
         with GitConfigParser(gitconfig, read_only=False) as config:
             config['user'] = user
             config.write()
 
-    def execute(self, ctx):
+    def prepare(self, ctx, pipeline):
         if 'HOME' not in ctx.environ:
             raise ArgsCombinationError('Apply patches requires setup_home')
 
-        gitconfig = ctx.environ['HOME'] + '/.gitconfig'
-        user = self._vcs_operate_as_kas(gitconfig)
+        self.gitconfig = ctx.environ['HOME'] + '/.gitconfig'
+        self.user = self._vcs_operate_as_kas(self.gitconfig)
+
+    def get_dependencies(self, ctx, pipeline, repo):
+        # patches are read from (verified) repos
+        patch_repos = [ctx.config.repo_dict.get(name)
+                       for name in repo.patch_repos]
+        return [pipeline.task('repos_check_signatures', r)
+                for r in patch_repos if r and r is not repo]
 
-        repos_apply_patches(ctx.config.get_repos())
+    async def execute_repo_async(self, ctx, repo):
+        try:
+            await repo.apply_patches_async()
+        except CommandExecError as e:
+            raise TaskExecError('apply patches', e.ret_code)
 
-        self._vcs_restore_user(gitconfig, user)
+    def finish(self, ctx):
+        if self.user:
+            self._vcs_restore_user(self.gitconfig, self.user)
+            self.user = None
 
 
 class InitSetupRepos(Command):
@@ -525,8 +764,22 @@ class InitSetupRepos(Command):
         return 'init_setup_repos'
 
     def execute(self, ctx):
-        ctx.missing_repo_names = ctx.config.find_missing_repos()
+        if ctx.state and ctx.state.restore(ctx):
+            # all repos needed by includes are in place already
+            ctx.missing_repo_names = []
+        else:
+            ctx.missing_repo_names = ctx.config.find_missing_repos()
+            # Fetch all pinned repos at once, instead of one include level
+            # after the other. Repos that are only known from a lockfile
+            # are located by the state of the previous run. The repos that
+            # the previous run discovered via includes are fetched
+            # speculatively.
+            hints = ctx.state.repo_hints if ctx.state else {}
+            discovered = ctx.state.discovered_repos if ctx.state else {}
+            repos_prefetch(ctx.config.get_pinned_repos(hints)
+                           + ctx.config.get_discovered_repos(discovered))
         ctx.missing_repo_names_old = None
+        ctx.include_readers = {}
 
 
 class SetupReposStep(Command):
@@ -539,6 +792,11 @@ class SetupReposStep(Command):
 
     def execute(self, ctx):
         if not ctx.missing_repo_names:
+            # The config is complete. Speculatively fetched repos that are
+            # not used must not hold job slots ahead of the remaining
+            # fetches.
+            asyncio.get_event_loop().run_until_complete(
+                cancel_prefetch(keep=ctx.config.get_repos_config()))
             return False
 
         if ctx.missing_repo_names == ctx.missing_repo_names_old:
@@ -559,8 +817,16 @@ class SetupReposStep(Command):
 
         repos_fetch([v for k, v in ctx.missing_repos])
 
+        # Read the includes from the revisions to be checked out if
+        # possible, so that the repos can be checked out in parallel
+        # later. Otherwise check them out now. As includes may refer to
+        # any file of a repo, this checkout is not sparse.
         for _, repo in ctx.missing_repos:
-            repo.checkout()
+            reader = repo.get_file_reader()
+            if reader:
+                ctx.include_readers[repo.path] = reader
+            else:
+                repo.checkout(sparse=False)
 
         ctx.config.repo_dict.update(
             {id: repo for id, repo in ctx.missing_repos})
@@ -570,12 +836,12 @@ class SetupReposStep(Command):
         ctx.missing_repo_names_old = ctx.missing_repo_names
 
         ctx.missing_repo_names = \
-            ctx.config.find_missing_repos(repo_paths)
+            ctx.config.find_missing_repos(repo_paths, ctx.include_readers)
 
         return ctx.missing_repo_names
 
 
-class FinishSetupRepos(Command):
+class FinishSetupRepos(RepoCommand):
     """
         Finalizes the repo setup loop
     """
@@ -583,15 +849,26 @@ class FinishSetupRepos(Command):
     def __str__(self):
         return 'finish_setup_repos'
 
-    def execute(self, ctx):
-        # now fetch everything with complete config
-        repos_fetch(ctx.config.get_repos())
-
+    def prepare(self, ctx, pipeline):
         config_str = pprint.pformat(ctx.config.get_config(), sort_dicts=False)
         logging.debug('Configuration from config file:\n%s', config_str)
 
+    def order(self, ctx, repos):
+        return ctx.scheduler.order(repos)
+
+    async def execute_repo_async(self, ctx, repo):
+        # now fetch everything with complete config
+        await wait_prefetch(repo)
+        try:
+            await ctx.scheduler.run(repo, repo.fetch_async)
+        except CommandExecError as e:
+            raise TaskExecError('fetch repos', e.ret_code)
+
+    def finish(self, ctx):
+        ctx.scheduler.save_stats()
 
-class ReposCheckout(Command):
+
+class ReposCheckout(RepoCommand):
     """
         Ensures that the right revision of each repo is checked out.
     """
@@ -599,23 +876,35 @@ class ReposCheckout(Command):
     def __str__(self):
         return 'repos_checkout'
 
-    def execute(self, ctx):
-        for repo in ctx.config.get_repos():
-            repo.checkout()
+    async def execute_repo_async(self, ctx, repo):
+        await ctx.scheduler.run(repo, repo.checkout_async, local=True)
 
 
-class ReposCheckSignatures(Command):
+class ReposCheckSignatures(RepoCommand):
     """
         Imports the keys defined in the configuration and checks the
-        signatures of the repositories.
+        signatures of the repositories. The keys are imported once the repos
+        providing them are checked out.
     """
 
     def __str__(self):
         return 'repos_check_signatures'
 
-    def execute(self, ctx):
-        self._import_keys(ctx)
-        self._check_signatures(ctx)
+    def prepare(self, ctx, pipeline):
+        key_repos = [ctx.config.repo_dict.get(s['repo'])
+                     for s in ctx.config.get_signers_config().values()
+                     if 'repo' in s]
+        pipeline.add(pipeline.task(str(self)),
+                     lambda: ReposPipeline.run_sync(self._import_keys, ctx),
+                     [pipeline.task('repos_checkout', r)
+                      for r in key_repos if r])
+
+    def get_dependencies(self, ctx, pipeline, repo):
+        return [pipeline.task(str(self))]
+
+    async def execute_repo_async(self, ctx, repo):
+        if repo.signed:
+            await ReposPipeline.run_sync(self._check_signature, ctx, repo)
 
     def _import_keys(self, ctx):
         handler_cfg = {
@@ -633,22 +922,22 @@ class ReposCheckSignatures(Command):
             ctx.managed_paths.add(dir)
             ctx.keyhandler[name] = handler_cls(dir, signers_cfg, ctx.config)
 
+        # replace the environment, as it might be in use by other tasks
+        environ = dict(ctx.environ)
         for keyhandler in ctx.keyhandler.values():
-            ctx.environ.update(keyhandler.env)
-
-    def _check_signatures(self, ctx):
-        for repo in ctx.config.get_repos():
-            if not repo.signed:
-                continue
-            valid, keyid = repo.check_signature()
-            keyhandler = ctx.keyhandler[repo.signers_type]
-            info = keyhandler.get_key_repr(keyid) if keyid else 'No info'
-            if valid:
-                logging.info(f'Repository {repo.name} signature valid: {info}')
-                continue
-            elif keyid:
-                raise RepoRefError(f'Repository {repo.name} is not signed '
-                                   f'with a trusted key: {info}')
-
+            environ.update(keyhandler.env)
+        ctx.environ = environ
+
+    def _check_signature(self, ctx, repo):
+        valid, keyid = repo.check_signature()
+        keyhandler = ctx.keyhandler[repo.signers_type]
+        info = keyhandler.get_key_repr(keyid) if keyid else 'No info'
+        if valid:
+            logging.info(f'Repository {repo.name} signature valid: {info}')
+            return
+        elif keyid:
             raise RepoRefError(f'Repository {repo.name} is not signed '
-                               'with a trusted key.')
+                               f'with a trusted key: {info}')
+
+        raise RepoRefError(f'Repository {repo.name} is not signed '
+                           'with a trusted key.')
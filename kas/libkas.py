@@ -31,6 +31,7 @@ import logging
 import tempfile
 import asyncio
 import errno
+import fcntl
 import hashlib
 import hmac
 import pathlib
@@ -38,11 +39,14 @@ import platform
 import shutil
 import signal
 import stat
+import time
+from contextlib import asynccontextmanager
 from subprocess import Popen, PIPE, run as subprocess_run
 from urllib.parse import quote
 from .context import get_context
 from .kasusererror import KasUserError, CommandExecError
 from .configschema import CONFIGSCHEMA
+from .scheduler import DEFAULT_JOBS
 
 __license__ = 'MIT'
 __copyright__ = 'Copyright (c) Siemens AG, 2017-2018'
@@ -72,6 +76,15 @@ class TaskExecError(KasUserError):
         super().__init__(f'{command} failed: error code {ret_code}')
 
 
+class LockTimeoutError(KasUserError):
+    """
+    A file lock could not be acquired in time
+    """
+    def __init__(self, path, timeout):
+        super().__init__(f'Timeout after {timeout}s while waiting for lock '
+                         f'"{path}"')
+
+
 class LogOutput:
     """
         Handles the log output of executed applications
@@ -216,6 +229,135 @@ def run_cmd(cmd, cwd, env=None, fail=True, capture_stderr=False):
                           ret.stderr.decode('utf-8'))
 
 
+class BatchCommand:
+    """
+        A long-running command that answers queries line by line, like
+        ``git cat-file --batch-check``. The process is started on the first
+        query. Use :func:`get_batch_cmd` to share it.
+    """
+
+    def __init__(self, cmd, cwd):
+        self.cmd = cmd
+        self.cwd = cwd
+        self._process = None
+        self._lock = None
+
+    async def query(self, line):
+        """
+            Sends the query line and returns the answer line, or None if
+            the process terminated.
+        """
+        if not self._lock:
+            # must be created within the running event loop
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            try:
+                if not self._process:
+                    logging.debug('%s$ %s', self.cwd, ' '.join(self.cmd))
+                    self._process = await asyncio.create_subprocess_exec(
+                        *self.cmd,
+                        cwd=self.cwd,
+                        env=get_context().environ,
+                        stdin=asyncio.subprocess.PIPE,
+                        stdout=asyncio.subprocess.PIPE,
+                        stderr=asyncio.subprocess.DEVNULL,
+                        preexec_fn=os.setpgrp)
+                self._process.stdin.write(line.encode() + b'\n')
+                await self._process.stdin.drain()
+                answer = await self._process.stdout.readline()
+            except asyncio.CancelledError:
+                # the answer of an interrupted query would be read by the
+                # next one
+                await self.close(terminate=True)
+                raise
+            except (BrokenPipeError, ConnectionResetError):
+                answer = b''
+            if not answer:
+                await self.close()
+                return None
+            return answer.decode().rstrip('\n')
+
+    async def close(self, terminate=False):
+        """
+            Stops the process and waits for its termination.
+        """
+        process = self._process
+        self._process = None
+        if not process:
+            return
+        if terminate:
+            process.terminate()
+        else:
+            process.stdin.close()
+        await asyncio.shield(process.wait())
+
+
+def get_batch_cmd(cmd, cwd):
+    """
+        Returns the batch command (see :class:`BatchCommand`) that runs cmd
+        in cwd. Batch commands are shared within a kas invocation and closed
+        by :func:`close_batch_cmds`.
+    """
+    batch_cmds = get_context().batch_cmds
+    key = (tuple(cmd), cwd)
+    if key not in batch_cmds:
+        batch_cmds[key] = BatchCommand(cmd, cwd)
+    return batch_cmds[key]
+
+
+async def close_batch_cmds():
+    """
+        Closes all batch commands.
+    """
+    batch_cmds = get_context().batch_cmds
+    cmds = list(batch_cmds.values())
+    batch_cmds.clear()
+    await asyncio.gather(*[c.close() for c in cmds])
+
+
+@asynccontextmanager
+async def file_lock(path, shared=False, timeout=None, poll_interval=0.1):
+    """
+        Holds an advisory lock (see flock(2)) on the file at path, which is
+        created if needed. Multiple shared locks can be held at the same
+        time, an exclusive lock excludes all others. Raises a
+        LockTimeoutError if the lock cannot be acquired within timeout
+        seconds. As the lock is released by the kernel when its holder
+        exits, locks of crashed processes never go stale. The holder of an
+        exclusive lock may remove the file, e.g. together with the locked
+        data. Waiters then lock the newly created file instead.
+    """
+    operation = (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) | fcntl.LOCK_NB
+    deadline = None if timeout is None else time.monotonic() + timeout
+    logged = False
+    while True:
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            fcntl.flock(fd, operation)
+        except BlockingIOError:
+            os.close(fd)
+            if deadline is not None and time.monotonic() >= deadline:
+                raise LockTimeoutError(path, timeout)
+            if not logged:
+                logging.debug('Waiting for lock %s', path)
+                logged = True
+            await asyncio.sleep(poll_interval)
+            continue
+        try:
+            locked = os.stat(path).st_ino == os.fstat(fd).st_ino
+        except FileNotFoundError:
+            locked = False
+        if locked:
+            break
+        # the file was removed by the previous holder
+        os.close(fd)
+    try:
+        yield
+    finally:
+        # closing the file releases the lock
+        os.close(fd)
+
+
 def find_program(paths, name):
     """
         Find a file within the paths array and returns its path.
@@ -236,35 +378,76 @@ def repos_fetch(repos):
     if len(repos) == 0:
         return
 
-    tasks = []
-    for repo in repos:
-        tasks.append(asyncio.ensure_future(repo.fetch_async()))
+    scheduler = get_context().scheduler
+
+    async def _fetch(repo):
+        await wait_prefetch(repo)
+        return await scheduler.run(repo, repo.fetch_async)
+
+    tasks = [asyncio.ensure_future(_fetch(r)) for r in scheduler.order(repos)]
 
     loop = asyncio.get_event_loop()
     try:
         loop.run_until_complete(asyncio.gather(*tasks))
     except CommandExecError as e:
         raise TaskExecError('fetch repos', e.ret_code)
+    finally:
+        scheduler.save_stats()
 
 
-def repos_apply_patches(repos):
+def repos_prefetch(repos):
+    """
+        Starts fetching the repos in the background. The fetches proceed
+        whenever the event loop runs. Failures are ignored, as the repos
+        are fetched again (see :func:`wait_prefetch`) once they are needed.
     """
-        Applies the patches to the repositories.
+    ctx = get_context()
 
-        .. note:: termination point of the asyncio event loop.
+    async def _prefetch(repo):
+        ctx.prefetches_started.add(repo.name)
+        try:
+            await repo.fetch_async()
+        except Exception as e:
+            logging.debug('Prefetch of repository %s failed: %s',
+                          repo.name, e)
+
+    for repo in ctx.scheduler.order(repos):
+        if repo.name not in ctx.prefetches:
+            logging.debug('Prefetching repository %s', repo.name)
+            ctx.prefetches[repo.name] = asyncio.ensure_future(
+                ctx.scheduler.run(repo, lambda r=repo: _prefetch(r)))
+
+
+async def wait_prefetch(repo):
     """
-    if len(repos) == 0:
-        return
+        Waits until the background fetch of the repo (if any) completed.
+    """
+    future = get_context().prefetches.pop(repo.name, None)
+    if future:
+        await future
 
-    tasks = []
-    for repo in repos:
-        tasks.append(asyncio.ensure_future(repo.apply_patches_async()))
 
-    loop = asyncio.get_event_loop()
-    try:
-        loop.run_until_complete(asyncio.gather(*tasks))
-    except CommandExecError as e:
-        raise TaskExecError('apply patches', e.ret_code)
+def cancel_prefetch(keep=None):
+    """
+        Cancels the background fetches of the repos that turned out to be
+        unused, i.e. all except the ones in ``keep``. The fetches are
+        cancelled right away, before they can take a job slot. Returns an
+        awaitable for the fetches that are running already. These are
+        completed, so that no partial clones are left behind.
+    """
+    ctx = get_context()
+    futures = []
+    for name in list(ctx.prefetches):
+        if name in (keep or []):
+            continue
+        future = ctx.prefetches.pop(name)
+        if name in ctx.prefetches_started:
+            logging.debug('Completing prefetch of unused repository %s',
+                          name)
+        else:
+            future.cancel()
+        futures.append(future)
+    return asyncio.gather(*futures, return_exceptions=True)
 
 
 def get_buildtools_dir():
@@ -383,13 +566,11 @@ def get_buildtools_version():
     return -1
 
 
-def get_build_environ(build_system):
+def find_init_script(build_system):
     """
-        Creates the build environment variables.
+        Returns the repo that provides the init-build-env script for the
+        build system and the name of that script.
     """
-    # nasty side effect function: running oe/isar-init-build-env also
-    # creates the conf directory
-
     init_repo = None
     if build_system in ['openembedded', 'oe']:
         scripts = ['oe-init-build-env']
@@ -412,7 +593,18 @@ def get_build_environ(build_system):
             init_script = script
     if not init_repo:
         raise InitBuildEnvError('Did not find any init-build-env script')
+    return (init_repo, init_script)
+
+
+def source_init_build_env(build_system):
+    """
+        Sources the init-build-env script (and the buildtools environment,
+        if configured) and returns the resulting environment variables.
+    """
+    # nasty side effect function: running oe/isar-init-build-env also
+    # creates the conf directory
 
+    (init_repo, init_script) = find_init_script(build_system)
     conf_buildtools = get_context().config.get_buildtools()
     buildtools_env = ""
 
@@ -484,6 +676,20 @@ def get_build_environ(build_system):
             env[key] = val
         except ValueError:
             pass
+    return env
+
+
+def get_build_environ(build_system, init_env=None):
+    """
+        Creates the build environment variables. The result of
+        :func:`source_init_build_env` can be passed as ``init_env`` (e.g. if
+        recorded in a previous run), otherwise the init script is sourced.
+    """
+    if init_env is None:
+        init_env = source_init_build_env(build_system)
+    if init_env == -1:
+        return -1
+    env = dict(init_env)
 
     conf_env = get_context().config.get_environment()
 
@@ -631,6 +837,14 @@ def setup_parser_common_args(parser):
     parser.add_argument('--update', action='store_true',
                         help='Pull new upstream changes to the desired '
                         'branch even if it is already checked out locally')
+    parser.add_argument('-j', '--jobs', type=int,
+                        help='Maximum number of concurrent repository '
+                        'fetches (default: KAS_FETCH_JOBS or '
+                        f'{DEFAULT_JOBS})')
+    parser.add_argument('--clone-filter', metavar='FILTER',
+                        help='Use partial clones of git repositories with '
+                        'the given filter, e.g. blob:none or tree:0 '
+                        '(default: KAS_CLONE_FILTER)')
 
 
 def setup_parser_config_arg(parser):
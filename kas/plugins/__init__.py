@@ -21,10 +21,68 @@
 # SOFTWARE.
 """
     This module contains and manages kas plugins
+
+    The built-in plugins are registered by name, together with their help
+    message. A plugin module is only imported when the plugin is looked up,
+    so that only the selected command pays for its imports.
 """
 
+import importlib
+
 PLUGINS = {}
 
+# built-in plugins: command name -> (module, help message)
+# The plugin classes take their help message from here.
+REGISTRY = {
+    'build': (
+        'build',
+        'Checks out all necessary repositories and builds using bitbake as '
+        'specified in the configuration file.'),
+    'checkout': (
+        'checkout',
+        'Checks out all necessary repositories and sets up the build '
+        'directory as specified in the configuration file.'),
+    'clean': (
+        'clean',
+        'Clean build artifacts, keep sstate cache and downloads.'),
+    'cleansstate': (
+        'clean',
+        'Clean build artifacts and sstate cache.'),
+    'cleanall': (
+        'clean',
+        'Clean build artifacts, sstate-cache and downloads.'),
+    'purge': (
+        'clean',
+        'Purge all data managed by kas, including managed repos.'),
+    'diff': (
+        'diff',
+        'Compare two KAS configurations.'),
+    'dump': (
+        'dump',
+        'Expand and dump the final config to stdout. When resolving branches, '
+        'this is done before patches are applied.'),
+    'for-all-repos': (
+        'for_all_repos',
+        'Runs a specified command in all checked out repositories.'),
+    'lock': (
+        'lock',
+        'Create and update kas project lockfiles.'),
+    'menu': (
+        'menu',
+        'Provides a configuration menu and triggers the build of the '
+        'choices.'),
+    'shell': (
+        'shell',
+        'Run a shell in the build environment.'),
+}
+
+
+def get_helpmsg(name):
+    """
+        Returns the help message of a built-in plugin
+    """
+    return REGISTRY[name][1]
+
 
 def register_plugins(mod):
     """
@@ -34,41 +92,50 @@ def register_plugins(mod):
         PLUGINS[plugin.name] = plugin
 
 
+def _import(name):
+    module = importlib.import_module(f'{__name__}.{REGISTRY[name][0]}')
+    register_plugins(module)
+
+
 def load():
     """
         Import all kas plugins
     """
-    # sort alphabetically
-    from . import build
-    from . import checkout
-    from . import clean
-    from . import diff
-    from . import dump
-    from . import for_all_repos
-    from . import lock
-    from . import menu
-    from . import shell
-
-    register_plugins(build)
-    register_plugins(checkout)
-    register_plugins(clean)
-    register_plugins(diff)
-    register_plugins(dump)
-    register_plugins(for_all_repos)
-    register_plugins(lock)
-    register_plugins(menu)
-    register_plugins(shell)
+    for name in REGISTRY:
+        if name not in PLUGINS:
+            _import(name)
+
+
+def commands():
+    """
+        Returns the names and help messages of all kas plugins, without
+        importing them.
+    """
+    entries = [(name, helpmsg) for (name, (_, helpmsg)) in REGISTRY.items()]
+    entries += [(p.name, p.helpmsg) for p in PLUGINS.values()
+                if p.name not in REGISTRY]
+    return entries
+
+
+def setup_parser(name, parser):
+    """
+        Sets up the argument parser of a kas plugin
+    """
+    get(name).setup_parser(parser)
 
 
 def get(name):
     """
         Lookup a kas plugin class by name
     """
+    if name not in PLUGINS and name in REGISTRY:
+        _import(name)
     return PLUGINS.get(name, None)
 
 
 def all():
     """
-        Get a list of all loaded kas plugin classes
+        Get a list of all kas plugin classes
     """
+    load()
     return PLUGINS.values()
@@ -51,6 +51,7 @@ from kas.libcmds import Macro, Command
 from kas.libkas import setup_parser_common_args, setup_parser_config_arg
 from kas.kasusererror import CommandExecError
 from kas.attestation import Provenance, Statement
+from kas import plugins
 
 
 __license__ = 'MIT'
@@ -63,10 +64,7 @@ class Build:
     """
 
     name = 'build'
-    helpmsg = (
-        'Checks out all necessary repositories and builds using bitbake as '
-        'specified in the configuration file.'
-    )
+    helpmsg = plugins.get_helpmsg(name)
 
     @classmethod
     def setup_parser(cls, parser):
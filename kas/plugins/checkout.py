@@ -37,6 +37,7 @@ from kas.context import create_global_context
 from kas.config import Config
 from kas.libcmds import Macro
 from kas.libkas import setup_parser_common_args, setup_parser_config_arg
+from kas import plugins
 
 __license__ = 'MIT'
 __copyright__ = 'Copyright (c) Siemens AG, 2017-2018'
@@ -44,10 +45,7 @@ __copyright__ = 'Copyright (c) Siemens AG, 2017-2018'
 
 class Checkout:
     name = 'checkout'
-    helpmsg = (
-        'Checks out all necessary repositories and sets up the build '
-        'directory as specified in the configuration file.'
-    )
+    helpmsg = plugins.get_helpmsg(name)
 
     @classmethod
     def setup_parser(cls, parser):
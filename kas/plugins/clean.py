@@ -25,6 +25,7 @@
     determine the build system and the files managed by kas.
 """
 
+import asyncio
 import os
 import shutil
 import logging
@@ -34,6 +35,7 @@ from kas.context import create_global_context, get_context
 from kas.config import Config, CONFIG_YAML_FILE
 from kas.includehandler import ConfigFile
 from kas.libcmds import Macro
+from kas.libkas import file_lock
 from kas.kasusererror import KasUserError
 from kas import plugins
 
@@ -49,9 +51,7 @@ class Clean():
     """
 
     name = 'clean'
-    helpmsg = (
-        'Clean build artifacts, keep sstate cache and downloads.'
-    )
+    helpmsg = plugins.get_helpmsg(name)
     config_files = None
 
     @classmethod
@@ -130,9 +130,7 @@ class CleanSstate(Clean):
     """
 
     name = 'cleansstate'
-    helpmsg = (
-        'Clean build artifacts and sstate cache.'
-    )
+    helpmsg = plugins.get_helpmsg(name)
 
     def run(self, args):
         super().run(args)
@@ -151,9 +149,7 @@ class CleanAll(CleanSstate):
     """
 
     name = 'cleanall'
-    helpmsg = (
-        'Clean build artifacts, sstate-cache and downloads.'
-    )
+    helpmsg = plugins.get_helpmsg(name)
 
     def run(self, args):
         super().run(args)
@@ -180,9 +176,7 @@ class Purge(CleanAll):
     """
 
     name = 'purge'
-    helpmsg = (
-        'Purge all data managed by kas, including managed repos.'
-    )
+    helpmsg = plugins.get_helpmsg(name)
 
     @classmethod
     def setup_parser(cls, parser):
@@ -192,6 +186,21 @@ class Purge(CleanAll):
                             default=False,
                             help='Do not remove the reference repositories')
 
+    @staticmethod
+    def remove_ref_repo(ctx, ref_repo):
+        """
+        Removes a reference repository and its lock file once no other
+        instance of kas uses it.
+        """
+        async def _remove():
+            lock = f'{ref_repo}.lock'
+            async with file_lock(lock, timeout=ctx.repo_ref_lock_timeout):
+                shutil.rmtree(ref_repo)
+                # waiting instances lock a new file
+                os.remove(lock)
+
+        asyncio.get_event_loop().run_until_complete(_remove())
+
     def run(self, args):
         super().run(args)
         ctx = get_context()
@@ -217,8 +226,12 @@ class Purge(CleanAll):
                 ref_repo = Path(ctx.kas_repo_ref_dir) / r.qualified_name
                 if ref_repo.exists():
                     logging.info(f'Removing {ref_repo}')
+                    if ctx.repo_ref_shared:
+                        logging.warning('Shared clones of %s in other work '
+                                        'directories become unusable',
+                                        ref_repo)
                     if not args.dry_run:
-                        shutil.rmtree(ref_repo)
+                        self.remove_ref_repo(ctx, ref_repo)
 
         build_dir = Path(ctx.build_dir)
         logging.info(f'Removing {build_dir}/*')
@@ -41,6 +41,7 @@ from kas.context import create_global_context
 from kas.config import Config
 from kas.libcmds import Macro
 from kas.libkas import setup_parser_common_args
+from kas import plugins
 
 __license__ = 'MIT'
 __copyright__ = 'Copyright (c) Siemens, 2025'
@@ -52,9 +53,7 @@ class Diff:
     """
 
     name = 'diff'
-    helpmsg = (
-        'Compare two KAS configurations.'
-    )
+    helpmsg = plugins.get_helpmsg(name)
 
     @classmethod
     def setup_parser(cls, parser):
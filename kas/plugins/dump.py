@@ -71,8 +71,10 @@ import argparse
 from typing import TypeVar, TextIO
 from collections import OrderedDict
 from kas.context import get_context
+from kas.configview import FrozenDict, FrozenList, MutableDict
 from kas.plugins.checkout import Checkout
 from kas.kasusererror import KasUserError, ArgsCombinationError
+from kas import plugins
 
 __license__ = 'MIT'
 __copyright__ = 'Copyright (c) Siemens AG, 2022'
@@ -125,10 +127,7 @@ class Dump(Checkout):
     """
 
     name = 'dump'
-    helpmsg = (
-        'Expand and dump the final config to stdout. When resolving branches, '
-        'this is done before patches are applied.'
-    )
+    helpmsg = plugins.get_helpmsg(name)
 
     class KasYamlDumper(yaml.Dumper):
         """
@@ -148,6 +147,10 @@ class Dump(Checkout):
                 return self.represent_mapping(
                     'tag:yaml.org,2002:map',
                     data.items())
+            elif isinstance(data, (FrozenDict, MutableDict)):
+                return self.represent_dict(data)
+            elif isinstance(data, FrozenList):
+                return self.represent_list(data)
             elif data is None:
                 return self.represent_scalar('tag:yaml.org,2002:null', '')
             return super().represent_data(data)
@@ -227,7 +230,7 @@ class Dump(Checkout):
         ctx = get_context()
         schema_v = LOCKFILE_VERSION_MIN if args.lock else SCHEMA_VERSION_MIN
         config_expanded = {'header': {'version': schema_v}} if args.lock \
-            else ctx.config.get_config(remove_includes=True)
+            else ctx.config.get_config(remove_includes=True).mutable()
         repos = ctx.config.repo_dict.items()
         output = IoTarget(target=sys.stdout, managed=False)
 
@@ -77,6 +77,7 @@ from kas.libkas import setup_parser_keep_config_unchanged_arg
 from kas.libkas import setup_parser_preserve_env_arg
 from kas.libkas import run_handle_preserve_env_arg
 from kas.kasusererror import CommandExecError
+from kas import plugins
 
 __license__ = 'MIT'
 __copyright__ = 'Copyright (c) Siemens AG, 2017-2018'
@@ -84,9 +85,7 @@ __copyright__ = 'Copyright (c) Siemens AG, 2017-2018'
 
 class ForAllRepos:
     name = 'for-all-repos'
-    helpmsg = (
-        'Runs a specified command in all checked out repositories.'
-    )
+    helpmsg = plugins.get_helpmsg(name)
 
     @classmethod
     def setup_parser(cls, parser):
@@ -82,6 +82,7 @@ from kas.plugins.checkout import Checkout
 from kas.plugins.dump import Dump, IoTarget, LOCKFILE_VERSION_MIN
 from kas.plugins.diff import Diff
 from kas.repos import Repo
+from kas import plugins
 
 __license__ = 'MIT'
 __copyright__ = 'Copyright (c) Siemens AG, 2024'
@@ -93,9 +94,7 @@ class Lock(Checkout):
     """
 
     name = 'lock'
-    helpmsg = (
-        'Create and update kas project lockfiles.'
-    )
+    helpmsg = plugins.get_helpmsg(name)
 
     @dataclass
     class RepoInfo():
@@ -78,6 +78,7 @@ from kas.includehandler import ConfigFile, \
     SOURCE_DIR_OVERRIDE_KEY, SOURCE_DIR_HOST_OVERRIDE_KEY
 from kas.plugins.build import Build
 from kas.kasusererror import KasUserError, MissingModuleError
+from kas import plugins
 
 try:
     from kconfiglib import Kconfig, Symbol, Choice, KconfigError, \
@@ -132,9 +133,7 @@ class Menu:
     """
 
     name = 'menu'
-    helpmsg = (
-        'Provides a configuration menu and triggers the build of the choices.'
-    )
+    helpmsg = plugins.get_helpmsg(name)
 
     @classmethod
     def setup_parser(cls, parser):
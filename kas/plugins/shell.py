@@ -50,6 +50,7 @@ from kas.libkas import setup_parser_keep_config_unchanged_arg
 from kas.libkas import setup_parser_preserve_env_arg
 from kas.libkas import run_handle_preserve_env_arg
 from kas.kasusererror import CommandExecError
+from kas import plugins
 
 __license__ = 'MIT'
 __copyright__ = 'Copyright (c) Siemens AG, 2017-2018'
@@ -63,7 +64,7 @@ class Shell:
     """
 
     name = 'shell'
-    helpmsg = 'Run a shell in the build environment.'
+    helpmsg = plugins.get_helpmsg(name)
 
     @classmethod
     def setup_parser(cls, parser):
@@ -25,17 +25,23 @@
 
 import re
 import os
+import asyncio
+import hashlib
+import json
 import linecache
 import logging
 import shutil
+import time
 from datetime import datetime
 from urllib.parse import urlparse
 from tempfile import TemporaryDirectory
+from contextlib import asynccontextmanager
 from .context import get_context
-from .libkas import run_cmd_async, run_cmd
+from .libkas import run_cmd_async, run_cmd, file_lock, get_batch_cmd
+from .scheduler import get_url_host
+from .gitrefs import GitRefReader
 from .kasusererror import KasUserError
 from functools import cached_property
-from git import Repo as GitPythonRepo
 
 __license__ = 'MIT'
 __copyright__ = 'Copyright (c) Siemens AG, 2017-2018'
@@ -83,6 +89,118 @@ class PatchApplyError(KasUserError):
         super().__init__(msg)
 
 
+class _UnknownLayout(Exception):
+    """
+        The repository layout cannot be resolved without the VCS commands.
+    """
+    pass
+
+
+def _is_git_dir(path):
+    return os.path.isfile(os.path.join(path, 'HEAD')) and \
+        (os.path.isdir(os.path.join(path, 'objects'))
+         or os.path.isfile(os.path.join(path, 'commondir')))
+
+
+def _read_gitfile(path):
+    try:
+        with open(path, 'r') as f:
+            content = f.read().strip()
+    except OSError:
+        return None
+    if not content.startswith('gitdir: '):
+        return None
+    return os.path.join(os.path.dirname(path), content[len('gitdir: '):])
+
+
+def _find_git_toplevel(path):
+    """
+        Returns the work tree root of the git repository containing path,
+        following the discovery rules of git. Like git, the search stops at
+        filesystem boundaries.
+    """
+    dev = os.stat(path).st_dev
+    while True:
+        dotgit = os.path.join(path, '.git')
+        if os.path.isdir(dotgit):
+            if not _is_git_dir(dotgit):
+                raise _UnknownLayout()
+            return path
+        if os.path.isfile(dotgit):
+            gitdir = _read_gitfile(dotgit)
+            if not gitdir or not _is_git_dir(gitdir):
+                raise _UnknownLayout()
+            return path
+        if _is_git_dir(path):
+            # inside a git directory or a bare repository
+            raise _UnknownLayout()
+        parent = os.path.dirname(path)
+        if parent == path or os.stat(parent).st_dev != dev:
+            return None
+        path = parent
+
+
+def _get_submodule_paths(toplevel):
+    paths = []
+    try:
+        with open(os.path.join(toplevel, '.gitmodules'), 'r') as f:
+            for line in f:
+                match = re.match(r'^\s*path\s*=\s*(.+?)\s*$', line)
+                if match:
+                    paths.append(match.group(1).strip('"'))
+    except OSError:
+        pass
+    return paths
+
+
+def _find_git_root(path):
+    """
+        Returns the root of the git repository containing path or the root of
+        its superproject, if it is a submodule.
+    """
+    toplevel = _find_git_toplevel(path)
+    if toplevel is None or os.path.dirname(toplevel) == toplevel:
+        return toplevel
+    parent = os.path.dirname(toplevel)
+    superproject = _find_git_toplevel(parent)
+    if superproject is None:
+        return toplevel
+    relpath = os.path.relpath(toplevel, superproject)
+    if relpath in map(os.path.normpath, _get_submodule_paths(superproject)):
+        return superproject
+    # a nested repository, git decides if it is tracked by the outer one
+    raise _UnknownLayout()
+
+
+def _find_hg_root(path):
+    while True:
+        if os.path.isdir(os.path.join(path, '.hg')):
+            return path
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+
+def _get_patched_dirs(path):
+    """
+        Returns the directories of the files modified by a patch (in -p1
+        format).
+    """
+    dirs = set()
+    with open(path, 'r', errors='replace') as f:
+        for line in f:
+            if not line.startswith(('--- ', '+++ ')):
+                continue
+            name = line[4:].split('\t')[0].strip()
+            if name == '/dev/null' or '/' not in name:
+                continue
+            dirname = os.path.dirname(name.split('/', 1)[1])
+            if dirname:
+                dirs.add(dirname)
+    return dirs
+
+
 class Repo:
     """
         Represents a repository in the kas configuration.
@@ -134,24 +252,12 @@ class Repo:
     @cached_property
     def revision(self):
         if self.commit:
-            (_, output) = run_cmd(self.get_commit_cmd(),
-                                  cwd=self.path, fail=False)
-            if output:
-                return output.strip()
-            return self.commit
+            return self.resolve_commit() or self.commit
         if self.tag:
-            (_, output) = run_cmd(self.resolve_tag_cmd(),
-                                  cwd=self.path, fail=False)
-            if output:
-                return output.strip()
-            return self.tag
+            return self.resolve_tag() or self.tag
         branch = self.branch or self.refspec
         if branch:
-            (_, output) = run_cmd(self.resolve_branch_cmd(),
-                                  cwd=self.path, fail=False)
-            if output:
-                return output.strip()
-            return branch
+            return self.resolve_branch() or branch
         return None
 
     @cached_property
@@ -184,6 +290,14 @@ class Repo:
             return None
         return get_context().keyhandler[self.signers_type]
 
+    @property
+    def patch_repos(self):
+        """
+            Returns the names of the repos that provide the patches of this
+            repo.
+        """
+        return [p['repo'] for p in self._patches or []]
+
     def check_signature(self):
         self.keyhandler.prepare_validation(self)
         (ret, _, err) = run_cmd(self.is_signed_cmd(),
@@ -204,6 +318,44 @@ class Repo:
         """
         raise NotImplementedError("Repo type not implemented")
 
+    def get_sparse_paths(self):
+        """
+            Returns the directories (relative to the repo) that are checked
+            out if KAS_SPARSE_CHECKOUT is set, or None if the whole repo is
+            checked out. These are the layers and the directories that
+            contain configuration files, patches and signer keys of the
+            repo. Files in the root directory are always checked out.
+        """
+        ctx = get_context()
+        if not ctx.repo_sparse_checkout or self.operations_disabled:
+            return None
+        # the repo providing the build system needs more than its layers
+        if any(os.path.exists(os.path.join(self.path, script))
+               for script in ['oe-init-build-env', 'isar-init-build-env']):
+            return None
+
+        paths = []
+        for layer in self._layers:
+            if os.path.normpath(layer) == '.':
+                return None
+            paths.append(layer)
+        for repo in ctx.config.repo_dict.values():
+            for patch in repo._patches or []:
+                if patch['repo'] == self.name:
+                    # the path is either a patch file or a series directory
+                    paths += [patch['path'], os.path.dirname(patch['path'])]
+        for signer in ctx.config.get_signers_config().values():
+            if signer.get('repo') == self.name and 'path' in signer:
+                paths.append(os.path.dirname(signer['path']))
+        for config_file in ctx.config.handler.config_files:
+            paths.append(os.path.relpath(
+                os.path.dirname(os.path.abspath(config_file.filename)),
+                self.path))
+
+        paths = [os.path.normpath(p) for p in paths]
+        return sorted(set(p for p in paths
+                          if p != '.' and not p.startswith('..')))
+
     def contains_path(self, path):
         (ret, _) = run_cmd(self.contains_path_cmd(str(path)),
                            cwd=self.path, fail=False)
@@ -337,7 +489,29 @@ class Repo:
             Checks if path is under version control and returns its root path.
             If the repo is a submodule, the root path of the super-repository
             is returned.
+
+            The repository is detected by walking up the directory tree. Only
+            for layouts that are not covered by this, the ``git`` and ``hg``
+            commands are used. Within a kas run, results are cached per
+            directory.
         """
+        ctx = get_context()
+        cache = ctx.root_paths if ctx else {}
+        key = os.path.realpath(path)
+        if key not in cache:
+            try:
+                if not os.path.isdir(path):
+                    raise _UnknownLayout()
+                root = _find_git_root(key)
+                if root is None:
+                    root = _find_hg_root(key)
+            except _UnknownLayout:
+                root = Repo._get_root_path_cmd(path)
+            cache[key] = root
+        return cache[key] or (path if fallback else None)
+
+    @staticmethod
+    def _get_root_path_cmd(path):
         git_cmd = ['git', 'rev-parse', '--show-toplevel',
                    '--show-superproject-working-tree']
         (ret, output) = run_cmd(git_cmd, cwd=path, fail=False)
@@ -348,8 +522,7 @@ class Repo:
                                 cwd=path, fail=False)
         if ret == 0:
             return output.strip()
-
-        return path if fallback else None
+        return None
 
 
 class RepoImpl(Repo):
@@ -359,37 +532,43 @@ class RepoImpl(Repo):
 
     async def fetch_async(self):
         """
-            Starts asynchronous repository fetch.
+            Starts asynchronous repository fetch. Each revision of a
+            repository is only fetched once per run.
         """
+        fetched = get_context().fetched_repos
+        key = (self.path, self.effective_url, self.commit, self.tag,
+               self.branch, self.refspec)
+        if key in fetched:
+            return 0
+        ret = await self._fetch_async()
+        fetched.add(key)
+        return ret
 
+    async def _fetch_async(self):
         if self.operations_disabled:
             return 0
 
         refdir = get_context().kas_repo_ref_dir
-        sdir = os.path.join(refdir, self.qualified_name) if refdir else None
+        sdir = self._get_ref_repo_dir()
 
         # fetch to refdir
         if refdir and not os.path.exists(sdir):
             os.makedirs(refdir, exist_ok=True)
-            with TemporaryDirectory(prefix=self.qualified_name + '.',
-                                    dir=refdir) as tmpdir:
-                (retc, _) = await run_cmd_async(
-                    self.clone_cmd(tmpdir, createref=True),
-                    cwd=get_context().kas_work_dir)
-
-                logging.debug('Created repo ref for %s', self.qualified_name)
-                try:
-                    os.rename(tmpdir, sdir)
-                except OSError:
-                    logging.debug('repo %s already cloned by other instance',
-                                  self.qualified_name)
+            async with self._ref_repo_lock(sdir):
+                # another instance may have created it while we waited
+                if not os.path.exists(sdir):
+                    await self._create_ref_repo(refdir, sdir)
 
         if not os.path.exists(self.path):
             logging.info('Cloning repository %s', self.name)
             os.makedirs(os.path.dirname(self.path), exist_ok=True)
-            (retc, _) = await run_cmd_async(
-                self.clone_cmd(sdir, createref=False),
-                cwd=get_context().kas_work_dir)
+            async with self._ref_repo_lock(sdir, shared=True):
+                (retc, _) = await run_cmd_async(
+                    self.clone_cmd(sdir, createref=False),
+                    cwd=get_context().kas_work_dir)
+
+        if sdir and os.path.isdir(sdir):
+            self.update_ref_repo_path(sdir)
 
         # Make sure the remote origin is set to the value
         # in the kas file to avoid surprises
@@ -406,33 +585,17 @@ class RepoImpl(Repo):
            and self.refspec is None:
             return 0
 
-        if not get_context().update:
-            # Do commit/tag/branch/refspec exist in the current repository?
-            (retc, output) = await run_cmd_async(self.contains_refspec_cmd(),
-                                                 cwd=self.path,
-                                                 fail=False)
-            if retc == 0:
-                logging.info('Repository %s already contains %s as %s',
-                             self.name,
-                             self.commit or self.tag or self.branch
-                             or self.refspec,
-                             output.strip())
-                # if branch is specified, check if it contains the commit
-                # also in our local clone
-                depth = get_context().repo_clone_depth
-                if self.branch and self.commit and not depth:
-                    (_, output) = await run_cmd_async(
-                        self.branch_contains_ref(), cwd=self.path, fail=False)
-                    if output.strip():
-                        return retc
-                else:
-                    return retc
+        if not get_context().update and await self._contains_revision():
+            return 0
+
+        if sdir and await self._fetch_from_ref_repo(sdir):
+            logging.info('Repository %s updated', self.name)
+            return 0
 
         # Try to fetch if commit/tag/branch/refspec is missing or if --update
         # argument was passed
-        (retc, output) = await run_cmd_async(self.fetch_cmd(),
-                                             cwd=self.path,
-                                             fail=False)
+        (retc, output) = await self._run_fetch_cmd(self.fetch_cmd,
+                                                   self.path)
         if retc:
             logging.warning('Could not update repository %s: %s',
                             self.name, output)
@@ -440,9 +603,216 @@ class RepoImpl(Repo):
             logging.info('Repository %s updated', self.name)
         return 0
 
-    def checkout(self):
+    async def _run_fetch_cmd(self, get_cmd, cwd, depth=None):
+        """
+            Runs the fetch command returned by ``get_cmd``. If the commit is
+            fetched by its SHA and this fails, the server might not allow
+            that. This is remembered for the host and the command is
+            retried (see :meth:`fetches_by_sha`).
+        """
+        by_sha = self.fetches_by_sha(depth)
+        (retc, output) = await run_cmd_async(get_cmd(), cwd=cwd, fail=False)
+        if retc and by_sha:
+            host = get_url_host(self.effective_url)
+            logging.info('Could not fetch commit %s of repository %s, '
+                         'fetching branches from %s instead',
+                         self.commit, self.name, host or 'local remotes')
+            get_context().fetch_by_sha_refused.add(host)
+            (retc, output) = await run_cmd_async(get_cmd(), cwd=cwd,
+                                                 fail=False)
+        return (retc, output)
+
+    def fetches_by_sha(self, depth=None):
+        """
+            Returns True if the commit is fetched by its SHA instead of
+            fetching the branches that contain it. The clone depth defaults
+            to KAS_CLONE_DEPTH.
+        """
+        return False
+
+    def _run_resolve_cmd(self, cmd):
+        (retc, output) = run_cmd(cmd, cwd=self.path, fail=False)
+        return output.strip() if retc == 0 and output.strip() else None
+
+    def resolve_commit(self):
+        """
+            Returns the id of the configured commit (or the checked out one,
+            if no commit is configured), or None if it cannot be resolved.
+        """
+        return self._run_resolve_cmd(self.get_commit_cmd())
+
+    def resolve_tag(self):
+        """
+            Returns the id of the commit the configured tag points to, or
+            None if the tag does not exist.
+        """
+        return self._run_resolve_cmd(self.resolve_tag_cmd())
+
+    def resolve_branch(self):
+        """
+            Returns the id of the commit the configured branch (of the
+            remote) points to, or None if the branch does not exist.
+        """
+        return self._run_resolve_cmd(self.resolve_branch_cmd())
+
+    def get_file_reader(self):
+        """
+            Returns a function that returns the content of a file (path
+            relative to the repo) in the revision to be checked out, or
+            None if the files can only be read after the checkout. The
+            function raises a FileNotFoundError for missing files.
+        """
+        return None
+
+    def update_ref_repo_path(self, sdir):
+        """
+            Updates the path of the reference repository the repository
+            takes objects from, if the reference repository was relocated
+            (e.g. if KAS_REPO_REF_DIR is mounted somewhere else).
+        """
+        pass
+
+    async def _contains_revision(self, log=True):
+        """
+            Checks if the commit/tag/branch/refspec exists in the repository.
+        """
+        objtype = await self.get_object_type_async()
+        if not objtype:
+            return False
+        if log:
+            logging.info('Repository %s already contains %s as %s',
+                         self.name,
+                         self.commit or self.tag or self.branch
+                         or self.refspec,
+                         objtype)
+        # if branch is specified, check if it contains the commit
+        # also in our local clone
+        depth = get_context().repo_clone_depth
+        if self.branch and self.commit and not depth:
+            return self.branch_contains(*await run_cmd_async(
+                self.branch_contains_ref(), cwd=self.path, fail=False))
+        return True
+
+    async def get_object_type_async(self):
+        """
+            Returns the type of the object the commit/tag/branch/refspec
+            refers to, or None if the repository does not contain it.
+        """
+        (retc, output) = await run_cmd_async(self.contains_refspec_cmd(),
+                                             cwd=self.path,
+                                             fail=False)
+        return None if retc else output.strip()
+
+    def branch_contains(self, retc, output):
+        """
+            Evaluates the result of the :meth:`branch_contains_ref` command.
+        """
+        return retc == 0 and bool(output.strip())
+
+    def _get_ref_repo_dir(self):
+        """
+            Returns the path of the reference repository, or None if
+            KAS_REPO_REF_DIR is not set.
+        """
+        refdir = get_context().kas_repo_ref_dir
+        return os.path.join(refdir, self.qualified_name) if refdir else None
+
+    @asynccontextmanager
+    async def _ref_repo_lock(self, sdir, shared=False):
+        """
+            Locks the reference repository sdir. Readers of the reference
+            repository hold a shared lock, while it is created or updated
+            an exclusive one. Nothing is locked if sdir is None.
+        """
+        if not sdir:
+            yield
+            return
+        async with file_lock(sdir + '.lock', shared=shared,
+                             timeout=get_context().repo_ref_lock_timeout):
+            yield
+
+    async def _create_ref_repo(self, refdir, sdir):
         """
-            Checks out the correct revision of the repo.
+            Clones the reference repository sdir. Must be called with the
+            exclusive lock held.
+        """
+        # As we hold the lock, temporary clones of this repo are leftovers
+        # of killed instances.
+        prefix = f'.{self.qualified_name}.tmp-'
+        for entry in os.listdir(refdir):
+            if entry.startswith(prefix):
+                logging.debug('Removing stale repo ref %s', entry)
+                shutil.rmtree(os.path.join(refdir, entry), ignore_errors=True)
+
+        with TemporaryDirectory(prefix=prefix, dir=refdir) as tmpdir:
+            await run_cmd_async(self.clone_cmd(tmpdir, createref=True),
+                                cwd=get_context().kas_work_dir)
+            os.rename(tmpdir, sdir)
+        logging.debug('Created repo ref for %s', self.qualified_name)
+
+    @staticmethod
+    def _get_ref_repo_age(sdir):
+        mtimes = []
+        for name in ['FETCH_HEAD', 'HEAD']:
+            try:
+                mtimes.append(os.stat(os.path.join(sdir, name)).st_mtime)
+            except OSError:
+                pass
+        return time.time() - max(mtimes, default=0)
+
+    async def _fetch_from_ref_repo(self, sdir):
+        """
+            Fetches the repository from its reference repository. The
+            reference repository is updated from upstream first, unless it
+            is younger than KAS_REPO_REF_MAX_AGE and already contains the
+            requested revision. Returns True if the requested revision is
+            available afterwards.
+        """
+        try:
+            fetch_cmd = self.fetch_from_ref_cmd(sdir)
+            self.update_ref_cmd()
+        except NotImplementedError:
+            return False
+        ctx = get_context()
+        if self._get_ref_repo_age(sdir) < ctx.repo_ref_max_age:
+            async with self._ref_repo_lock(sdir, shared=True):
+                (retc, _) = await run_cmd_async(fetch_cmd, cwd=self.path,
+                                                fail=False)
+            if retc == 0 and await self._contains_revision(log=False):
+                return True
+
+        started = time.time()
+        async with self._ref_repo_lock(sdir):
+            # skip the update if another instance did it while we waited
+            if self._get_ref_repo_age(sdir) > time.time() - started:
+                # the reference repository is never shallow
+                (retc, output) = await self._run_fetch_cmd(
+                    self.update_ref_cmd, sdir, depth=0)
+                if retc:
+                    logging.warning('Could not update reference repository '
+                                    'of %s: %s', self.name, output)
+                    return False
+                logging.debug('Updated repo ref for %s', self.qualified_name)
+        async with self._ref_repo_lock(sdir, shared=True):
+            (retc, _) = await run_cmd_async(fetch_cmd, cwd=self.path,
+                                            fail=False)
+        return retc == 0 and await self._contains_revision(log=False)
+
+    def checkout(self, sparse=True):
+        """
+            Checks out the correct revision of the repo. With sparse=False,
+            the whole repo is checked out, even if KAS_SPARSE_CHECKOUT is
+            set.
+
+            .. note:: termination point of the asyncio event loop.
+        """
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(self.checkout_async(sparse))
+
+    async def checkout_async(self, sparse=True):
+        """
+            Checks out the correct revision of the repo asynchronously (see
+            :meth:`checkout`).
         """
         if self.operations_disabled \
             or (self.commit is None and self.tag is None
@@ -451,24 +821,57 @@ class RepoImpl(Repo):
 
         if not get_context().force_checkout:
             # Check if repos is dirty
-            if self.dirty:
+            if await self._is_dirty_async():
                 logging.warning('Repo %s is dirty - no checkout', self.name)
                 return
 
+        (desired_ref, is_branch) = await self._get_desired_ref_async()
+
+        paths = None
+        if sparse:
+            paths = self.get_sparse_paths()
+            if not await self._setup_sparse_checkout(paths):
+                paths = None
+        elif get_context().repo_sparse_checkout:
+            await self._setup_sparse_checkout(None)
+
+        await run_cmd_async(self.checkout_cmd(desired_ref, is_branch),
+                            cwd=self.path)
+        # the messages of a repo are logged together, as checkouts run
+        # concurrently
+        if paths is not None:
+            logging.debug('Repository %s sparsely checked out: %s',
+                          self.name, ', '.join(paths) or '/')
+        logging.info(f'Repository {self.name} checked out to {desired_ref}')
+
+    async def _is_dirty_async(self):
+        """
+            Returns :attr:`dirty` without blocking the event loop.
+        """
+        if 'dirty' not in self.__dict__ and self.url:
+            (_, output) = await run_cmd_async(self.is_dirty_cmd(),
+                                              cwd=self.path, fail=False)
+            # fill the cache of the property
+            self.__dict__['dirty'] = bool(output)
+        return self.dirty
+
+    def _get_desired_ref(self, check_branch=True):
+        """
+            Returns the revision to check out and whether it is a branch.
+            Unless check_branch is False, it is verified that the branch
+            contains the requested commit.
+        """
         if self.tag and self.branch:
             raise RepoRefError(
                 f'Both tag "{self.tag}" and branch "{self.branch}" '
                 f'cannot be specified for repository "{self.name}"')
 
         if self.tag:
-            (retc, output) = run_cmd(self.resolve_tag_cmd(),
-                                     cwd=self.path,
-                                     fail=False)
-            if retc:
+            desired_ref = self.resolve_tag()
+            if not desired_ref:
                 raise RepoRefError(f'Tag "{self.tag}" cannot be found '
                                    f'in repository "{self.name}"')
 
-            desired_ref = output.strip()
             if self.commit and desired_ref != self.commit:
                 # Ensure provided commit and tag match
                 raise RepoRefError(f'Provided tag "{self.tag}" '
@@ -477,26 +880,16 @@ class RepoImpl(Repo):
                                    f'repository "{self.name}", aborting!')
             is_branch = False
         elif self.branch:
-            (retc, output) = run_cmd(self.resolve_branch_cmd(),
-                                     cwd=self.path,
-                                     fail=False)
-            if retc:
+            branch_ref = self.resolve_branch()
+            if not branch_ref:
                 raise RepoRefError(
                     f'Branch "{self.branch}" cannot be found '
                     f'in repository "{self.name}"')
-            # check if branch contains the requested commit.
-            # skip check on shallow clones, as branch information is missing
-            if self.commit and not get_context().repo_clone_depth:
-                (_, output) = run_cmd(self.branch_contains_ref(),
-                                      cwd=self.path,
-                                      fail=False)
-                if not output.strip():
-                    raise RepoRefError(
-                        f'Branch "{self.branch}" in '
-                        f'repository "{self.name}" does not contain '
-                        f'commit "{self.commit}"')
-
-            desired_ref = self.commit or output.strip()
+            if check_branch and self._checks_branch():
+                self._check_branch_contains(run_cmd(
+                    self.branch_contains_ref(), cwd=self.path, fail=False))
+
+            desired_ref = self.commit or branch_ref
             is_branch = True
         elif self.commit:
             desired_ref = self.commit
@@ -505,26 +898,78 @@ class RepoImpl(Repo):
             desired_ref = self.refspec
             is_branch = False
 
-        run_cmd(self.checkout_cmd(desired_ref, is_branch), cwd=self.path)
-        logging.info(f'Repository {self.name} checked out to {desired_ref}')
+        return (desired_ref, is_branch)
 
-    async def apply_patches_async(self):
+    async def _get_desired_ref_async(self):
         """
-            Applies patches to a repository asynchronously.
+            Like :meth:`_get_desired_ref`, but checks the branch without
+            blocking the event loop.
         """
-        if self.operations_disabled or not self._patches:
-            return 0
+        (desired_ref, is_branch) = self._get_desired_ref(check_branch=False)
+        if is_branch and self._checks_branch():
+            self._check_branch_contains(await run_cmd_async(
+                self.branch_contains_ref(), cwd=self.path, fail=False))
+        return (desired_ref, is_branch)
+
+    def _checks_branch(self):
+        # skip check on shallow clones, as branch information is missing
+        return bool(self.branch and self.commit
+                    and not get_context().repo_clone_depth)
+
+    def _check_branch_contains(self, result):
+        """
+            Raises a RepoRefError if the result of the
+            :meth:`branch_contains_ref` command shows that the branch does
+            not contain the requested commit.
+        """
+        if not self.branch_contains(*result):
+            raise RepoRefError(
+                f'Branch "{self.branch}" in '
+                f'repository "{self.name}" does not contain '
+                f'commit "{self.commit}"')
 
-        if self.dirty:
-            logging.warning(f'Repo {self.name} is dirty - no patching')
-            return 0
+    async def _setup_sparse_checkout(self, paths):
+        """
+            Restricts the working copy to the given directories or checks
+            out the whole repo if paths is None. Returns False if there was
+            nothing to do.
+        """
+        sparse_file = os.path.join(self.path, '.git', 'info',
+                                   'sparse-checkout')
+        if paths is None and not os.path.exists(sparse_file):
+            return False
+        try:
+            cmd = self.sparse_checkout_cmd(paths)
+        except NotImplementedError:
+            return False
+        await run_cmd_async(cmd, cwd=self.path)
+        return True
 
-        (retc, _) = await run_cmd_async(self.prepare_patches_cmd(),
-                                        cwd=self.path)
+    async def _extend_sparse_checkout(self, patches):
+        """
+            Adds the directories that are modified by the patches to a
+            sparse checkout.
+        """
+        if self.get_sparse_paths() is None:
+            return
+        paths = set()
+        for (path, _) in patches:
+            paths.update(_get_patched_dirs(path))
+        try:
+            cmd = self.sparse_checkout_cmd(sorted(paths), add=True)
+        except NotImplementedError:
+            return
+        if paths:
+            await run_cmd_async(cmd, cwd=self.path)
 
+    def get_patch_files(self):
+        """
+            Returns the patch files of this repo as list of
+            (path, patch id) tuples, in the order they are applied.
+        """
         my_patches = []
 
-        for patch in self._patches:
+        for patch in self._patches or []:
             other_repo = get_context().config.repo_dict.get(patch['repo'],
                                                             None)
 
@@ -535,7 +980,6 @@ class RepoImpl(Repo):
                                         f'patch entry: {patch["id"]})')
 
             path = os.path.join(other_repo.path, patch['path'])
-            cmd = []
 
             if os.path.isfile(path):
                 my_patches.append((path, patch['id']))
@@ -555,8 +999,129 @@ class RepoImpl(Repo):
                     'Could not find patch. '
                     f'(patch path: {path}, repo: {self.name}, patch '
                     f'entry: {patch["id"]})')
+        return my_patches
+
+    async def apply_patches_async(self):
+        """
+            Applies patches to a repository asynchronously.
+        """
+        if self.operations_disabled or not self._patches:
+            return 0
+
+        if self.dirty:
+            logging.warning(f'Repo {self.name} is dirty - no patching')
+            return 0
+
+        (retc, _) = await run_cmd_async(self.prepare_patches_cmd(),
+                                        cwd=self.path)
+
+        my_patches = self.get_patch_files()
+        await self._extend_sparse_checkout(my_patches)
+
+        sdir = self._get_ref_repo_dir()
+        cache_ref = None
+        if sdir and os.path.isdir(sdir):
+            cache_ref = await self._get_patch_cache_ref(my_patches)
+        if cache_ref and await self._restore_patched_async(sdir, cache_ref):
+            logging.info('Patches of repository %s taken from reference '
+                         'repository (%s)', self.name, cache_ref)
+            return 0
+
+        await self._apply_patch_series_async(my_patches,
+                                             cached=cache_ref is not None)
 
-        for (path, patch_id) in my_patches:
+        if cache_ref:
+            await self._store_patched_async(sdir, cache_ref)
+        return 0
+
+    async def _get_patch_cache_ref(self, patches):
+        """
+            Returns the ref the patched revision is cached under in the
+            reference repository, or None if caching is not supported. The
+            key covers everything the patch commits are made of, so that a
+            cached revision is identical to a fresh application. Patches
+            without a date are not cached, as their commits are dated by the
+            modification time of the patch file.
+        """
+        try:
+            cmd = self.get_committer_ident_cmd()
+            self.fetch_patched_cmd('', '')
+        except NotImplementedError:
+            return None
+        # the hooks may change the commits, and restoring does not run them
+        if await self._has_commit_hooks_async():
+            return None
+        (retc, output) = await run_cmd_async(cmd, cwd=self.path, fail=False)
+        base = self.resolve_commit()
+        if retc or not base:
+            return None
+        # the ident ends with the current date, which is not used
+        ident = output.strip().rsplit(' ', 2)[0]
+        entries = []
+        for (path, patch_id) in patches:
+            if not self.get_patch_timestamp(path):
+                return None
+            with open(path, 'rb') as f:
+                digest = hashlib.sha256(f.read()).hexdigest()
+            entries.append([digest, *self._get_patch_commit_info(
+                path, patch_id, cached=True)])
+        key = hashlib.sha256(
+            json.dumps([base, ident, entries]).encode()).hexdigest()
+        return f'refs/kas/patched/{key}'
+
+    async def _restore_patched_async(self, sdir, ref):
+        """
+            Checks out the patched revision cached under ref in the
+            reference repository. Returns False if it is not cached.
+        """
+        async with self._ref_repo_lock(sdir, shared=True):
+            (retc, _) = await run_cmd_async(self.fetch_patched_cmd(sdir, ref),
+                                            cwd=self.path, fail=False)
+        if retc:
+            return False
+        cmd = self.checkout_patched_cmd(ref)
+        (retc, out, err) = await run_cmd_async(
+            cmd, cwd=self.path, fail=False, capture_stderr=True)
+        if retc:
+            raise PatchApplyError('Could not check out patched files: repo: '
+                                  f'{self.name}', cmd, out, err)
+        return True
+
+    async def _store_patched_async(self, sdir, ref):
+        """
+            Caches the patched revision under ref in the reference
+            repository.
+        """
+        # refs are updated atomically, so readers need not be excluded
+        async with self._ref_repo_lock(sdir, shared=True):
+            (retc, output) = await run_cmd_async(
+                self.store_patched_cmd(sdir, ref), cwd=self.path, fail=False)
+        if retc:
+            logging.warning('Could not cache patches of repository %s: %s',
+                            self.name, output)
+
+    async def _has_commit_hooks_async(self):
+        """
+            Returns True if committing a patch runs hooks of the repository.
+        """
+        try:
+            cmd = self.get_hooks_path_cmd()
+        except NotImplementedError:
+            return False
+        (retc, output) = await run_cmd_async(cmd, cwd=self.path, fail=False)
+        if retc:
+            return False
+        hooks_path = os.path.join(self.path, output.strip())
+        return any(os.access(os.path.join(hooks_path, hook), os.X_OK)
+                   for hook in self.commit_hooks)
+
+    async def _apply_patch_series_async(self, patches, cached=False):
+        """
+            Applies and commits the patches one by one in the worktree. If
+            the result is cached, the commits do not depend on the
+            workspace (see :meth:`_get_patch_commit_info`).
+        """
+        for (path, patch_id) in patches:
             cmd = self.apply_patches_file_cmd(path)
             (retc, out, err) = await run_cmd_async(
                 cmd, cwd=self.path, fail=False, capture_stderr=True)
@@ -577,14 +1142,9 @@ class RepoImpl(Repo):
                 raise PatchApplyError('Could not add patched files: repo: '
                                       f'{self.name}', cmd, out, err)
 
-            timestamp = self.get_patch_timestamp(path)
-            if not timestamp:
-                dt = datetime.fromtimestamp(os.path.getmtime(path))
-                timestamp = dt.astimezone().strftime(
-                    "%a, %d %b %Y %H:%M:%S %z")
-
+            (timestamp, msg) = self._get_patch_commit_info(path, patch_id,
+                                                           cached)
             env = get_context().environ.copy()
-            msg = f'kas: {patch_id}\n\npatch {path} applied by kas'
             cmd = self.commit_cmd(env, 'kas <kas@example.com>', msg,
                                   timestamp)
             (retc, out, err) = await run_cmd_async(
@@ -593,7 +1153,24 @@ class RepoImpl(Repo):
                 raise PatchApplyError('Could not commit patch changes. repo: '
                                       f'{self.name}', cmd, out, err)
 
-        return 0
+    def _get_patch_commit_info(self, path, patch_id, cached=False):
+        """
+            Returns the date and the message of the commit of a patch. If
+            the patched revision is cached, the message names the patch
+            path relative to the repo it is taken from, so that the commit
+            is the same in all workspaces.
+        """
+        timestamp = self.get_patch_timestamp(path)
+        if not timestamp:
+            dt = datetime.fromtimestamp(os.path.getmtime(path))
+            timestamp = dt.astimezone().strftime(
+                "%a, %d %b %Y %H:%M:%S %z")
+        if cached:
+            patch = next(p for p in self._patches if p['id'] == patch_id)
+            other_repo = get_context().config.repo_dict[patch['repo']]
+            path = os.path.relpath(path, other_repo.path)
+        msg = f'kas: {patch_id}\n\npatch {path} applied by kas'
+        return (timestamp, msg)
 
     def resolve_local(self):
         (retc, output) = run_cmd(self.get_remote_url_cmd(),
@@ -601,10 +1178,9 @@ class RepoImpl(Repo):
         if retc == 0:
             self.url = output.strip()
 
-        (retc, output) = run_cmd(self.get_commit_cmd(),
-                                 cwd=self.path, fail=False)
-        if retc == 0:
-            self.commit = output.strip()
+        commit = self.resolve_commit()
+        if commit:
+            self.commit = commit
         if self.url and self.commit:
             logging.debug('Repository %s resolved to %s @ %s',
                           self.name, self.url, self.commit)
@@ -615,6 +1191,9 @@ class GitRepo(RepoImpl):
         Provides the git functionality for a Repo.
     """
 
+    commit_hooks = ['pre-commit', 'prepare-commit-msg', 'commit-msg',
+                    'post-commit']
+
     @staticmethod
     def get_type():
         return 'git'
@@ -628,6 +1207,9 @@ class GitRepo(RepoImpl):
 
     def clone_cmd(self, srcdir, createref):
         cmd = ['git', 'clone', '-q']
+        if not createref:
+            # the requested revision is checked out later
+            cmd.append('--no-checkout')
 
         depth = get_context().repo_clone_depth
         if depth:
@@ -648,8 +1230,35 @@ class GitRepo(RepoImpl):
                     cmd.extend(['--branch',
                                 self.remove_ref_prefix(self.branch)])
 
+        clone_filter = get_context().repo_clone_filter
+        if clone_filter:
+            cmd.append(f'--filter={clone_filter}')
+
+        # local clones from the reference repo are cheap anyway
+        from_upstream = createref or not srcdir or clone_filter
+        if get_context().repo_clone_minimal and from_upstream:
+            cmd.extend(['--single-branch', '--no-tags'])
+            branch = self._get_minimal_branch()
+            if branch and '--branch' not in cmd:
+                cmd.extend(['--branch', branch])
+
+        if get_context().repo_sparse_checkout and not createref:
+            # only check out the files in the root directory for now
+            cmd.append('--sparse')
+
         if createref:
+            if get_context().repo_ref_shared:
+                cmd.extend(['--config', 'gc.pruneExpire=never'])
             cmd.extend([self.effective_url, '--bare', srcdir])
+        elif srcdir and clone_filter:
+            # A partial reference repo cannot serve its missing objects.
+            # Clone from upstream instead, so that they are fetched from
+            # there on checkout. All other objects are still taken from
+            # the reference repo.
+            cmd.extend(['--reference', srcdir, self.effective_url,
+                        self.path])
+        elif srcdir and get_context().repo_ref_shared:
+            cmd.extend(['--shared', srcdir, self.path])
         elif srcdir:
             cmd.extend([srcdir, '--reference', srcdir, self.path])
         else:
@@ -661,15 +1270,33 @@ class GitRepo(RepoImpl):
         return ['git', 'commit', '-a', '--author', author, '-m', msg,
                 '--date', date]
 
-    def contains_refspec_cmd(self):
+    def _get_contained_rev(self):
         branch = self.branch or self.refspec
         if branch and branch.startswith('refs/'):
             branch = 'remotes/origin/' + self.remove_ref_prefix(branch)
-        return ['git', 'cat-file', '-t', self.commit or self.tag or branch]
+        return self.commit or self.tag or branch
+
+    def contains_refspec_cmd(self):
+        return ['git', 'cat-file', '-t', self._get_contained_rev()]
+
+    async def get_object_type_async(self):
+        # answered by one cat-file process per repo
+        batch_cmd = get_batch_cmd(['git', 'cat-file', '--batch-check'],
+                                  self.path)
+        answer = await batch_cmd.query(self._get_contained_rev())
+        fields = (answer or '').split()
+        if len(fields) != 3:
+            # missing or ambiguous
+            return None
+        return fields[1]
 
     def fetch_cmd(self):
         cmd = ['git', 'fetch', '-q']
 
+        minimal = get_context().repo_clone_minimal
+        if minimal:
+            cmd.append('--no-tags')
+
         depth = 0 if self.refspec else get_context().repo_clone_depth
         if depth:
             cmd.extend(['--depth', str(depth)])
@@ -679,20 +1306,183 @@ class GitRepo(RepoImpl):
             return cmd
 
         # only fetch this commit (branch information is lost)
-        if depth and self.commit:
+        if self.fetches_by_sha(depth):
             cmd.extend(['origin', self.commit])
             return cmd
 
         branch = self.branch or self.refspec
-        if branch and (branch.startswith('refs/') or depth):
+        if branch and (branch.startswith('refs/') or depth or minimal):
             branch = self.remove_ref_prefix(branch)
             cmd.extend(['origin', f'+{branch}:refs/remotes/origin/{branch}'])
+        elif minimal:
+            # the clone only tracks a single branch
+            cmd.extend(['origin', '+refs/heads/*:refs/remotes/origin/*'])
+
+        return cmd
+
+    def fetches_by_sha(self, depth=None):
+        ctx = get_context()
+        if depth is None:
+            depth = 0 if self.refspec else ctx.repo_clone_depth
+        if not self.commit or self.tag or self.refspec or \
+                get_url_host(self.effective_url) in ctx.fetch_by_sha_refused:
+            return False
+        # shallow clones never contain the branch history anyway
+        return bool(depth) or (ctx.repo_clone_minimal and not self.branch)
+
+    def _get_tag_name(self):
+        tag = self.remove_ref_prefix(self.tag)
+        return tag[tag.startswith('tags/') and len('tags/'):]
+
+    def _get_minimal_branch(self):
+        """
+            Returns the branch or tag to clone in minimal mode, if any.
+        """
+        if self.tag:
+            return self._get_tag_name()
+        ref = self.branch or ''
+        if ref.startswith('refs/heads/'):
+            return ref[len('refs/heads/'):]
+        if ref and not ref.startswith('refs/'):
+            return ref
+        return None
+
+    def get_file_reader(self):
+        # a working copy that exists already may contain local changes
+        if self.operations_disabled or self.refspec or \
+                os.path.exists(os.path.join(self.path, '.git', 'index')):
+            return None
+        (rev, _) = self._get_desired_ref()
+        contents = {}
+
+        def _read(path):
+            if path not in contents:
+                (ret, output) = run_cmd(self.read_file_cmd(rev, path),
+                                        cwd=self.path, fail=False)
+                contents[path] = None if ret else output
+            if contents[path] is None:
+                raise FileNotFoundError(path)
+            return contents[path]
+
+        return _read
+
+    def read_file_cmd(self, rev, path):
+        return ['git', 'cat-file', 'blob', f'{rev}:{path}']
+
+    def _resolve_natively(self, resolve, name):
+        """
+            Resolves the name using ``resolve(reader, name)``, or returns
+            NotImplemented if the repository layout requires git.
+        """
+        try:
+            return resolve(GitRefReader(self.path), name)
+        except (NotImplementedError, OSError, ValueError) as e:
+            logging.debug('Resolving %s in repository %s using git: %s',
+                          name, self.name, e)
+            return NotImplemented
+
+    def resolve_commit(self):
+        rev = self._resolve_natively(GitRefReader.rev_parse,
+                                     self.commit or 'HEAD')
+        return super().resolve_commit() if rev is NotImplemented else rev
+
+    def resolve_tag(self):
+        rev = self._resolve_natively(GitRefReader.peel,
+                                     self.remove_ref_prefix(self.tag))
+        return super().resolve_tag() if rev is NotImplemented else rev
+
+    def resolve_branch(self):
+        refspec = self.remove_ref_prefix(self.branch or self.refspec)
+        rev = self._resolve_natively(GitRefReader.rev_parse,
+                                     f'origin/{refspec}')
+        return super().resolve_branch() if rev is NotImplemented else rev
+
+    def update_ref_repo_path(self, sdir):
+        alternates = os.path.join(self.path, '.git', 'objects', 'info',
+                                  'alternates')
+        try:
+            with open(alternates, 'r') as f:
+                paths = f.read().splitlines()
+        except OSError:
+            return
+        objects = os.path.join(sdir, 'objects')
+        suffix = os.path.join(os.sep, self.qualified_name, 'objects')
+        relocated = [objects if p.endswith(suffix) and not os.path.isdir(p)
+                     else p for p in paths]
+        if relocated != paths:
+            logging.info('Reference repository of %s relocated to %s',
+                         self.name, sdir)
+            with open(alternates, 'w') as f:
+                f.write(''.join(f'{p}\n' for p in relocated))
+
+    def _get_extra_ref(self):
+        # refs outside of heads and tags are not fetched by default
+        ref = self.branch or self.refspec
+        if ref and ref.startswith('refs/') \
+                and not ref.startswith(('refs/heads/', 'refs/tags/')):
+            return ref
+        return None
 
+    def update_ref_cmd(self):
+        cmd = ['git']
+        if get_context().repo_ref_shared:
+            # shared clones may still need objects that became unreachable
+            cmd.extend(['-c', 'gc.pruneExpire=never'])
+        cmd.extend(['fetch', '-q'])
+        clone_filter = get_context().repo_clone_filter
+        if clone_filter:
+            cmd.append(f'--filter={clone_filter}')
+        if get_context().repo_clone_minimal:
+            cmd.extend(['--no-tags', self.effective_url,
+                        *self._get_minimal_ref_refspecs()])
+            return cmd
+        cmd.extend([self.effective_url,
+                    '+refs/heads/*:refs/heads/*', '+refs/tags/*:refs/tags/*'])
+        ref = self._get_extra_ref()
+        if ref:
+            cmd.append(f'+{ref}:{ref}')
+        return cmd
+
+    def _get_minimal_ref_refspecs(self):
+        """
+            Returns the refspecs to update the reference repository with in
+            minimal mode. Commits that are fetched by SHA are kept in
+            refs/kas/commits/, so that they are not garbage collected.
+        """
+        if self.tag:
+            tag = self._get_tag_name()
+            return [f'+refs/tags/{tag}:refs/tags/{tag}']
+        if self.fetches_by_sha(depth=0):
+            return [f'+{self.commit}:refs/kas/commits/{self.commit}']
+        ref = self.branch or self.refspec
+        if not ref:
+            return ['+refs/heads/*:refs/heads/*']
+        if not ref.startswith('refs/'):
+            ref = f'refs/heads/{ref}'
+        return [f'+{ref}:{ref}']
+
+    def fetch_from_ref_cmd(self, srcdir):
+        cmd = ['git', 'fetch', '-q', srcdir,
+               '+refs/heads/*:refs/remotes/origin/*',
+               '+refs/tags/*:refs/tags/*']
+        if get_context().repo_clone_minimal:
+            cmd.append('+refs/kas/commits/*:refs/kas/commits/*')
+        ref = self._get_extra_ref()
+        if ref:
+            cmd.append(f'+{ref}:refs/remotes/origin/'
+                       f'{self.remove_ref_prefix(ref)}')
         return cmd
 
     def is_dirty_cmd(self):
         return ['git', 'diff', '--stat']
 
+    def sparse_checkout_cmd(self, paths, add=False):
+        if paths is None:
+            return ['git', 'sparse-checkout', 'disable']
+        if add:
+            return ['git', 'sparse-checkout', 'add', '--', *paths]
+        return ['git', 'sparse-checkout', 'set', '--cone', '--', *paths]
+
     def is_signed_cmd(self):
         if self.tag:
             return ['git', 'verify-tag', '--raw', self.tag]
@@ -708,8 +1498,11 @@ class GitRepo(RepoImpl):
         return ['git', 'rev-list', '-n', '1', self.remove_ref_prefix(self.tag)]
 
     def branch_contains_ref(self):
-        return ['git', 'branch', f'origin/{self.branch}',
-                '-r', '--contains', self.commit]
+        return ['git', 'merge-base', '--is-ancestor', self.commit,
+                f'origin/{self.branch}']
+
+    def branch_contains(self, retc, output):
+        return retc == 0
 
     def checkout_cmd(self, desired_ref, is_branch):
         cmd = ['git', 'checkout', '-q', self.remove_ref_prefix(desired_ref)]
@@ -729,6 +1522,87 @@ class GitRepo(RepoImpl):
     def apply_patches_file_cmd(self, path):
         return ['git', 'apply', '--whitespace=nowarn', path]
 
+    async def _apply_patch_series_async(self, patches, cached=False):
+        # Only git commit runs the commit hooks of the repository.
+        if await self._has_commit_hooks_async():
+            logging.debug('Repository %s has commit hooks, patches are '
+                          'committed in the worktree', self.name)
+            return await super()._apply_patch_series_async(patches, cached)
+        # The patches are applied to a temporary index and committed from
+        # there, so that the worktree is only scanned and updated once.
+        (_, output) = await run_cmd_async(
+            ['git', 'rev-parse', 'HEAD', 'HEAD^{tree}'], cwd=self.path)
+        (parent, parent_tree) = output.split()
+        with TemporaryDirectory(prefix='kas-patch-') as tmpdir:
+            env = get_context().environ.copy()
+            env['GIT_INDEX_FILE'] = os.path.join(tmpdir, 'index')
+            await run_cmd_async(['git', 'read-tree', parent],
+                                cwd=self.path, env=env)
+            for (path, patch_id) in patches:
+                patch_info = (f'patch path: {path}, repo: {self.name}, '
+                              f'patch entry: {patch_id}')
+                cmd = ['git', 'apply', '--cached', '--whitespace=nowarn',
+                       path]
+                (retc, out, err) = await run_cmd_async(
+                    cmd, cwd=self.path, env=env, fail=False,
+                    capture_stderr=True)
+                if retc:
+                    raise PatchApplyError(
+                        'Could not apply patch. Please fix repos and '
+                        f'patches:\n{patch_info}', cmd, out, err)
+
+                logging.info('Patch applied. (%s)', patch_info)
+
+                cmd = ['git', 'write-tree']
+                (retc, out, err) = await run_cmd_async(
+                    cmd, cwd=self.path, env=env, fail=False,
+                    capture_stderr=True)
+                tree = out.strip()
+                if retc or tree == parent_tree:
+                    # like git commit, refuse to create an empty commit
+                    raise PatchApplyError(
+                        'Could not commit patch changes. '
+                        f'({patch_info})', cmd, out, err)
+
+                (timestamp, msg) = self._get_patch_commit_info(
+                    path, patch_id, cached)
+                commit_env = dict(env,
+                                  GIT_AUTHOR_NAME='kas',
+                                  GIT_AUTHOR_EMAIL='kas@example.com',
+                                  GIT_AUTHOR_DATE=timestamp,
+                                  GIT_COMMITTER_DATE=timestamp)
+                cmd = ['git', 'commit-tree', tree, '-p', parent, '-m', msg]
+                (retc, out, err) = await run_cmd_async(
+                    cmd, cwd=self.path, env=commit_env, fail=False,
+                    capture_stderr=True)
+                if retc:
+                    raise PatchApplyError(
+                        'Could not commit patch changes. '
+                        f'({patch_info})', cmd, out, err)
+                (parent, parent_tree) = (out.strip(), tree)
+
+        cmd = self.checkout_patched_cmd(parent)
+        (retc, out, err) = await run_cmd_async(
+            cmd, cwd=self.path, fail=False, capture_stderr=True)
+        if retc:
+            raise PatchApplyError('Could not check out patched files: repo: '
+                                  f'{self.name}', cmd, out, err)
+
+    def get_hooks_path_cmd(self):
+        return ['git', 'rev-parse', '--git-path', 'hooks']
+
+    def get_committer_ident_cmd(self):
+        return ['git', 'var', 'GIT_COMMITTER_IDENT']
+
+    def fetch_patched_cmd(self, srcdir, ref):
+        return ['git', 'fetch', '-q', '--no-tags', srcdir, f'+{ref}:{ref}']
+
+    def store_patched_cmd(self, srcdir, ref):
+        return ['git', 'push', '-q', '--no-verify', srcdir, f'+HEAD:{ref}']
+
+    def checkout_patched_cmd(self, rev):
+        return ['git', 'reset', '-q', '--keep', rev]
+
     def set_remote_url_cmd(self):
         return ['git', 'remote', 'set-url', 'origin', self.effective_url]
 
@@ -753,6 +1627,7 @@ class GitRepo(RepoImpl):
             commit1 = 'HEAD'
         if commit2 is None:
             commit2 = 'HEAD'
+        from git import Repo as GitPythonRepo
         git_repo = GitPythonRepo(self.path)
         shallow_file = os.path.join(git_repo.git_dir, 'shallow')
         if os.path.isfile(shallow_file):
@@ -800,10 +1675,20 @@ class MercurialRepo(RepoImpl):
     def fetch_cmd(self):
         return ['hg', 'pull']
 
+    def update_ref_cmd(self):
+        # Mercurial does not support repo references (object caches)
+        raise NotImplementedError()
+
+    def fetch_from_ref_cmd(self, srcdir):
+        raise NotImplementedError()
+
     def is_dirty_cmd(self):
         return ['hg', 'status', '--modified', '--added',
                 '--removed', '--deleted']
 
+    def sparse_checkout_cmd(self, paths, add=False):
+        raise NotImplementedError()
+
     def is_signed_cmd(self):
         raise NotImplementedError()
 
@@ -836,6 +1721,17 @@ class MercurialRepo(RepoImpl):
     def apply_patches_file_cmd(self, path):
         return ['hg', 'import', '--no-commit', path]
 
+    def get_hooks_path_cmd(self):
+        # Mercurial has no hooks that are skipped by the patch commits
+        raise NotImplementedError()
+
+    def get_committer_ident_cmd(self):
+        raise NotImplementedError()
+
+    def fetch_patched_cmd(self, srcdir, ref):
+        # Mercurial does not support repo references (object caches)
+        raise NotImplementedError()
+
     def set_remote_url_cmd(self):
         raise NotImplementedError()
 
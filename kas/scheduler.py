@@ -0,0 +1,234 @@
+# kas - setup tool for bitbake based projects
+#
+# Copyright (c) Siemens AG, 2025
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+    This module contains the scheduler that bounds and orders the concurrent
+    repository operations of kas.
+
+    The number of concurrent jobs is limited globally and per remote host.
+    Jobs are started longest-first, based on the durations recorded in
+    previous runs. By that, the expensive clones do not end up at the tail
+    of the schedule.
+
+    Dependent jobs (e.g. the per-repo setup steps) are modelled as a
+    :class:`TaskGraph`, where each job starts as soon as its dependencies
+    completed.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+from tempfile import NamedTemporaryFile
+from urllib.parse import urlparse
+
+__license__ = 'MIT'
+__copyright__ = 'Copyright (c) Siemens AG, 2025'
+
+DEFAULT_JOBS = 16
+DEFAULT_HOST_JOBS = 8
+STATS_FILE = '.kas_fetch_stats.json'
+# weight of the previous duration when a job completes faster than before
+STATS_DECAY = 0.5
+
+
+def get_url_host(url):
+    """
+        Returns the host of a repository URL. This also covers the scp-like
+        syntax of git (``user@host:path``). Local paths map to an empty
+        string.
+    """
+    if not url:
+        return ''
+    parsed = urlparse(url)
+    if parsed.hostname:
+        return parsed.hostname
+    match = re.match(r'^(?:[^@/]+@)?([^:/]+):', url)
+    if match and not parsed.scheme:
+        return match.group(1)
+    return ''
+
+
+class Scheduler:
+    """
+        Runs asynchronous jobs with a bounded concurrency, both globally and
+        per remote host. Durations of completed jobs are recorded in the
+        ``stats_file`` (if provided) and used to order the jobs of
+        subsequent runs.
+    """
+
+    def __init__(self, jobs=DEFAULT_JOBS, host_jobs=DEFAULT_HOST_JOBS,
+                 stats_file=None):
+        self.jobs = jobs
+        self.host_jobs = host_jobs
+        self.stats_file = stats_file
+        self._durations = self._load_stats()
+        self._jobs_sem = None
+        self._host_sems = {}
+
+    def _load_stats(self):
+        if not self.stats_file:
+            return {}
+        try:
+            with open(self.stats_file, 'r') as f:
+                stats = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(stats, dict):
+            return {}
+        return {k: v for k, v in stats.items()
+                if isinstance(v, (int, float))}
+
+    def save_stats(self):
+        """
+            Persists the recorded job durations. The file is replaced
+            atomically, as it might be shared across kas instances.
+        """
+        if not self.stats_file or not self._durations:
+            return
+        stats = self._load_stats()
+        stats.update(self._durations)
+        try:
+            with NamedTemporaryFile('w', delete=False,
+                                    dir=os.path.dirname(self.stats_file),
+                                    prefix=STATS_FILE + '.') as f:
+                json.dump(stats, f, indent=2, sort_keys=True)
+            os.replace(f.name, self.stats_file)
+        except OSError as e:
+            logging.debug('Could not store fetch statistics: %s', e)
+
+    @staticmethod
+    def job_key(repo):
+        return repo.qualified_name if repo.url else None
+
+    def get_duration(self, repo):
+        """
+            Returns the recorded duration of the last job for this repo.
+        """
+        return self._durations.get(self.job_key(repo), 0.0)
+
+    def record(self, repo, duration):
+        """
+            Records the duration of a job. Faster runs (e.g. no-op fetches)
+            only slowly decay the recorded value, so that the cost of a full
+            clone is still known to later runs on empty work directories.
+        """
+        key = self.job_key(repo)
+        if not key:
+            return
+        previous = self._durations.get(key, 0.0)
+        self._durations[key] = round(max(duration,
+                                         previous * STATS_DECAY), 3)
+
+    def order(self, repos):
+        """
+            Returns the repos sorted by their recorded durations (longest
+            first). Repos without a record keep their relative order.
+        """
+        return sorted(repos, key=lambda r: -self.get_duration(r))
+
+    def _get_semaphores(self, repo):
+        # semaphores must be created within the running event loop
+        if not self._jobs_sem:
+            self._jobs_sem = asyncio.Semaphore(self.jobs)
+        host = get_url_host(repo.effective_url) if repo.url else ''
+        if host not in self._host_sems:
+            self._host_sems[host] = asyncio.Semaphore(self.host_jobs)
+        return (self._host_sems[host], self._jobs_sem)
+
+    async def run(self, repo, func, local=False):
+        """
+            Runs the coroutine function ``func`` as soon as a job slot for
+            the host of the repo is available and records its duration.
+            Local jobs (e.g. checkouts) only take a global job slot and are
+            not recorded.
+        """
+        (host_sem, jobs_sem) = self._get_semaphores(repo)
+        if local:
+            async with jobs_sem:
+                return await func()
+        async with host_sem:
+            async with jobs_sem:
+                start = time.monotonic()
+                ret = await func()
+                self.record(repo, time.monotonic() - start)
+                return ret
+
+
+class TaskGraph:
+    """
+        A graph of asynchronous tasks. Each task is started as soon as all
+        tasks it depends on completed successfully. If a task fails, all
+        remaining tasks are cancelled and the error is propagated.
+    """
+
+    def __init__(self):
+        self._nodes = {}
+        self._tasks = {}
+
+    def __contains__(self, key):
+        return key in self._nodes
+
+    def add(self, key, func, deps=None):
+        """
+            Adds the coroutine function ``func`` as task ``key``. The task
+            depends on the tasks listed in ``deps``. Dependencies that are
+            not part of the graph (e.g. skipped steps) are ignored.
+        """
+        self._nodes[key] = (func, list(deps or []))
+
+    async def wait(self, keys):
+        """
+            Waits until the given tasks completed successfully. This can be
+            used by a task to depend on tasks that are only known at runtime.
+        """
+        tasks = [self._tasks[k] for k in keys if k in self._tasks]
+        if not tasks:
+            return
+        await asyncio.wait(tasks)
+        for task in tasks:
+            # the failure itself is reported by the task
+            if task.cancelled() or task.exception():
+                raise asyncio.CancelledError()
+
+    async def _run_task(self, key):
+        (func, deps) = self._nodes[key]
+        await self.wait(deps)
+        return await func()
+
+    async def run(self):
+        """
+            Runs all tasks of the graph and returns a dict with their
+            results.
+        """
+        for key in self._nodes:
+            self._tasks[key] = asyncio.ensure_future(self._run_task(key))
+        try:
+            await asyncio.gather(*self._tasks.values())
+        except BaseException:
+            for task in self._tasks.values():
+                task.cancel()
+            await asyncio.gather(*self._tasks.values(),
+                                 return_exceptions=True)
+            raise
+        return {k: t.result() for k, t in self._tasks.items()}
@@ -0,0 +1,244 @@
+# kas - setup tool for bitbake based projects
+#
+# Copyright (c) Siemens AG, 2025
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+    This module validates configuration files against the kas schema.
+
+    The schema is compiled into specialised Python checks that only tell if
+    a document is valid. Only if a document is rejected, the generic
+    jsonschema validator is used to report the errors. Schemas that use
+    keywords not supported by the compiler are validated by jsonschema only.
+"""
+
+import logging
+
+__license__ = 'MIT'
+__copyright__ = 'Copyright (c) Siemens AG, 2025'
+
+# keywords without effect on the validation result
+ANNOTATIONS = ['$schema', '$id', 'title', 'description', 'default',
+               'examples', '$comment']
+
+TYPE_CHECKS = {
+    'string': 'isinstance(x, str)',
+    'object': 'isinstance(x, dict)',
+    'array': 'isinstance(x, list)',
+    'boolean': 'isinstance(x, bool)',
+    'null': 'x is None',
+    'integer': '(isinstance(x, int) and not isinstance(x, bool)'
+               ' or isinstance(x, float) and x.is_integer())',
+    'number': '(isinstance(x, (int, float)) and not isinstance(x, bool))',
+}
+
+_validators = {}
+
+
+class _Bool:
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return isinstance(other, _Bool) and self.value == other.value
+
+    def __hash__(self):
+        return hash((_Bool, self.value))
+
+
+def _unbool(value):
+    # in JSON schema, booleans are not numbers
+    return _Bool(value) if isinstance(value, bool) else value
+
+
+def _equal(one, two):
+    return _unbool(one) == _unbool(two)
+
+
+class SchemaCompiler:
+    """
+        Generates a Python function that checks if a document is valid
+        according to the schema. Raises a NotImplementedError if the schema
+        uses unsupported keywords.
+    """
+
+    def __init__(self, schema):
+        self.schema = schema
+        self.lines = []
+        self.constants = {}
+        self.count = 0
+
+    def _constant(self, value):
+        name = f'_c{len(self.constants)}'
+        self.constants[name] = value
+        return name
+
+    @staticmethod
+    def _scalar(value):
+        if isinstance(value, (list, dict)):
+            raise NotImplementedError('Non-scalar enum values')
+        return value
+
+    def _node(self, schema):
+        """
+            Emits a check function for the schema node and returns its name.
+        """
+        name = f'_v{self.count}'
+        self.count += 1
+        if schema is True or schema == {}:
+            self.lines += [f'def {name}(x):', '    return True', '']
+            return name
+        if schema is False:
+            self.lines += [f'def {name}(x):', '    return False', '']
+            return name
+        if not isinstance(schema, dict):
+            raise NotImplementedError(f'Invalid schema node: {schema}')
+
+        body = []
+        for (keyword, value) in schema.items():
+            if keyword in ANNOTATIONS:
+                continue
+            body += self._keyword(keyword, value, schema)
+        self.lines += [f'def {name}(x):'] + body + ['    return True', '']
+        return name
+
+    def _keyword(self, keyword, value, schema):
+        if keyword == 'type':
+            types = value if isinstance(value, list) else [value]
+            if any(t not in TYPE_CHECKS for t in types):
+                raise NotImplementedError(f'Unsupported type "{value}"')
+            checks = ' or '.join(TYPE_CHECKS[t] for t in types)
+            return [f'    if not ({checks}):', '        return False']
+        if keyword == 'enum':
+            enum = self._constant([self._scalar(v) for v in value])
+            return [f'    if not any(_equal(x, e) for e in {enum}):',
+                    '        return False']
+        if keyword == 'const':
+            const = self._constant(self._scalar(value))
+            return [f'    if not _equal(x, {const}):', '        return False']
+        if keyword in ['minLength', 'maxLength']:
+            op = '<' if keyword == 'minLength' else '>'
+            return [f'    if isinstance(x, str) and len(x) {op} {int(value)}:',
+                    '        return False']
+        if keyword in ['minimum', 'maximum']:
+            op = '<' if keyword == 'minimum' else '>'
+            limit = self._constant(value)
+            return [f'    if {TYPE_CHECKS["number"]} and x {op} {limit}:',
+                    '        return False']
+        if keyword == 'anyOf':
+            checks = ' or '.join(f'{self._node(s)}(x)' for s in value)
+            return [f'    if not ({checks}):', '        return False']
+        if keyword == 'items':
+            if isinstance(value, list):
+                raise NotImplementedError('Tuple validation')
+            check = self._node(value)
+            return ['    if isinstance(x, list):',
+                    '        for v in x:',
+                    f'            if not {check}(v):',
+                    '                return False']
+        if keyword == 'required':
+            required = self._constant(list(value))
+            return ['    if isinstance(x, dict):',
+                    f'        for k in {required}:',
+                    '            if k not in x:',
+                    '                return False']
+        if keyword == 'properties':
+            if not value:
+                return []
+            lines = ['    if isinstance(x, dict):']
+            for (prop, subschema) in value.items():
+                key = self._constant(prop)
+                check = self._node(subschema)
+                lines += [f'        if {key} in x and not {check}(x[{key}]):',
+                          '            return False']
+            return lines
+        if keyword == 'additionalProperties':
+            if 'patternProperties' in schema:
+                raise NotImplementedError('patternProperties')
+            props = self._constant(frozenset(schema.get('properties', {})))
+            if value is True:
+                return []
+            if value is False:
+                return ['    if isinstance(x, dict):',
+                        '        for k in x:',
+                        f'            if k not in {props}:',
+                        '                return False']
+            check = self._node(value)
+            return ['    if isinstance(x, dict):',
+                    '        for (k, v) in x.items():',
+                    f'            if k not in {props} and not {check}(v):',
+                    '                return False']
+        raise NotImplementedError(f'Unsupported keyword "{keyword}"')
+
+    def compile(self):
+        """
+            Returns the check function for the schema.
+        """
+        entry = self._node(self.schema)
+        namespace = {'_equal': _equal}
+        namespace.update(self.constants)
+        code = compile('\n'.join(self.lines), '<kas-schema>', 'exec')
+        exec(code, namespace)
+        return namespace[entry]
+
+
+class ConfigValidator:
+    """
+        Validates documents against a schema, using the compiled checks if
+        possible.
+    """
+
+    def __init__(self, schema):
+        self.schema = schema
+        try:
+            self.check = SchemaCompiler(schema).compile()
+        except NotImplementedError as e:
+            logging.debug('Schema not compiled: %s', e)
+            self.check = None
+        self._validator = None
+
+    @property
+    def validator(self):
+        """
+            The generic jsonschema validator.
+        """
+        if not self._validator:
+            from jsonschema.validators import validator_for
+            self._validator = validator_for(self.schema)(self.schema)
+        return self._validator
+
+    def iter_errors(self, document):
+        """
+            Returns the validation errors (see jsonschema) of the document.
+        """
+        if self.check and self.check(document):
+            return iter([])
+        return self.validator.iter_errors(document)
+
+
+def get_validator(schema):
+    """
+        Returns the validator for the schema. Validators are only built
+        once per schema.
+    """
+    validator = _validators.get(id(schema))
+    if not validator or validator.schema is not schema:
+        validator = ConfigValidator(schema)
+        _validators[id(schema)] = validator
+    return validator
@@ -0,0 +1,277 @@
+# kas - setup tool for bitbake based projects
+#
+# Copyright (c) Siemens AG, 2025
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+    This module implements the workspace state manifest.
+
+    After a successful setup, kas records the state of the workspace in the
+    build directory: the stats of all loaded configuration files, a digest
+    of the effective configuration, the configuration and the stats of the
+    git metadata (``HEAD``, ``index``, refs) of each repository and the
+    environment of the init-build-env script.
+
+    On the next run, this state is compared using file stats only.
+    Repositories whose state is unchanged skip their setup steps (fetch,
+    checkout, patches) and the init-build-env script is not sourced again
+    if no repository changed. The state is not used on ``--update`` and
+    ``--force-checkout``, nor if any setup step is skipped. Even if the
+    state is outdated, the recorded URLs are used to start fetching the
+    repositories that are only known from a lockfile early. If the same
+    configuration is used, all repositories of the previous run are fetched
+    speculatively right away, instead of one level of includes after the
+    other.
+"""
+
+import hashlib
+import json
+import logging
+import os
+from tempfile import NamedTemporaryFile
+from . import __version__
+from .kasusererror import KasUserError
+from .libkas import get_buildtools_dir
+from .repos import GitRepo
+
+__license__ = 'MIT'
+__copyright__ = 'Copyright (c) Siemens AG, 2025'
+
+STATE_FILE = '.kas_state.json'
+STATE_VERSION = 1
+
+
+def _stat(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_ino, st.st_size, st.st_mtime_ns]
+
+
+def _digest(data):
+    encoded = json.dumps(data, default=str).encode()
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class WorkspaceState:
+    """
+        The recorded state of the workspace.
+    """
+
+    # setup steps that contribute to the recorded state
+    STEPS = [
+        'init_setup_repos',
+        'repo_setup_loop',
+        'finish_setup_repos',
+        'repos_checkout',
+        'repos_check_signatures',
+        'repos_apply_patches',
+        'setup_environ',
+    ]
+
+    def __init__(self, ctx):
+        self.filename = os.path.join(ctx.build_dir, STATE_FILE)
+        self.init_environ = None
+        self.clean_repos = []
+        self._all_clean = False
+        self._data = {}
+        data = self._load()
+        self.repo_hints = self._get_repo_hints(ctx, data)
+        # the repos that were discovered by the same configuration
+        self.discovered_repos = {}
+        if data.get('settings', {}).get('config') == ctx.config.filenames:
+            self.discovered_repos = self.repo_hints
+        if ctx.update or ctx.force_checkout:
+            return
+        if data.get('settings') != self._get_settings(ctx):
+            return
+        if any(_stat(f) != st for (f, st) in data['config_files']):
+            logging.debug('Workspace state: configuration files changed')
+            return
+        self._data = data
+
+    def _load(self):
+        try:
+            with open(self.filename, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(data, dict) or \
+                data.get('version') != STATE_VERSION:
+            return {}
+        return data
+
+    @staticmethod
+    def _get_settings(ctx):
+        return {
+            'kas_version': __version__,
+            'config': ctx.config.filenames,
+            'work_dir': ctx.kas_work_dir,
+            'build_dir': ctx.build_dir,
+            'ref_dir': ctx.kas_repo_ref_dir,
+            'ref_shared': ctx.repo_ref_shared,
+            'clone_depth': ctx.repo_clone_depth,
+            'clone_filter': ctx.repo_clone_filter,
+            'clone_minimal': ctx.repo_clone_minimal,
+            'sparse_checkout': ctx.repo_sparse_checkout,
+            'premirrors': os.environ.get('KAS_PREMIRRORS'),
+        }
+
+    @staticmethod
+    def _get_config_files(ctx):
+        handler = ctx.config.handler
+        files = []
+        for cf in handler.config_files:
+            files.append(str(cf.filename))
+            # a lockfile that is added later also changes the config
+            if not cf.is_lockfile:
+                files.append(str(handler.get_lock_filename(cf.filename)))
+        return [(f, _stat(f)) for f in dict.fromkeys(files)]
+
+    @staticmethod
+    def _get_repo_state(repo):
+        """
+            Returns the state of a repo or None, if the state of the repo
+            cannot be tracked.
+        """
+        if repo.signed:
+            # always verify signatures
+            return None
+        if repo.operations_disabled:
+            return {}
+        if not isinstance(repo, GitRepo):
+            return None
+        gitdir = os.path.join(repo.path, '.git')
+        try:
+            with open(os.path.join(gitdir, 'HEAD'), 'r') as f:
+                head = f.read().strip()
+        except OSError:
+            return None
+        files = ['HEAD', 'index', 'packed-refs']
+        if head.startswith('ref: '):
+            files.append(head[len('ref: '):])
+        try:
+            patches = [(path, patch_id, _stat(path))
+                       for (path, patch_id) in repo.get_patch_files()]
+        except KasUserError:
+            return None
+        config = [repo.effective_url, repo.path, repo.commit, repo.tag,
+                  repo.branch, repo.refspec, patches]
+        return {
+            'digest': _digest(config),
+            'files': {f: _stat(os.path.join(gitdir, f)) for f in files},
+        }
+
+    @staticmethod
+    def _get_repo_hints(ctx, data):
+        settings = data.get('settings', {})
+        if settings.get('work_dir') != ctx.kas_work_dir:
+            return {}
+        return {name: r for (name, r) in data.get('repos', {}).items()
+                if r.get('url')}
+
+    @property
+    def repo_paths(self):
+        return {name: r['path'] for (name, r)
+                in self._data.get('repos', {}).items()}
+
+    def restore(self, ctx):
+        """
+            Loads the configuration with the recorded repos and determines
+            the repos with unchanged state. Returns False if the
+            configuration does not match the recorded one.
+        """
+        if not self._data:
+            return False
+        missing_repos = ctx.config.find_missing_repos(self.repo_paths)
+        if missing_repos or \
+                _digest(ctx.config.get_config()) != self._data['config']:
+            logging.debug('Workspace state: configuration changed')
+            return False
+
+        ctx.config.get_repos()
+        recorded = self._data['repos']
+        self.clean_repos = []
+        for (name, repo) in ctx.config.repo_dict.items():
+            entry = recorded.get(name)
+            if not entry or entry['path'] != repo.path:
+                continue
+            state = self._get_repo_state(repo)
+            if state is not None and state == entry['state']:
+                self.clean_repos.append(repo)
+        self._all_clean = \
+            len(self.clean_repos) == len(ctx.config.repo_dict)
+        logging.debug('Workspace state: %d of %d repos unchanged',
+                      len(self.clean_repos), len(ctx.config.repo_dict))
+        return True
+
+    def is_clean(self, repo):
+        """
+            Returns True if the repo is in the recorded state.
+        """
+        return repo in self.clean_repos
+
+    def get_init_environ(self, ctx):
+        """
+            Returns the recorded environment of the init-build-env script,
+            if no repo changed since it was recorded.
+        """
+        environ = self._data.get('init_environ')
+        if not self._all_clean or not isinstance(environ, dict):
+            return None
+        if not os.path.isdir(os.path.join(ctx.build_dir, 'conf')):
+            return None
+        if ctx.config.get_buildtools() and \
+                not any(get_buildtools_dir().glob('environment-setup-*')):
+            return None
+        self.init_environ = environ
+        return environ
+
+    def save(self, ctx):
+        """
+            Records the current state of the workspace.
+        """
+        repos = {}
+        for (name, repo) in ctx.config.repo_dict.items():
+            repos[name] = {
+                'path': repo.path,
+                'url': repo.url,
+                'type': repo.get_type(),
+                'commit': repo.commit,
+                'branch': repo.branch,
+                'tag': repo.tag,
+                'state': self._get_repo_state(repo),
+            }
+        data = {
+            'version': STATE_VERSION,
+            'settings': self._get_settings(ctx),
+            'config_files': self._get_config_files(ctx),
+            'config': _digest(ctx.config.get_config()),
+            'repos': repos,
+            'init_environ': self.init_environ,
+        }
+        try:
+            with NamedTemporaryFile('w', delete=False,
+                                    dir=os.path.dirname(self.filename),
+                                    prefix=STATE_FILE + '.') as f:
+                json.dump(data, f, indent=2)
+            os.replace(f.name, self.filename)
+        except OSError as e:
+            logging.debug('Could not store workspace state: %s', e)
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+#
+# kas - setup tool for bitbake based projects
+#
+# Copyright (c) Siemens AG, 2025
+#
+# SPDX-License-Identifier: MIT
+#
+# Benchmarks the merge of the configuration files of kas.
+#
+# A set of synthetic configuration files is generated, similar to a large
+# include tree: each file adds a repository with layers, a few overrides of
+# shared repositories and local.conf header entries. The files are merged
+# with the pairwise merge that was used before and with merge_configs.
+#
+# Usage: benchmark-config-merge.py [--files N] [--repeat N]
+
+import argparse
+import json
+import os
+import sys
+import timeit
+from functools import reduce
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from kas.includehandler import merge_configs  # noqa: E402
+
+
+def pairwise_merge(dest, upd):
+    dest = dest.copy()
+    for key in upd:
+        if isinstance(dest.get(key), dict) and isinstance(upd[key], dict):
+            dest[key] = pairwise_merge(dest[key], upd[key])
+        else:
+            dest[key] = upd[key]
+    return dest
+
+
+def create_configs(count):
+    configs = []
+    for i in range(count):
+        configs.append({
+            'header': {'version': 14},
+            'machine': f'machine-{i % 7}',
+            'repos': {
+                f'repo{i}': {
+                    'url': f'https://example.com/repo{i}.git',
+                    'commit': f'{i:040x}',
+                    'layers': {f'meta-{i}-{j}': None for j in range(4)},
+                },
+                f'shared{i % 10}': {
+                    'branch': f'branch-{i}',
+                    'layers': {f'meta-shared-{i}': None},
+                },
+            },
+            'local_conf_header': {
+                f'entry{i}': f'VAR_{i} = "{i}"\n',
+                'common': f'COMMON = "{i}"\n',
+            },
+            'env': {f'VAR_{i % 20}': str(i)},
+        })
+    return configs
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--files', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    configs = create_configs(args.files)
+    if json.dumps(merge_configs(configs)) != \
+            json.dumps(reduce(pairwise_merge, configs)):
+        sys.exit('Merge results differ')
+
+    for name, func in [('pairwise', lambda: reduce(pairwise_merge, configs)),
+                       ('k-way', lambda: merge_configs(configs))]:
+        duration = min(timeit.repeat(func, number=1, repeat=args.repeat))
+        print(f'{name:>10}: {duration * 1000:8.2f}ms '
+              f'(files={args.files})')
+
+
+if __name__ == '__main__':
+    main()
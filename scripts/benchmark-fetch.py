@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+#
+# kas - setup tool for bitbake based projects
+#
+# Copyright (c) Siemens AG, 2025
+#
+# SPDX-License-Identifier: MIT
+#
+# Benchmarks the fetch scheduler of kas against local bare repositories.
+#
+# A set of small repositories and a single large one are created. The large
+# one is listed last in the kas configuration, hence it is fetched last when
+# no fetch statistics are available. The first run records the durations,
+# the second run (on a fresh work dir) uses them to start the large repo first.
+#
+# The repositories are referenced via file:// URLs, so that git uses its
+# regular transport instead of hardlinking the objects.
+#
+# Usage: benchmark-fetch.py [--jobs N] [--repos N] [--size MB] [workdir]
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+KAS_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def git(*args, cwd=None):
+    subprocess.check_call(['git', *args], cwd=cwd, stdout=subprocess.DEVNULL,
+                          stderr=subprocess.DEVNULL)
+
+
+def create_bare_repo(path, size_mb, commits):
+    work = path + '.work'
+    os.makedirs(work)
+    git('init', '-q', '-b', 'main', cwd=work)
+    chunk = size_mb * 1024 * 1024 // commits
+    for i in range(commits):
+        with open(os.path.join(work, f'blob{i}'), 'wb') as f:
+            f.write(os.urandom(chunk))
+        git('add', '-A', cwd=work)
+        git('-c', 'user.name=kas', '-c', 'user.email=kas@example.com',
+            'commit', '-q', '-m', f'commit {i}', cwd=work)
+    git('clone', '-q', '--bare', work, path)
+    shutil.rmtree(work)
+
+
+def write_config(path, repos):
+    with open(path, 'w') as f:
+        f.write('header:\n  version: 14\nrepos:\n')
+        f.write('  this:\n')
+        for name, url in repos:
+            f.write(f'  {name}:\n    url: "{url}"\n    branch: main\n')
+
+
+def run_kas(workdir, config, jobs):
+    env = dict(os.environ)
+    env['KAS_WORK_DIR'] = workdir
+    env['PYTHONPATH'] = KAS_ROOT
+    env.pop('KAS_REPO_REF_DIR', None)
+    cmd = [sys.executable, '-m', 'kas', 'checkout', '--jobs', str(jobs),
+           '--skip', 'setup_environ', '--skip', 'write_bbconfig', config]
+    start = time.monotonic()
+    subprocess.check_call(cmd, env=env, cwd=workdir,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.monotonic() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--jobs', type=int, default=2)
+    parser.add_argument('--repos', type=int, default=8)
+    parser.add_argument('--size', type=int, default=100,
+                        help='size of the large repo in MB')
+    parser.add_argument('workdir', nargs='?')
+    args = parser.parse_args()
+
+    base = args.workdir or tempfile.mkdtemp(prefix='kas-bench-')
+    upstream = os.path.join(base, 'upstream')
+    os.makedirs(upstream, exist_ok=True)
+
+    repos = []
+    small_size = max(args.size // (4 * args.repos), 1)
+    for i in range(args.repos):
+        path = os.path.join(upstream, f'small{i}.git')
+        create_bare_repo(path, small_size, 4)
+        repos.append((f'small{i}', 'file://' + path))
+    path = os.path.join(upstream, 'large.git')
+    create_bare_repo(path, args.size, 16)
+    repos.append(('large', 'file://' + path))
+
+    results = []
+    for run in ['cold', 'scheduled']:
+        workdir = os.path.join(base, run)
+        os.makedirs(os.path.join(workdir, 'build'))
+        if run == 'scheduled':
+            shutil.copy(os.path.join(base, 'cold', 'build',
+                                     '.kas_fetch_stats.json'),
+                        os.path.join(workdir, 'build'))
+        config = os.path.join(workdir, 'kas.yml')
+        write_config(config, repos)
+        results.append((run, run_kas(workdir, config, args.jobs)))
+
+    for run, duration in results:
+        print(f'{run:>10}: {duration:6.2f}s (jobs={args.jobs})')
+    if not args.workdir:
+        shutil.rmtree(base)
+
+
+if __name__ == '__main__':
+    main()
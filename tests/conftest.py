@@ -24,6 +24,7 @@ import pytest
 import os
 import subprocess
 import shutil
+import yaml
 from pathlib import Path
 
 ENVVARS_KAS = [
@@ -36,6 +37,15 @@ ENVVARS_KAS = [
     'KAS_TASK',
     'KAS_PREMIRRORS',
     'KAS_CLONE_DEPTH',
+    'KAS_CLONE_FILTER',
+    'KAS_CLONE_MINIMAL',
+    'KAS_SPARSE_CHECKOUT',
+    'KAS_FETCH_JOBS',
+    'KAS_FETCH_HOST_JOBS',
+    'KAS_CONFIG_CACHE',
+    'KAS_REPO_REF_MAX_AGE',
+    'KAS_REF_LOCK_TIMEOUT',
+    'KAS_REPO_REF_SHARED',
     'KAS_CONTAINER_SCRIPT_VERSION',
     'SSH_PRIVATE_KEY',
     'SSH_PRIVATE_KEY_FILE',
@@ -178,3 +188,81 @@ def mercurial():
     def make_hg_repo(tmpdir, name, branch=None):
         return MercurialRepo(tmpdir, name, branch)
     return make_hg_repo
+
+
+def _git(*args, cwd):
+    subprocess.check_call(['git', '-c', 'user.name=kas',
+                           '-c', 'user.email=kas@example.com',
+                           '-c', 'protocol.file.allow=always', *args],
+                          cwd=cwd, stdout=subprocess.DEVNULL,
+                          stderr=subprocess.DEVNULL)
+
+
+@pytest.fixture
+def git():
+    """
+    Returns a function that quietly runs a git command in a directory.
+    """
+    return _git
+
+
+@pytest.fixture
+def upstream(monkeykas, tmpdir):
+    """
+    Returns a factory for git repositories below tmpdir. The given files
+    are committed on branch main.
+    """
+    def create_upstream(name='upstream', files=None):
+        path = Path(tmpdir / name)
+        path.mkdir()
+        _git('init', '-q', '-b', 'main', cwd=path)
+        for (file, content) in (files or {}).items():
+            (path / file).parent.mkdir(parents=True, exist_ok=True)
+            (path / file).write_text(content)
+        _git('add', '-A', cwd=path)
+        _git('commit', '-q', '--allow-empty', '-m', 'initial', cwd=path)
+        return path
+    return create_upstream
+
+
+class KasProject:
+    """
+    Project directory with an init-build-env script and a test.yml that
+    refers to the given repositories.
+    """
+    def __init__(self, monkeykas, tmpdir, name):
+        self.monkeykas = monkeykas
+        self.tmpdir = tmpdir
+        self.path = Path(tmpdir / name)
+        self.path.mkdir()
+        (self.path / 'oe-init-build-env').write_text('true\n')
+
+    def write_config(self, repos, includes=None):
+        """
+        Writes the config with the given repos next to the 'this' repo.
+        """
+        header = {'version': 14}
+        if includes:
+            header['includes'] = includes
+        config = {'header': header, 'repos': {'this': None, **repos}}
+        with open(self.path / 'test.yml', 'w') as f:
+            yaml.safe_dump(config, f, sort_keys=False)
+
+    def use_ref_dir(self):
+        """
+        Creates the reference repository directory and sets it for kas.
+        """
+        refdir = Path(self.tmpdir / 'refs')
+        refdir.mkdir(exist_ok=True)
+        self.monkeykas.setenv('KAS_REPO_REF_DIR', str(refdir))
+        return refdir
+
+
+@pytest.fixture
+def project(monkeykas, tmpdir):
+    """
+    Creates the project directory and changes into it.
+    """
+    project = KasProject(monkeykas, tmpdir, 'project')
+    monkeykas.chdir(project.path)
+    return project
@@ -120,6 +120,7 @@ def test_checkout_create_refs(monkeykas, tmpdir):
     # check if refs are removed on purge
     kas.kas(['purge', 'test.yml'])
     assert not (repo_cache / 'github.com.siemens.kas.git').exists()
+    assert not (repo_cache / 'github.com.siemens.kas.git.lock').exists()
 
 
 @pytest.mark.online
@@ -0,0 +1,87 @@
+# kas - setup tool for bitbake based projects
+#
+# Copyright (c) Siemens AG, 2025
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import copy
+import json
+import pickle
+import pytest
+import yaml
+from kas.configview import freeze, thaw
+from kas.plugins.dump import Dump
+
+CONFIG = {
+    'header': {'version': 14, 'includes': ['a.yml', {'repo': 'r',
+                                                     'file': 'b.yml'}]},
+    'repos': {
+        'r': {'url': 'https://example.com/r.git', 'layers': {'meta': None}},
+        's': None,
+    },
+}
+
+
+def test_readonly():
+    config = freeze(CONFIG)
+    assert config == CONFIG
+    assert json.dumps(config) == json.dumps(CONFIG)
+    assert freeze(config) is config
+    with pytest.raises(TypeError):
+        config['machine'] = 'qemux86-64'
+    with pytest.raises(TypeError):
+        config['repos']['r']['layers'].pop('meta')
+    with pytest.raises(TypeError):
+        config['header']['includes'].append('c.yml')
+
+
+def test_mutable():
+    config = freeze(CONFIG)
+    mutable = config.mutable()
+    mutable['repos']['r']['commit'] = '0' * 40
+    mutable['header']['includes'].append('c.yml')
+    del mutable['repos']['s']
+
+    # only the modified paths are copied
+    assert 'commit' not in config['repos']['r']
+    assert len(config['header']['includes']) == 2
+    assert 's' in config['repos']
+    assert dict.get(mutable['repos']['r'], 'layers') is \
+        config['repos']['r']['layers']
+
+    refrozen = freeze(mutable)
+    assert refrozen['repos']['r']['commit'] == '0' * 40
+    assert refrozen['repos']['r']['layers'] is \
+        config['repos']['r']['layers']
+
+
+def test_copy():
+    config = freeze(CONFIG)
+    assert copy.copy(config) is config
+    plain = copy.deepcopy(config)
+    assert type(plain) is dict and type(plain['header']['includes']) is list
+    assert plain == thaw(config) == CONFIG
+    assert pickle.loads(pickle.dumps(config)) == config
+
+
+def test_dump_yaml():
+    config = freeze(CONFIG)
+    expected = yaml.dump(CONFIG, Dumper=Dump.KasYamlDumper)
+    assert yaml.dump(config, Dumper=Dump.KasYamlDumper) == expected
+    assert yaml.dump(config.mutable(), Dumper=Dump.KasYamlDumper) == expected
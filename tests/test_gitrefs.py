@@ -0,0 +1,106 @@
+# kas - setup tool for bitbake based projects
+#
+# Copyright (c) Siemens AG, 2025
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import subprocess
+import pytest
+from pathlib import Path
+from kas.gitrefs import GitRefReader
+
+
+def git(*args, cwd):
+    return subprocess.check_output(
+        ['git', '-c', 'user.name=kas', '-c', 'user.email=kas@example.com',
+         *args], cwd=cwd, stderr=subprocess.DEVNULL).decode().strip()
+
+
+@pytest.fixture
+def repo(tmpdir):
+    path = Path(tmpdir / 'upstream')
+    path.mkdir()
+    git('init', '-q', '-b', 'main', cwd=path)
+    git('commit', '-q', '--allow-empty', '-m', 'initial', cwd=path)
+    git('tag', 'light', cwd=path)
+    git('tag', '-a', '-m', 'annotated', 'annotated', cwd=path)
+    git('tag', '-a', '-m', 'nested', 'nested', 'annotated', cwd=path)
+    git('commit', '-q', '--allow-empty', '-m', 'next', cwd=path)
+    git('branch', 'other', cwd=path)
+    return path
+
+
+NAMES = ['HEAD', 'main', 'other', 'heads/main', 'refs/heads/other', 'light',
+         'annotated', 'nested', 'tags/annotated', 'origin/main',
+         'origin/other', 'missing']
+
+
+def check(path):
+    reader = GitRefReader(path)
+    for name in NAMES:
+        try:
+            expected = git('rev-parse', '--verify', '-q', name, cwd=path)
+        except subprocess.CalledProcessError:
+            expected = None
+        assert reader.rev_parse(name) == expected, name
+        try:
+            expected = git('rev-list', '-n', '1', name, cwd=path)
+        except subprocess.CalledProcessError:
+            expected = None
+        assert reader.peel(name) == expected, name
+
+
+def test_loose_refs(repo):
+    check(repo)
+    git('checkout', '-q', '--detach', 'HEAD~1', cwd=repo)
+    check(repo)
+
+
+def test_packed_refs(repo):
+    git('pack-refs', '--all', cwd=repo)
+    check(repo)
+    # peel through the object store
+    git('gc', '-q', cwd=repo)
+    (repo / '.git' / 'packed-refs').write_text(''.join(
+        line + '\n' for line in
+        (repo / '.git' / 'packed-refs').read_text().splitlines()
+        if not line.startswith(('#', '^'))))
+    check(repo)
+
+
+def test_clone(repo, tmpdir):
+    clone = Path(tmpdir / 'clone')
+    git('clone', '-q', '--shared', str(repo), str(clone), cwd=tmpdir)
+    check(clone)
+    worktree = Path(tmpdir / 'worktree')
+    git('worktree', 'add', '-q', '--detach', str(worktree), 'origin/other',
+        cwd=clone)
+    check(worktree)
+
+
+def test_fallback(repo, tmpdir):
+    reader = GitRefReader(repo)
+    commit = git('rev-parse', 'HEAD', cwd=repo)
+    assert reader.rev_parse(commit) == commit
+    for name in ['HEAD~1', 'main^{}', commit[:7]]:
+        with pytest.raises(NotImplementedError):
+            reader.rev_parse(name)
+    with pytest.raises(NotImplementedError):
+        GitRefReader(Path(tmpdir))
@@ -0,0 +1,86 @@
+# kas - setup tool for bitbake based projects
+#
+# Copyright (c) Siemens AG, 2025
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import subprocess
+import sys
+import pytest
+from kas import kas, plugins
+
+HEAVY_MODULES = ['git', 'jsonschema', 'yaml', 'distro', 'kconfiglib',
+                 'kas.attestation', 'kas.repos', 'kas.plugins.menu',
+                 'kas.plugins.diff']
+
+
+def get_imported_modules(*args):
+    """
+        Returns the modules that are imported by a kas call.
+    """
+    ret = subprocess.run([sys.executable, '-X', 'importtime', '-m', 'kas',
+                          *args], capture_output=True, text=True, check=True)
+    return {line.split('|')[-1].strip() for line in ret.stderr.splitlines()
+            if line.startswith('import time:') and 'cumulative' not in line}
+
+
+def test_startup_imports():
+    modules = get_imported_modules('--version')
+    assert not [m for m in HEAVY_MODULES if m in modules]
+
+
+@pytest.mark.parametrize('cmd', ['dump', 'shell'])
+def test_plugin_imports(cmd):
+    # only the selected plugin is imported
+    modules = get_imported_modules(cmd, '--help')
+    assert 'kas.libcmds' in modules
+    assert not [m for m in ['git', 'kas.attestation', 'kas.plugins.menu',
+                            'kas.plugins.diff'] if m in modules]
+
+
+def test_registry():
+    plugins.load()
+    for name in plugins.REGISTRY:
+        assert plugins.get(name).name == name
+
+
+@pytest.mark.parametrize('cmd', plugins.REGISTRY)
+def test_plugin_help(cmd, capsys):
+    # the help of a lazily set up command matches the complete parser
+    with pytest.raises(SystemExit) as exc:
+        kas.kas([cmd, '--help'])
+    assert exc.value.code == 0
+    lazy_help = capsys.readouterr().out
+    with pytest.raises(SystemExit):
+        kas.kas_get_argparser().parse_args([cmd, '--help'])
+    assert lazy_help == capsys.readouterr().out
+    assert f' {cmd} [-h]' in lazy_help
+
+
+def test_invalid_command(capsys):
+    with pytest.raises(SystemExit) as exc:
+        kas.kas(['invalid'])
+    assert exc.value.code == 2
+    assert "invalid choice: 'invalid'" in capsys.readouterr().err
+
+    # unknown arguments of a valid command are still rejected
+    with pytest.raises(SystemExit) as exc:
+        kas.kas(['shell', '--invalid', 'test.yml'])
+    assert exc.value.code == 2
+    assert 'unrecognized arguments: --invalid' in capsys.readouterr().err
@@ -23,10 +23,14 @@
 
 import os
 import io
+import json
+import random
 import textwrap
 import contextlib
+from functools import reduce
 
 import pytest
+import yaml
 
 from kas import includehandler, context
 from kas.includehandler import ConfigFile
@@ -143,6 +147,88 @@ class TestLoadConfig:
         with patch_open(includehandler, string='header: {version: "0.10"}'):
             ConfigFile.load('x.yml')
 
+    def test_cache(self, monkeypatch, tmpdir):
+        parsed = []
+        safe_load = yaml.safe_load
+
+        def _safe_load(content):
+            parsed.append(content)
+            return safe_load(content)
+
+        monkeypatch.setattr(yaml, 'safe_load', _safe_load)
+        filename = str(tmpdir / 'x.yml')
+        with open(filename, 'w') as f:
+            f.write('header: {version: 5}\nmachine: a\n')
+
+        cf = ConfigFile.load(filename)
+        cf.config['machine'] = 'modified'
+        assert ConfigFile.load(filename).config['machine'] == 'a'
+        assert len(parsed) == 1
+
+        with open(filename, 'w') as f:
+            f.write('header: {version: 5}\nmachine: b\n')
+        assert ConfigFile.load(filename).config['machine'] == 'b'
+        assert len(parsed) == 2
+
+        # the on-disk cache is keyed by content
+        cache_dir = str(tmpdir / 'cache')
+        monkeypatch.setattr(ConfigFile, '_cache', {})
+        ConfigFile.load(filename, cache_dir=cache_dir)
+        assert len(os.listdir(cache_dir)) == 1
+        assert len(parsed) == 3
+        monkeypatch.setattr(ConfigFile, '_cache', {})
+        assert ConfigFile.load(filename, cache_dir=cache_dir) \
+            .config['machine'] == 'b'
+        assert len(parsed) == 3
+
+
+def legacy_dict_merge(dest, upd):
+    """
+    Merges upd recursively into a copy of dest (pairwise reference merge).
+    """
+    dest = dest.copy()
+    for key in upd:
+        if isinstance(dest.get(key), dict) and isinstance(upd[key], dict):
+            dest[key] = legacy_dict_merge(dest[key], upd[key])
+        else:
+            dest[key] = upd[key]
+    return dest
+
+
+def random_config(rng, depth=0):
+    config = {}
+    for _ in range(rng.randint(0, 4)):
+        key = rng.choice('abcdef')
+        if depth < 3 and rng.random() < 0.6:
+            config[key] = random_config(rng, depth + 1)
+        else:
+            config[key] = rng.choice([None, 1, 'x', [1, 2], True])
+    return config
+
+
+class TestMergeConfigs:
+    def test_equivalence(self):
+        rng = random.Random(42)
+        for _ in range(500):
+            configs = [random_config(rng) for _ in range(rng.randint(1, 8))]
+            expected = reduce(legacy_dict_merge, configs)
+            merged = includehandler.merge_configs(configs)
+            # compare the values and the key order
+            assert json.dumps(merged) == json.dumps(expected)
+
+    def test_no_mutation(self):
+        configs = [{'header': {'version': 5}, 'v': {'a': 1}},
+                   {'header': {'version': 6}, 'v': {'b': 2}}]
+        merged = includehandler.merge_configs(configs)
+        merged['header']['version'] = 7
+        merged['v']['a'] = 2
+        assert configs == [{'header': {'version': 5}, 'v': {'a': 1}},
+                           {'header': {'version': 6}, 'v': {'b': 2}}]
+
+    def test_non_dict(self):
+        with pytest.raises(includehandler.IncludeException):
+            includehandler.merge_configs([{}, []])
+
 
 class TestIncludes:
     header = '''
@@ -473,3 +559,48 @@ v: {v3: z, v4: z}''')}
             assert index['v2'] < index['v1']
             assert index['v3'] < index['v1']
             assert index['v5'] < index['v1']
+
+    def test_shared_includes(self, monkeypatch):
+        # disable schema validation for this test:
+        monkeypatch.setattr(includehandler, 'CONFIGSCHEMA', {})
+        header = self.__class__.header
+        loaded = []
+        load = ConfigFile.load
+
+        def _load(filename, *args, **kwargs):
+            loaded.append(str(filename))
+            return load(filename, *args, **kwargs)
+
+        monkeypatch.setattr(ConfigFile, 'load', _load)
+        includes = [f'f{i}.yml' for i in range(50)]
+        data = {'x.yml': header.format(f'  includes: {includes}'),
+                os.path.abspath('base.yml'): header.format('''
+v: {a: base, b: base}''')}
+        for i in range(50):
+            data[os.path.abspath(f'f{i}.yml')] = header.format(f'''\
+  includes: ["base.yml"]
+v: {{a: f{i}{', b: f0' if i == 0 else ''}}}''')
+        with patch_open(includehandler, dictionary=data):
+            ginc = includehandler.IncludeHandler(['x.yml'])
+            config, _ = ginc.get_config()
+
+        assert loaded.count(os.path.abspath('base.yml')) == 1
+        assert len(loaded) == 52
+        # every occurrence of the include is still merged in order
+        assert len(ginc.config_files) == 101
+        assert config['v'] == {'a': 'f49', 'b': 'base'}
+
+    def test_circular_includes(self, monkeypatch):
+        # disable schema validation for this test:
+        monkeypatch.setattr(includehandler, 'CONFIGSCHEMA', {})
+        header = self.__class__.header
+        data = {'x.yml': header.format('  includes: ["y.yml"]'),
+                os.path.abspath('y.yml'):
+                header.format('  includes: ["z.yml"]'),
+                os.path.abspath('z.yml'):
+                header.format('  includes: ["y.yml"]')}
+        with patch_open(includehandler, dictionary=data):
+            ginc = includehandler.IncludeHandler(['x.yml'])
+            with pytest.raises(includehandler.IncludeException,
+                               match='Circular include detected'):
+                ginc.get_config()
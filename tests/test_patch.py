@@ -26,6 +26,7 @@ import shutil
 import pytest
 import subprocess
 from kas import kas
+from kas.repos import GitRepo, RepoImpl
 from kas.repos import PatchApplyError, PatchFileNotFound, PatchMappingError
 
 
@@ -141,3 +142,80 @@ def test_patch_dirty_repo(monkeykas, tmpdir, mercurial):
     assert not (kas_branch_dir / 'tests/test_patch/hello.sh').exists()
     # the clean repo must be patched
     assert (monkeykas.get_kwd() / 'hello-branch/hello.sh').exists()
+
+
+def test_patch_series(monkeykas, upstream, project, git):
+    """
+        Test that a patch series results in the same commits when it is
+        applied in a temporary index and in the worktree
+    """
+    upstream = upstream(files={'hello': 'hello\n'})
+
+    patches = project.path / 'patches'
+    patches.mkdir()
+    # first patch with a date header, the second one without
+    (upstream / 'hello').write_text('hello\nworld\n', encoding='utf-8')
+    (upstream / 'new').write_text('new\n', encoding='utf-8')
+    git('add', '-A', cwd=upstream)
+    git('commit', '-q', '-m', 'first', cwd=upstream)
+    git('format-patch', '-q', '-1', '-o', str(patches), cwd=upstream)
+    (upstream / 'hello').write_text('hello\nworld\n!\n', encoding='utf-8')
+    (patches / 'second.patch').write_text(subprocess.check_output(
+        ['git', 'diff'], cwd=upstream, text=True), encoding='utf-8')
+    git('reset', '-q', '--hard', 'HEAD~1', cwd=upstream)
+    (patches / 'series').write_text(
+        '0001-first.patch\nsecond.patch\n', encoding='utf-8')
+    project.write_config({'upstream': {
+        'url': f'file://{upstream}', 'branch': 'main',
+        'patches': {'series': {'repo': 'this', 'path': 'patches'}}}})
+    workrepo = monkeykas.get_kwd() / 'upstream'
+
+    kas.kas(['checkout', 'test.yml'])
+    head = git_get_commit(workrepo)
+    assert (workrepo / 'hello').read_text() == 'hello\nworld\n!\n'
+    assert (workrepo / 'new').read_text() == 'new\n'
+    assert not subprocess.check_output(['git', 'status', '--porcelain'],
+                                       cwd=workrepo)
+
+    # the failing patch is reported, the worktree is left unchanged
+    series = (patches / 'series').read_text()
+    (patches / 'series').write_text('second.patch\n', encoding='utf-8')
+    shutil.rmtree(workrepo)
+    with pytest.raises(PatchApplyError, match='second.patch'):
+        kas.kas(['checkout', 'test.yml'])
+    assert (workrepo / 'hello').read_text() == 'hello\n'
+    (patches / 'series').write_text(series, encoding='utf-8')
+
+    monkeykas.setattr(GitRepo, '_apply_patch_series_async',
+                      RepoImpl._apply_patch_series_async)
+    shutil.rmtree(workrepo)
+    kas.kas(['checkout', 'test.yml'])
+    assert git_get_commit(workrepo) == head
+
+
+def test_patch_commit_hooks(monkeykas, upstream, project):
+    """
+        Test that the commit hooks of a repository are run when the patches
+        are committed and that such commits are not cached
+    """
+    upstream = upstream(files={'hello': 'hello\n'})
+    shutil.copy(os.path.join(os.path.dirname(__file__),
+                             'test_state/patches/hello.patch'), project.path)
+    project.write_config({'upstream': {
+        'url': f'file://{upstream}', 'branch': 'main',
+        'patches': {'hello': {'repo': 'this', 'path': 'hello.patch'}}}})
+    refdir = project.use_ref_dir()
+    workrepo = monkeykas.get_kwd() / 'upstream'
+
+    kas.kas(['checkout', '--skip', 'repos_apply_patches', 'test.yml'])
+    hook = workrepo / '.git/hooks/commit-msg'
+    hook.write_text('#!/bin/sh\necho "Hooked-by: commit-msg" >> "$1"\n')
+    hook.chmod(0o755)
+    kas.kas(['checkout', 'test.yml'])
+    assert (workrepo / 'hello').read_text() == 'hello\npatched\n'
+    msg = subprocess.check_output(['git', 'log', '-1', '--format=%B'],
+                                  cwd=workrepo, text=True)
+    assert 'Hooked-by: commit-msg' in msg
+    (mirror,) = refdir.glob('*upstream')
+    assert not subprocess.check_output(
+        ['git', 'for-each-ref', 'refs/kas/patched'], cwd=mirror)
@@ -0,0 +1,659 @@
+# kas - setup tool for bitbake based projects
+#
+# Copyright (c) Siemens AG, 2025
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import asyncio
+import fcntl
+import os
+import shutil
+import subprocess
+import sys
+import pytest
+from pathlib import Path
+from kas import context
+from kas import kas
+from kas.includehandler import IncludeHandler
+from kas.kasusererror import KasUserError
+from kas.libkas import LockTimeoutError, get_batch_cmd, close_batch_cmds
+from kas.libkas import file_lock
+from kas.repos import GitRepo, Repo
+
+
+@pytest.fixture
+def layouts(tmpdir, monkeypatch, git):
+    context.create_global_context(None)
+    base = os.path.realpath(str(tmpdir))
+    for name in ['sub', 'super']:
+        os.makedirs(os.path.join(base, name, 'dir'))
+        git('init', '-q', cwd=os.path.join(base, name))
+        open(os.path.join(base, name, 'dir', 'file'), 'w').close()
+        git('add', '-A', cwd=os.path.join(base, name))
+        git('commit', '-q', '-m', 'initial', cwd=os.path.join(base, name))
+    sup = os.path.join(base, 'super')
+    git('submodule', '-q', 'add', '../sub', 'modules/sub', cwd=sup)
+    git('commit', '-q', '-m', 'submodule', cwd=sup)
+    git('worktree', 'add', '-q', '../worktree', cwd=sup)
+    git('init', '-q', 'nested', cwd=sup)
+    os.makedirs(os.path.join(base, 'plain', 'dir'))
+    os.symlink(os.path.join(sup, 'dir'), os.path.join(base, 'link'))
+    yield base
+    context.__context__ = None
+
+
+def test_root_path(layouts, monkeypatch):
+    base = layouts
+    expected = {
+        'sub/dir': 'sub',
+        'super': 'super',
+        'super/dir': 'super',
+        'super/modules/sub': 'super',
+        'super/modules/sub/dir': 'super',
+        'worktree/dir': 'worktree',
+        'link': 'super',
+    }
+    commands = []
+    get_root_path_cmd = Repo._get_root_path_cmd
+
+    def _get_root_path_cmd(path):
+        commands.append(path)
+        return get_root_path_cmd(path)
+
+    monkeypatch.setattr(Repo, '_get_root_path_cmd', _get_root_path_cmd)
+    for (path, root) in expected.items():
+        path = os.path.join(base, path)
+        assert Repo.get_root_path(path) == os.path.join(base, root)
+        assert get_root_path_cmd(path) == os.path.join(base, root)
+    assert commands == []
+
+    # a nested repo that is not a submodule is resolved by git
+    path = os.path.join(base, 'super', 'nested')
+    assert Repo.get_root_path(path) == path
+    assert commands == [path]
+    Repo.get_root_path(path)
+    assert commands == [path]
+
+    path = os.path.join(base, 'plain', 'dir')
+    if get_root_path_cmd(path) is None:
+        assert Repo.get_root_path(path) == path
+        assert Repo.get_root_path(path, fallback=False) is None
+
+
+def git_output(*args, cwd):
+    return subprocess.check_output(['git', *args], cwd=cwd).decode().strip()
+
+
+def test_ref_repo_update(monkeykas, upstream, project, git):
+    upstream = upstream()
+    project.write_config({'upstream': {'url': f'file://{upstream}',
+                                       'branch': 'main'}})
+    refdir = project.use_ref_dir()
+    workrepo = monkeykas.get_kwd() / 'upstream'
+
+    kas.kas(['checkout', 'test.yml'])
+    (mirror,) = refdir.glob('*upstream')
+    objects = git_output('count-objects', '-v', cwd=workrepo)
+    git('commit', '-q', '--allow-empty', '-m', 'update', cwd=upstream)
+    head = git_output('rev-parse', 'HEAD', cwd=upstream)
+
+    # a recently updated reference repo is used as is
+    monkeykas.setenv('KAS_REPO_REF_MAX_AGE', '3600')
+    kas.kas(['checkout', '--update', 'test.yml'])
+    assert git_output('rev-parse', 'HEAD', cwd=workrepo) != head
+
+    # otherwise, it is updated and the work repo is fetched from it
+    monkeykas.setenv('KAS_REPO_REF_MAX_AGE', '0')
+    kas.kas(['checkout', '--update', 'test.yml'])
+    assert git_output('rev-parse', 'main', cwd=mirror) == head
+    assert git_output('rev-parse', 'HEAD', cwd=workrepo) == head
+    # all objects are taken from the reference repo
+    assert git_output('count-objects', '-v', cwd=workrepo) == objects
+
+
+def test_ref_repo_patch_cache(monkeykas, upstream, project):
+    upstream = upstream(files={'hello': 'hello\n'})
+    diff = (Path(__file__).parent / 'test_state/patches/hello.patch')
+    patch = project.path / 'patches/hello.patch'
+    patch.parent.mkdir()
+    patch.write_text('From: kas <kas@example.com>\n'
+                     'Subject: [PATCH] hello\n'
+                     'Date: Mon, 1 Jan 2024 00:00:00 +0000\n\n'
+                     '---\n' + diff.read_text())
+    project.write_config({'upstream': {
+        'url': f'file://{upstream}', 'branch': 'main',
+        'patches': {'hello': {'repo': 'this',
+                              'path': 'patches/hello.patch'}}}})
+    refdir = project.use_ref_dir()
+    workrepo = monkeykas.get_kwd() / 'upstream'
+
+    applied = []
+    apply_patch_series_async = GitRepo._apply_patch_series_async
+
+    async def _apply_patch_series_async(self, patches, cached=False):
+        applied.append(self.name)
+        return await apply_patch_series_async(self, patches, cached)
+
+    monkeykas.setattr(GitRepo, '_apply_patch_series_async',
+                      _apply_patch_series_async)
+
+    kas.kas(['checkout', 'test.yml'])
+    assert applied == ['upstream']
+    head = git_output('rev-parse', 'HEAD', cwd=workrepo)
+    (mirror,) = refdir.glob('*upstream')
+    (cache_ref,) = git_output('for-each-ref', '--format=%(refname)',
+                              'refs/kas/patched', cwd=mirror).split()
+    assert git_output('rev-parse', cache_ref, cwd=mirror) == head
+    # the commit does not depend on the location of the workspace
+    assert git_output('log', '-1', '--format=%B', cwd=workrepo) == \
+        'kas: hello\n\npatch patches/hello.patch applied by kas'
+
+    # a fresh workspace takes the patched revision from the cache
+    shutil.rmtree(workrepo)
+    kas.kas(['checkout', 'test.yml'])
+    assert applied == ['upstream']
+    assert git_output('rev-parse', 'HEAD', cwd=workrepo) == head
+    assert (workrepo / 'hello').read_text() == 'hello\npatched\n'
+    assert not git_output('status', '--porcelain', cwd=workrepo)
+
+    # so does a workspace in another directory with fresh patch files
+    other = Path(project.tmpdir / 'other')
+    other.mkdir()
+    for name in ['test.yml', 'oe-init-build-env', 'patches/hello.patch']:
+        (other / name).parent.mkdir(exist_ok=True)
+        shutil.copy(project.path / name, other / name)
+    os.utime(other / 'patches/hello.patch', (0, 0))
+    monkeykas.chdir(other)
+    kas.kas(['checkout', 'test.yml'])
+    assert applied == ['upstream']
+    assert git_output('rev-parse', 'HEAD', cwd=other / 'upstream') == head
+    monkeykas.chdir(project.path)
+
+    # a changed patch is applied again
+    patch.write_text(patch.read_text().replace('@@ -1 +1,2 @@',
+                                               '@@ -1 +1,3 @@') + '+again\n')
+    shutil.rmtree(workrepo)
+    kas.kas(['checkout', 'test.yml'])
+    assert applied == ['upstream', 'upstream']
+    assert (workrepo / 'hello').read_text() == 'hello\npatched\nagain\n'
+    assert len(git_output('for-each-ref', 'refs/kas/patched',
+                          cwd=mirror).splitlines()) == 2
+
+    # patches without a date are committed as usual, but not cached
+    patch.write_text(diff.read_text())
+    for i in range(2):
+        shutil.rmtree(workrepo)
+        kas.kas(['checkout', 'test.yml'])
+    assert applied == ['upstream'] * 4
+    assert git_output('log', '-1', '--format=%B', cwd=workrepo) == \
+        f'kas: hello\n\npatch {patch} applied by kas'
+    assert len(git_output('for-each-ref', 'refs/kas/patched',
+                          cwd=mirror).splitlines()) == 2
+
+
+def test_ref_repo_concurrent_clone(monkeykas, tmpdir, project, git):
+    upstream = Path(tmpdir / 'upstream.git')
+    git('init', '-q', '--bare', '-b', 'main', str(upstream), cwd=tmpdir)
+    src = Path(tmpdir / 'src')
+    git('clone', '-q', str(upstream), str(src), cwd=tmpdir)
+    git('commit', '-q', '--allow-empty', '-m', 'initial', cwd=src)
+    git('push', '-q', 'origin', 'HEAD:main', cwd=src)
+    head = git_output('rev-parse', 'HEAD', cwd=src)
+    project.write_config({'upstream': {'url': f'file://{upstream}',
+                                       'branch': 'main'}})
+    refdir = project.use_ref_dir()
+    mirror = refdir / str(upstream).replace('/', '.')
+
+    # leftover of an instance that was killed while cloning
+    stale = refdir / f'.{mirror.name}.tmp-stale'
+    (stale / 'objects').mkdir(parents=True)
+
+    procs = []
+    for i in range(6):
+        env = dict(os.environ, KAS_WORK_DIR=str(tmpdir / f'work{i}'))
+        os.mkdir(env['KAS_WORK_DIR'])
+        procs.append(subprocess.Popen(
+            [sys.executable, '-m', 'kas', '-l', 'debug', 'checkout',
+             'test.yml'], cwd=project.path, env=env, stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT, text=True))
+    outputs = [p.communicate()[0] for p in procs]
+    assert [p.returncode for p in procs] == [0] * 6, outputs
+
+    # the reference repo was cloned once and used by all instances
+    assert sum('Created repo ref' in out for out in outputs) == 1
+    assert mirror.is_dir()
+    assert not any('.tmp-' in p.name for p in refdir.iterdir())
+    for i in range(6):
+        workrepo = Path(tmpdir / f'work{i}' / 'upstream')
+        assert git_output('rev-parse', 'HEAD', cwd=workrepo) == head
+        alternates = workrepo / '.git/objects/info/alternates'
+        assert alternates.read_text().strip() == str(mirror / 'objects')
+
+
+def test_ref_repo_lock_timeout(monkeykas, upstream, project):
+    upstream = upstream()
+    project.write_config({'upstream': {'url': f'file://{upstream}',
+                                       'branch': 'main'}})
+    refdir = project.use_ref_dir()
+    monkeykas.setenv('KAS_REF_LOCK_TIMEOUT', '1')
+    mirror = refdir / str(upstream).replace('/', '.')
+
+    # another instance holds the lock while creating the reference repo
+    with open(f'{mirror}.lock', 'w') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        with pytest.raises(LockTimeoutError):
+            kas.kas(['checkout', 'test.yml'])
+    assert not mirror.exists()
+
+    # a lock of an exited holder does not block
+    kas.kas(['checkout', 'test.yml'])
+    assert mirror.exists()
+
+    # the lock file is removed together with the reference repo
+    kas.kas(['purge', 'test.yml'])
+    assert not mirror.exists()
+    assert not Path(f'{mirror}.lock').exists()
+
+
+def test_file_lock_removed(tmpdir):
+    path = str(tmpdir / 'lock')
+    events = []
+
+    async def holder():
+        async with file_lock(path):
+            await asyncio.sleep(0.2)
+            os.remove(path)
+            events.append('removed')
+
+    async def waiter(name, delay):
+        await asyncio.sleep(delay)
+        async with file_lock(path, poll_interval=0.01):
+            events.append(f'{name} locked')
+            await asyncio.sleep(0.1)
+            events.append(f'{name} unlocked')
+
+    async def run():
+        # a waits for the removed file, b opens the new one
+        await asyncio.gather(holder(), waiter('a', 0.1), waiter('b', 0.25))
+
+    asyncio.run(run())
+    assert events[0] == 'removed'
+    assert events[1].split()[1] == 'locked'
+    assert events[2].split()[1] == 'unlocked'
+
+
+def count_blobs(repo):
+    objects = subprocess.check_output(
+        ['git', 'cat-file', '--batch-all-objects', '--batch-check'],
+        cwd=repo, env=dict(os.environ, GIT_NO_LAZY_FETCH='1')).decode()
+    return sum(line.split()[1] == 'blob' for line in objects.splitlines())
+
+
+def test_partial_clone(monkeykas, upstream, project, git):
+    upstream = upstream(files={'file0': '0\n'})
+    git('config', 'uploadpack.allowFilter', 'true', cwd=upstream)
+    for i in range(1, 3):
+        (upstream / f'file{i}').write_text(f'{i}\n')
+        git('add', '-A', cwd=upstream)
+        git('commit', '-q', '-m', f'commit {i}', cwd=upstream)
+    project.write_config({'upstream': {'url': f'file://{upstream}',
+                                       'branch': 'main'}})
+    workrepo = monkeykas.get_kwd() / 'upstream'
+
+    monkeykas.setenv('KAS_CLONE_FILTER', 'invalid')
+    with pytest.raises(KasUserError):
+        kas.kas(['checkout', 'test.yml'])
+
+    # reference repo and work repo are partial clones
+    monkeykas.setenv('KAS_CLONE_FILTER', 'blob:none')
+    refdir = project.use_ref_dir()
+    kas.kas(['checkout', 'test.yml'])
+    (mirror,) = refdir.glob('*upstream')
+    assert count_blobs(mirror) == 0
+    assert git_output('config', 'remote.origin.partialclonefilter',
+                      cwd=workrepo) == 'blob:none'
+    # the full history is available, blobs are fetched on checkout
+    assert git_output('rev-list', '--count', 'HEAD', cwd=workrepo) == '3'
+    assert (workrepo / 'file2').read_text() == '2\n'
+
+    # new commits are fetched into the reference repo without blobs
+    (upstream / 'file3').write_text('3\n')
+    git('add', '-A', cwd=upstream)
+    git('commit', '-q', '-m', 'commit 3', cwd=upstream)
+    kas.kas(['checkout', '--update', 'test.yml'])
+    assert count_blobs(mirror) == 0
+    assert (workrepo / 'file3').read_text() == '3\n'
+
+    # the command line option takes precedence
+    shutil.rmtree(workrepo)
+    monkeykas.delenv('KAS_REPO_REF_DIR')
+    kas.kas(['checkout', '--clone-filter', 'tree:0', 'test.yml'])
+    assert git_output('config', 'remote.origin.partialclonefilter',
+                      cwd=workrepo) == 'tree:0'
+    assert git_output('rev-list', '--count', 'HEAD', cwd=workrepo) == '4'
+    assert (workrepo / 'file3').read_text() == '3\n'
+
+
+def test_sparse_checkout(monkeykas, upstream, project):
+    files = {path: f'{path}\n' for path in [
+        'README', 'meta-a/conf/layer.conf', 'meta-b/conf/layer.conf',
+        'meta-c/recipes/file', 'docs/manual']}
+    files['kas/machine.yml'] = 'header:\n  version: 14\nmachine: sparse\n'
+    bsp = upstream('bsp', files)
+    (project.path / 'fix.patch').write_text("""\
+diff --git a/meta-c/recipes/file b/meta-c/recipes/file
+--- a/meta-c/recipes/file
++++ b/meta-c/recipes/file
+@@ -1 +1,2 @@
+ meta-c/recipes/file
++patched
+""")
+    project.write_config({'bsp': {
+        'url': f'file://{bsp}', 'branch': 'main',
+        'layers': {'meta-a': None, 'meta-b': None},
+        'patches': {'fix': {'repo': 'this', 'path': 'fix.patch'}}}},
+        includes=[{'repo': 'bsp', 'file': 'kas/machine.yml'}])
+    workrepo = monkeykas.get_kwd() / 'bsp'
+
+    def checked_out():
+        return sorted(p.name for p in workrepo.iterdir() if p.name != '.git')
+
+    # only the layers, the include file and the patched files are used
+    monkeykas.setenv('KAS_SPARSE_CHECKOUT', '1')
+    kas.kas(['checkout', '--skip', 'repos_apply_patches', 'test.yml'])
+    assert checked_out() == ['README', 'kas', 'meta-a', 'meta-b']
+    kas.kas(['checkout', 'test.yml'])
+    assert checked_out() == ['README', 'kas', 'meta-a', 'meta-b', 'meta-c']
+    assert (workrepo / 'meta-c/recipes/file').read_text() == \
+        'meta-c/recipes/file\npatched\n'
+    assert not git_output('status', '--porcelain', cwd=workrepo)
+
+    # the whole repo is checked out again if disabled
+    monkeykas.delenv('KAS_SPARSE_CHECKOUT')
+    kas.kas(['checkout', 'test.yml'])
+    assert checked_out() == ['README', 'docs', 'kas', 'meta-a', 'meta-b',
+                             'meta-c']
+
+
+def test_repo_include_from_objects(monkeykas, upstream, project, capsys):
+    bsp = upstream('bsp', {
+        'kas/machine.yml': 'header:\n  version: 14\n  includes:\n'
+                           '    - common.yml\nmachine: upstream\n',
+        'kas/common.yml': 'header:\n  version: 14\ndistro: upstream\n'})
+    project.write_config({'bsp': {'url': f'file://{bsp}', 'branch': 'main'}},
+                         includes=[{'repo': 'bsp', 'file': 'kas/machine.yml'}])
+    workrepo = monkeykas.get_kwd() / 'bsp'
+
+    events = []
+    checkout_async = GitRepo.checkout_async
+    get_config = IncludeHandler.get_config
+
+    async def _checkout_async(self, sparse=True):
+        events.append(f'checkout {self.name}')
+        return await checkout_async(self, sparse)
+
+    def _get_config(self, repos=None, readers=None):
+        events.append('includes')
+        return get_config(self, repos, readers)
+
+    monkeykas.setattr(GitRepo, 'checkout_async', _checkout_async)
+    monkeykas.setattr(IncludeHandler, 'get_config', _get_config)
+
+    def dump():
+        capsys.readouterr()
+        kas.kas(['dump', 'test.yml'])
+        return capsys.readouterr().out
+
+    # the includes are resolved before the repo is checked out
+    config = dump()
+    assert 'machine: upstream' in config
+    assert 'distro: upstream' in config
+    assert events[-1] == 'checkout bsp'
+    assert events.count('checkout bsp') == 1
+    assert not git_output('status', '--porcelain', cwd=workrepo)
+
+    # local changes of a checked out repo are used
+    (workrepo / 'kas/common.yml').write_text('header:\n  version: 14\n'
+                                             'distro: local\n')
+    assert 'distro: local' in dump()
+
+
+def test_fetch_once(monkeykas, upstream, project):
+    bsp = upstream('bsp', {'machine.yml': 'header:\n  version: 14\n'})
+    project.write_config({'bsp': {'url': f'file://{bsp}', 'branch': 'main'}},
+                         includes=[{'repo': 'bsp', 'file': 'machine.yml'}])
+
+    fetches = []
+    set_remote_url_cmd = GitRepo.set_remote_url_cmd
+
+    def _set_remote_url_cmd(self):
+        fetches.append(self.name)
+        return set_remote_url_cmd(self)
+
+    monkeykas.setattr(GitRepo, 'set_remote_url_cmd', _set_remote_url_cmd)
+
+    # the repo is fetched by the setup loop, but not again afterwards
+    kas.kas(['checkout', 'test.yml'])
+    assert fetches == ['bsp']
+    kas.kas(['checkout', '--update', 'test.yml'])
+    assert fetches == ['bsp', 'bsp']
+
+
+def test_object_queries(monkeykas, upstream, project, git):
+    upstream = upstream()
+    git('checkout', '-q', '-b', 'other', cwd=upstream)
+    git('commit', '-q', '--allow-empty', '-m', 'other', cwd=upstream)
+    commits = {b: git_output('rev-parse', b, cwd=upstream)
+               for b in ['main', 'other']}
+
+    def write_config(commit):
+        project.write_config({'upstream': {
+            'url': f'file://{upstream}', 'branch': 'main', 'commit': commit}})
+
+    cmds = []
+    create_subprocess_exec = asyncio.create_subprocess_exec
+
+    def _create_subprocess_exec(*args, **kwargs):
+        cmds.append(list(args))
+        return create_subprocess_exec(*args, **kwargs)
+
+    monkeykas.setattr(asyncio, 'create_subprocess_exec',
+                      _create_subprocess_exec)
+
+    # the existing clone is queried by one cat-file process
+    write_config(commits['main'])
+    kas.kas(['checkout', 'test.yml'])
+    cmds.clear()
+    kas.kas(['checkout', '--force-checkout', 'test.yml'])
+    assert cmds.count(['git', 'cat-file', '--batch-check']) == 1
+    assert ['git', 'merge-base', '--is-ancestor', commits['main'],
+            'origin/main'] in cmds
+    assert not any(c[:2] == ['git', 'branch'] for c in cmds)
+
+    # the commit is known, but not part of the branch
+    write_config(commits['other'])
+    with pytest.raises(KasUserError, match='does not contain commit'):
+        kas.kas(['checkout', 'test.yml'])
+
+
+def test_parallel_checkout(monkeykas, upstream, project, git):
+    commits = {}
+    for name in ['a', 'b']:
+        repo = upstream(name)
+        git('checkout', '-q', '-b', 'other', cwd=repo)
+        git('commit', '-q', '--allow-empty', '-m', 'other', cwd=repo)
+        commits[name] = git_output('rev-parse', 'HEAD', cwd=repo)
+
+    def write_config(branch_a):
+        project.write_config({
+            'a': {'url': f'file://{project.tmpdir}/a', 'branch': branch_a,
+                  'commit': commits['a']},
+            'b': {'url': f'file://{project.tmpdir}/b', 'branch': 'other'}})
+
+    started = []
+    cancelled = []
+    block = []
+    checkout_async = GitRepo.checkout_async
+
+    async def wait_for(name):
+        for _ in range(500):
+            if name in started:
+                return
+            await asyncio.sleep(0.01)
+        raise AssertionError(f'checkout of {name} not started')
+
+    async def _checkout_async(self, sparse=True):
+        started.append(self.name)
+        try:
+            # a and b are checked out concurrently
+            if self.name in ['a', 'b']:
+                await wait_for('b' if self.name == 'a' else 'a')
+            if self.name in block:
+                await asyncio.sleep(60)
+            return await checkout_async(self, sparse)
+        except asyncio.CancelledError:
+            cancelled.append(self.name)
+            raise
+
+    monkeykas.setattr(GitRepo, 'checkout_async', _checkout_async)
+
+    write_config('other')
+    kas.kas(['checkout', 'test.yml'])
+    assert sorted(started) == ['a', 'b', 'this']
+    for name in ['a', 'b']:
+        assert git_output('rev-parse', 'HEAD',
+                          cwd=monkeykas.get_kwd() / name) == commits[name]
+
+    # the failing checkout cancels the remaining ones
+    write_config('main')
+    started.clear()
+    block.append('b')
+    with pytest.raises(KasUserError, match='does not contain commit'):
+        kas.kas(['checkout', '--force-checkout', 'test.yml'])
+    assert cancelled == ['b']
+
+
+def test_batch_cmd_cancel(upstream):
+    repo = upstream()
+    head = git_output('rev-parse', 'HEAD', cwd=repo)
+    context.create_global_context(None)
+
+    async def run():
+        batch_cmd = get_batch_cmd(['git', 'cat-file', '--batch-check'],
+                                  str(repo))
+        answer = await batch_cmd.query('HEAD')
+        assert answer.split()[:2] == [head, 'commit']
+        assert await batch_cmd.query('missing') == 'missing missing'
+        process = batch_cmd._process
+        # a waiting query is interrupted and the process is terminated
+        waiting = get_batch_cmd(['sleep', '60'], str(repo))
+        task = asyncio.ensure_future(waiting.query('HEAD'))
+        await asyncio.sleep(0.1)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert waiting._process is None
+        # the remaining processes are closed
+        await close_batch_cmds()
+        assert process.returncode == 0
+        assert not context.get_context().batch_cmds
+
+    try:
+        asyncio.run(run())
+    finally:
+        context.__context__ = None
+
+
+def test_minimal_clone(monkeykas, upstream, project, git):
+    upstream = upstream()
+    git('tag', 'v1', cwd=upstream)
+    git('commit', '-q', '--allow-empty', '-m', 'main', cwd=upstream)
+    git('checkout', '-q', '-b', 'other', cwd=upstream)
+    git('commit', '-q', '--allow-empty', '-m', 'other', cwd=upstream)
+    commit = git_output('rev-parse', 'other', cwd=upstream)
+    git('checkout', '-q', 'main', cwd=upstream)
+    url = f'file://{upstream}'
+    project.write_config({'branch': {'url': url, 'branch': 'main'},
+                          'tag': {'url': url, 'tag': 'v1'},
+                          'commit': {'url': url, 'commit': commit}})
+    monkeykas.setenv('KAS_CLONE_MINIMAL', '1')
+    kas_wd = monkeykas.get_kwd()
+
+    def refs(path):
+        return [ref for (_, ref) in
+                (line.split() for line in
+                 git_output('show-ref', cwd=path).splitlines())
+                if not ref.endswith('/HEAD')]
+
+    # only the refs of the requested revisions are fetched
+    kas.kas(['checkout', 'test.yml'])
+    assert refs(kas_wd / 'branch') == ['refs/heads/main',
+                                       'refs/remotes/origin/main']
+    assert refs(kas_wd / 'tag') == ['refs/tags/v1']
+    assert 'refs/remotes/origin/other' not in refs(kas_wd / 'commit')
+    assert git_output('rev-parse', 'HEAD', cwd=kas_wd / 'commit') == commit
+
+    # commits are kept in the reference repo by a ref
+    refdir = project.use_ref_dir()
+    shutil.rmtree(kas_wd / 'commit')
+    kas.kas(['checkout', 'test.yml'])
+    (mirror,) = refdir.glob('*upstream')
+    assert f'refs/kas/commits/{commit}' in refs(mirror)
+    assert 'refs/tags/v1' not in refs(mirror)
+    assert git_output('rev-parse', 'HEAD', cwd=kas_wd / 'commit') == commit
+
+    # the branches are fetched if the server refuses to fetch by SHA
+    fetch_cmd = GitRepo.fetch_cmd
+
+    def _fetch_cmd(self):
+        cmd = fetch_cmd(self)
+        return cmd[:-1] + ['0' * 40] if cmd[-1] == commit else cmd
+
+    monkeykas.setattr(GitRepo, 'fetch_cmd', _fetch_cmd)
+    monkeykas.delenv('KAS_REPO_REF_DIR')
+    shutil.rmtree(kas_wd / 'commit')
+    kas.kas(['checkout', 'test.yml'])
+    assert 'refs/remotes/origin/other' in refs(kas_wd / 'commit')
+    assert git_output('rev-parse', 'HEAD', cwd=kas_wd / 'commit') == commit
+
+
+def test_ref_repo_shared(monkeykas, tmpdir, upstream, project, git):
+    upstream = upstream()
+    project.write_config({'upstream': {'url': f'file://{upstream}',
+                                       'branch': 'main'}})
+    refdir = project.use_ref_dir()
+    monkeykas.setenv('KAS_REPO_REF_SHARED', '1')
+    workrepo = monkeykas.get_kwd() / 'upstream'
+    alternates = workrepo / '.git/objects/info/alternates'
+
+    # no objects are copied into the work repo
+    kas.kas(['checkout', 'test.yml'])
+    (mirror,) = refdir.glob('*upstream')
+    assert git_output('count-objects', cwd=workrepo).startswith('0 objects')
+    assert not list((workrepo / '.git/objects/pack').iterdir())
+    assert alternates.read_text() == f'{mirror}/objects\n'
+    assert git_output('config', 'gc.pruneExpire', cwd=mirror) == 'never'
+
+    # the work repo follows a relocated reference repo
+    newrefdir = Path(tmpdir / 'newrefs')
+    refdir.rename(newrefdir)
+    monkeykas.setenv('KAS_REPO_REF_DIR', str(newrefdir))
+    kas.kas(['checkout', 'test.yml'])
+    assert alternates.read_text() == f'{newrefdir / mirror.name}/objects\n'
+    git('fsck', cwd=workrepo)
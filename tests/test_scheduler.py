@@ -0,0 +1,197 @@
+# kas - setup tool for bitbake based projects
+#
+# Copyright (c) Siemens AG, 2025
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import asyncio
+import json
+import pytest
+from kas.scheduler import Scheduler, TaskGraph, get_url_host
+
+
+class FakeRepo:
+    def __init__(self, name, url, duration=0.0):
+        self.name = name
+        self.url = url
+        self.effective_url = url
+        self.qualified_name = name + '.git'
+        self.duration = duration
+
+
+def run_jobs(scheduler, repos, trace):
+    async def _job(repo):
+        trace.append(('start', repo.name))
+        await asyncio.sleep(repo.duration)
+        trace.append(('end', repo.name))
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        start = loop.time()
+        # submitted in the order of the recorded durations, like the fetches
+        tasks = [asyncio.ensure_future(
+                 scheduler.run(repo, lambda r=repo: _job(r)))
+                 for repo in scheduler.order(repos)]
+        loop.run_until_complete(asyncio.gather(*tasks))
+        return loop.time() - start
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+def max_concurrency(trace, names=None):
+    running = 0
+    peak = 0
+    for event, name in trace:
+        if names and name not in names:
+            continue
+        running += 1 if event == 'start' else -1
+        peak = max(peak, running)
+    return peak
+
+
+@pytest.mark.parametrize('url,host', [
+    ('https://github.com/siemens/kas.git', 'github.com'),
+    ('ssh://git@example.com:2222/kas.git', 'example.com'),
+    ('git@example.com:siemens/kas.git', 'example.com'),
+    ('/srv/git/kas.git', ''),
+    ('file:///srv/git/kas.git', ''),
+    (None, ''),
+])
+def test_url_host(url, host):
+    assert get_url_host(url) == host
+
+
+def test_job_limits():
+    repos = [FakeRepo(f'a{i}', f'https://a.org/{i}', 0.01) for i in range(8)]
+    repos += [FakeRepo(f'b{i}', f'https://b.org/{i}', 0.01) for i in range(8)]
+    trace = []
+    run_jobs(Scheduler(jobs=5, host_jobs=2), repos, trace)
+    assert len(trace) == 2 * len(repos)
+    assert max_concurrency(trace) <= 4
+    assert max_concurrency(trace, [r.name for r in repos[:8]]) == 2
+
+    trace = []
+    run_jobs(Scheduler(jobs=3, host_jobs=8), repos, trace)
+    assert max_concurrency(trace) == 3
+
+
+def test_longest_first(tmpdir):
+    """
+        Without history, the jobs run in the given order and the long job
+        at the end dominates the makespan. With the recorded durations of
+        the first run, the long job is started first.
+    """
+    stats = str(tmpdir / 'stats.json')
+    repos = [FakeRepo(f'r{i}', f'https://host/{i}', 0.05) for i in range(6)]
+    repos.append(FakeRepo('large', 'https://host/large', 0.3))
+
+    scheduler = Scheduler(jobs=2, stats_file=stats)
+    trace = []
+    cold = run_jobs(scheduler, repos, trace)
+    assert trace[0] == ('start', 'r0')
+    scheduler.save_stats()
+    with open(stats) as f:
+        assert json.load(f)['large.git'] >= 0.3
+
+    scheduler = Scheduler(jobs=2, stats_file=stats)
+    trace = []
+    warm = run_jobs(scheduler, repos, trace)
+    assert trace[0] == ('start', 'large')
+    # optimal: 0.3 on one slot, 6 x 0.05 on the other one
+    assert warm < cold
+    assert warm < 0.45
+
+
+def test_stats_decay(tmpdir):
+    stats = str(tmpdir / 'stats.json')
+    repo = FakeRepo('r', 'https://host/r')
+    scheduler = Scheduler(stats_file=stats)
+    scheduler.record(repo, 10.0)
+    scheduler.record(repo, 0.1)
+    assert scheduler.get_duration(repo) == 5.0
+    scheduler.record(repo, 7.0)
+    assert scheduler.get_duration(repo) == 7.0
+
+
+def run_graph(graph):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(graph.run())
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+def test_task_graph():
+    """
+        Each task starts as soon as its own dependencies are done, not
+        when all tasks of the previous step are done.
+    """
+    trace = []
+
+    def _step(name, duration):
+        async def _run():
+            trace.append(('start', name))
+            await asyncio.sleep(duration)
+            trace.append(('end', name))
+            return name
+        return _run
+
+    graph = TaskGraph()
+    graph.add(('fetch', 'a'), _step('fetch-a', 0.01))
+    graph.add(('fetch', 'b'), _step('fetch-b', 0.2))
+    graph.add(('checkout', 'a'), _step('checkout-a', 0.01), [('fetch', 'a')])
+    graph.add(('checkout', 'b'), _step('checkout-b', 0.01), [('fetch', 'b')])
+    graph.add(('patch', 'a'), _step('patch-a', 0.01),
+              [('checkout', 'a'), ('skipped', 'a')])
+    results = run_graph(graph)
+
+    assert results[('patch', 'a')] == 'patch-a'
+    assert trace.index(('end', 'patch-a')) < trace.index(('end', 'fetch-b'))
+    assert trace.index(('end', 'fetch-b')) < \
+        trace.index(('start', 'checkout-b'))
+
+
+def test_task_graph_error():
+    trace = []
+
+    async def _fail():
+        await asyncio.sleep(0.01)
+        raise ValueError('fetch failed')
+
+    async def _slow():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            trace.append('cancelled')
+            raise
+
+    async def _never():
+        trace.append('started')
+
+    graph = TaskGraph()
+    graph.add('fetch-a', _fail)
+    graph.add('fetch-b', _slow)
+    graph.add('checkout-a', _never, ['fetch-a'])
+    with pytest.raises(ValueError, match='fetch failed'):
+        run_graph(graph)
+    assert trace == ['cancelled']
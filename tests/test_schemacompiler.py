@@ -0,0 +1,99 @@
+# kas - setup tool for bitbake based projects
+#
+# Copyright (c) Siemens AG, 2025
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import copy
+import glob
+import pytest
+import yaml
+from jsonschema.validators import validator_for
+from kas.configschema import CONFIGSCHEMA
+from kas.schemacompiler import SchemaCompiler, get_validator
+
+REPLACEMENTS = [None, True, False, 0, 1, 1.0, 2.5, '', 'disabled', '0.10',
+                [], ['x'], {}, {'x': None}]
+
+
+def load_configs():
+    configs = []
+    for filename in sorted(glob.glob('tests/**/*.yml', recursive=True)):
+        with open(filename) as f:
+            config = yaml.safe_load(f)
+        if isinstance(config, dict) and 'header' in config:
+            configs.append(config)
+    return configs
+
+
+def mutations(node):
+    """
+        Yields variants of the document with a single leaf replaced or a
+        single unknown key added.
+    """
+    yield node
+    if isinstance(node, dict):
+        yield {**node, 'unknown_key': 'x'}
+        for key in node:
+            for value in REPLACEMENTS:
+                yield {**node, key: value}
+            for variant in mutations(node[key]):
+                yield {**node, key: variant}
+    elif isinstance(node, list):
+        for (i, item) in enumerate(node):
+            for variant in mutations(item):
+                yield node[:i] + [variant] + node[i + 1:]
+
+
+@pytest.fixture(scope='module')
+def reference():
+    validator = validator_for(CONFIGSCHEMA)(CONFIGSCHEMA)
+    return lambda doc: not any(validator.iter_errors(doc))
+
+
+def test_compiled_matches_jsonschema(reference):
+    check = SchemaCompiler(CONFIGSCHEMA).compile()
+    documents = 0
+    for config in load_configs():
+        for doc in mutations(copy.deepcopy(config)):
+            assert check(doc) == reference(doc), doc
+            documents += 1
+    assert documents > 1000
+
+
+@pytest.mark.parametrize('schema,doc,valid', [
+    ({'enum': [0, False]}, 0.0, True),
+    ({'enum': [0, False]}, False, True),
+    ({'enum': [0]}, False, False),
+    ({'type': 'integer'}, 3.0, True),
+    ({'type': 'integer'}, True, False),
+    ({'type': 'object', 'required': ['a']}, {}, False),
+    ({'additionalProperties': {'type': 'string'}}, {'a': 1}, False),
+])
+def test_compiled_semantics(reference, schema, doc, valid):
+    assert SchemaCompiler(schema).compile()(doc) == valid
+    assert (not any(get_validator(schema).iter_errors(doc))) == valid
+
+
+def test_unsupported_schema():
+    schema = {'type': 'object', 'patternProperties': {'^a': {}}}
+    validator = get_validator(schema)
+    assert validator.check is None
+    assert get_validator(schema) is validator
+    assert not any(validator.iter_errors({'a': 1}))
@@ -0,0 +1,238 @@
+# kas - setup tool for bitbake based projects
+#
+# Copyright (c) Siemens AG, 2025
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import shutil
+import subprocess
+import pytest
+from pathlib import Path
+from kas import kas
+from kas import libcmds
+from kas.kasusererror import KasUserError
+from kas.repos import GitRepo
+from kas.state import STATE_FILE
+
+
+@pytest.fixture
+def calls(monkeykas):
+    """
+        Counts the expensive setup operations.
+    """
+    counts = {'checkout': 0, 'source': 0}
+    checkout_async = GitRepo.checkout_async
+    source = libcmds.source_init_build_env
+
+    async def _checkout_async(self, sparse=True):
+        if not self.operations_disabled:
+            counts['checkout'] += 1
+        return await checkout_async(self, sparse)
+
+    def _source(build_system):
+        counts['source'] += 1
+        return source(build_system)
+
+    monkeykas.setattr(GitRepo, 'checkout_async', _checkout_async)
+    monkeykas.setattr(libcmds, 'source_init_build_env', _source)
+    return counts
+
+
+def test_state_fast_path(monkeykas, upstream, project, calls, git):
+    upstream = upstream(files={'hello': 'hello\n'})
+    shutil.copytree(Path(__file__).parent / 'test_state/patches',
+                    project.path / 'patches')
+    project.write_config({'upstream': {
+        'url': f'file://{upstream}', 'branch': 'main',
+        'patches': {'hello': {'repo': 'this',
+                              'path': 'patches/hello.patch'}}}})
+    kas_wd = monkeykas.get_kwd()
+    kas_bd = monkeykas.get_kbd()
+
+    kas.kas(['checkout', 'test.yml'])
+    assert os.path.exists(kas_bd / STATE_FILE)
+    assert (kas_wd / 'upstream/hello').read_text() == 'hello\npatched\n'
+    assert calls == {'checkout': 1, 'source': 1}
+
+    # nothing changed: no setup steps and no re-sourcing
+    kas.kas(['checkout', 'test.yml'])
+    assert calls == {'checkout': 1, 'source': 1}
+
+    # patch changed: patches are re-applied
+    os.utime(project.path / 'patches/hello.patch')
+    kas.kas(['checkout', 'test.yml'])
+    assert calls == {'checkout': 2, 'source': 2}
+    assert (kas_wd / 'upstream/hello').read_text() == 'hello\npatched\n'
+
+    # repo changed: checkout and patch again
+    git('reset', '-q', '--hard', 'HEAD~1', cwd=kas_wd / 'upstream')
+    kas.kas(['checkout', 'test.yml'])
+    assert calls == {'checkout': 3, 'source': 3}
+    assert (kas_wd / 'upstream/hello').read_text() == 'hello\npatched\n'
+
+    # the state is not used on update
+    kas.kas(['checkout', '--update', 'test.yml'])
+    assert calls == {'checkout': 4, 'source': 4}
+
+    # the state is not used nor stored if steps are skipped
+    kas.kas(['checkout', '--skip', 'repos_apply_patches', 'test.yml'])
+    assert calls == {'checkout': 5, 'source': 5}
+    assert (kas_wd / 'upstream/hello').read_text() == 'hello\n'
+    kas.kas(['checkout', 'test.yml'])
+    assert calls == {'checkout': 6, 'source': 6}
+    kas.kas(['checkout', 'test.yml'])
+    assert calls == {'checkout': 6, 'source': 6}
+
+
+def create_include_chain(upstream):
+    """
+        Creates the repos a and b, where a includes b. Returns the commits.
+    """
+    b = upstream('b', {'b.yml': 'header:\n  version: 14\n'})
+    a = upstream('a', {'a.yml': f"""\
+header:
+  version: 14
+  includes:
+    - repo: b
+      file: b.yml
+repos:
+  b:
+    url: file://{b}
+    branch: main
+"""})
+    return {name: subprocess.check_output(
+        ['git', 'rev-parse', 'HEAD'], cwd=path, text=True).strip()
+        for (name, path) in [('a', a), ('b', b)]}
+
+
+def test_lockfile_prefetch(monkeykas, upstream, project, git):
+    # repo b is only known once the include file of repo a is loaded
+    commits = create_include_chain(upstream)
+    for name in ['a', 'b']:
+        git('commit', '-q', '--allow-empty', '-m', 'update',
+            cwd=project.tmpdir / name)
+        commits[name] = [commits[name], subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=project.tmpdir / name,
+            text=True).strip()]
+    project.write_config({'a': {'url': f'file://{project.tmpdir}/a',
+                                'branch': 'main'}},
+                         includes=[{'repo': 'a', 'file': 'a.yml'}])
+
+    events = []
+    fetch_async = GitRepo.fetch_async
+    get_file_reader = GitRepo.get_file_reader
+
+    async def _fetch_async(self):
+        events.append(f'fetch {self.name}')
+        return await fetch_async(self)
+
+    def _get_file_reader(self):
+        events.append(f'read {self.name}')
+        return get_file_reader(self)
+
+    monkeykas.setattr(GitRepo, 'fetch_async', _fetch_async)
+    monkeykas.setattr(GitRepo, 'get_file_reader', _get_file_reader)
+
+    def checkout_locked(index):
+        (project.path / 'test.lock.yml').write_text(f"""\
+header:
+  version: 14
+overrides:
+  repos:
+    a:
+      commit: {commits['a'][index]}
+    b:
+      commit: {commits['b'][index]}
+""")
+        events.clear()
+        kas.kas(['checkout', 'test.yml'])
+
+    # without a previous run, repo b is fetched once the include file of
+    # repo a is read
+    checkout_locked(1)
+    assert events.index('fetch b') > events.index('read a')
+
+    # afterwards, both are fetched in the first wave
+    checkout_locked(0)
+    assert events.index('fetch b') < events.index('read a')
+    kas_wd = monkeykas.get_kwd()
+    for name in ['a', 'b']:
+        head = subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                       cwd=kas_wd / name, text=True).strip()
+        assert head == commits[name][0]
+
+
+def test_discovered_prefetch(monkeykas, upstream, project):
+    # repo b is only known once the include file of repo a is loaded
+    create_include_chain(upstream)
+    project.write_config({'a': {'url': f'file://{project.tmpdir}/a',
+                                'branch': 'main'}},
+                         includes=[{'repo': 'a', 'file': 'a.yml'}])
+    kas_wd = monkeykas.get_kwd()
+
+    events = []
+    fetch_async = GitRepo.fetch_async
+    get_file_reader = GitRepo.get_file_reader
+
+    async def _fetch_async(self):
+        events.append(f'fetch {self.name}')
+        return await fetch_async(self)
+
+    def _get_file_reader(self):
+        events.append(f'read {self.name}')
+        return get_file_reader(self)
+
+    monkeykas.setattr(GitRepo, 'fetch_async', _fetch_async)
+    monkeykas.setattr(GitRepo, 'get_file_reader', _get_file_reader)
+
+    # without a previous run, repo b is fetched once the include file of
+    # repo a is read
+    kas.kas(['checkout', 'test.yml'])
+    assert events.index('fetch b') > events.index('read a')
+
+    # afterwards, both are fetched in the first wave
+    shutil.rmtree(kas_wd / 'b')
+    events.clear()
+    kas.kas(['checkout', 'test.yml'])
+    assert events.index('fetch b') < events.index('read a')
+    assert (kas_wd / 'b' / 'b.yml').exists()
+
+    # a failed run does not wait for the queued speculative fetches
+    shutil.rmtree(kas_wd / 'b')
+    events.clear()
+    with monkeykas.context() as mp:
+        def _execute(self, ctx):
+            raise KasUserError('failed')
+
+        mp.setattr(libcmds.SetupReposStep, 'execute', _execute)
+        with pytest.raises(KasUserError):
+            kas.kas(['checkout', 'test.yml'])
+    assert 'fetch b' not in events
+
+    # repos that turn out to be unused are not fetched ahead of the used
+    # ones, even if only one fetch runs at a time
+    project.write_config({'a': {'url': f'file://{project.tmpdir}/a',
+                                'branch': 'main'}})
+    monkeykas.setenv('KAS_FETCH_JOBS', '1')
+    events.clear()
+    kas.kas(['checkout', 'test.yml'])
+    assert 'fetch a' in events
+    assert 'fetch b' not in events
+    assert not (kas_wd / 'b').exists()